@@ -4,9 +4,9 @@ from pathlib import Path
 from shutil import rmtree
 from typing import cast
 
+import click
 from flask import Flask, current_app
 from flask_login import LoginManager  # Fjernet kommentar
-from flask_bcrypt import Bcrypt  # Fjernet kommentar
 from flask_wtf.csrf import CSRFProtect  # Fjernet kommentar
 from flask_talisman import Talisman
 from flask_limiter import Limiter
@@ -14,12 +14,26 @@ from flask_limiter.util import get_remote_address
 
 from social_insecurity.config import Config
 from social_insecurity.database import SQLite3
+from social_insecurity.events import EventHub
+from social_insecurity.fragments import FragmentCache
+from social_insecurity.graph import FriendGraph
+from social_insecurity.images import ImagePipeline
 from social_insecurity.models import User  # Sørg for at du har en models.py med User-klassen
+from social_insecurity.passwords import PasswordHasher
+from social_insecurity.queries import QueryRegistry
+from social_insecurity.ratelimit import SQLiteStorage  # noqa: F401 - registers the sqlite:// rate limit storage
+from social_insecurity.writebehind import WriteBehind
 
 # Initialiser utvidelser
 sqlite = SQLite3()
+queries = QueryRegistry()
+friend_graph = FriendGraph()
 login = LoginManager()
-bcrypt = Bcrypt()
+passwords = PasswordHasher()
+images = ImagePipeline()
+fragments = FragmentCache()
+events = EventHub()
+writebehind = WriteBehind()
 csrf = CSRFProtect()
 limiter = Limiter(key_func=get_remote_address, default_limits=["50 per day", "20 per hour"])
 
@@ -33,14 +47,27 @@ def create_app(test_config=None) -> Flask:
     """Create and configure the Flask application."""
     app = Flask(__name__)
     app.config.from_object(Config)
-    if test_config:
+    if isinstance(test_config, dict):
+        app.config.from_mapping(test_config)
+    elif test_config:
         app.config.from_object(test_config)
 
     # Initialiser utvidelsene
     sqlite.init_app(app, schema="schema.sql")
+    queries.init_app(app, path="queries.sql")
+    friend_graph.init_app(app)
     login.init_app(app)
-    bcrypt.init_app(app)
+    passwords.init_app(app)
+    images.init_app(app)
+    fragments.init_app(app)
+    events.init_app(app)
+    writebehind.init_app(app)
     csrf.init_app(app)
+    # Share rate limit counters between worker processes through a database next to the app's own
+    if not app.config.get("RATELIMIT_STORAGE_URI"):
+        ratelimit_path = Path(app.instance_path) / app.config["RATELIMIT_DATABASE_PATH"]
+        ratelimit_path.parent.mkdir(parents=True, exist_ok=True)
+        app.config["RATELIMIT_STORAGE_URI"] = f"sqlite:///{ratelimit_path}"
     limiter.init_app(app)
 
     # Oppsett av Flask-Talisman for sikkerhetshoder
@@ -63,9 +90,122 @@ def create_app(test_config=None) -> Flask:
         instance_path = Path(current_app.instance_path)
         if instance_path.exists():
             rmtree(instance_path)
-    
+
+    @app.cli.command("seed")
+    @click.option("--users", default=1000, show_default=True, help="Number of users to add.")
+    @click.option("--posts", default=10.0, show_default=True, help="Average number of posts per user.")
+    @click.option("--comments", default=2.0, show_default=True, help="Average number of comments per post.")
+    @click.option("--friends", default=20, show_default=True, help="Average number of friends per user.")
+    @click.option("--password", default="Password123!", show_default=True, help="Password of every added user.")
+    @click.option("--seed", type=int, help="Seed of the random generator, for a reproducible dataset.")
+    def seed_command(users: int, posts: float, comments: float, friends: int, password: str, seed: int) -> None:
+        """Add synthetic users, a power-law friend graph, posts and comments, for load testing."""
+        from social_insecurity.dataset import generate
+
+        stats = generate(users, posts, comments, friends, password=password, seed=seed)
+        print(
+            f"Added {stats.users} users, {stats.friendships} friendships, "
+            f"{stats.posts} posts and {stats.comments} comments"
+        )
+
+    @app.cli.command("export-data")
+    @click.argument("path", type=click.Path(dir_okay=False, writable=True))
+    def export_data_command(path: str) -> None:
+        """Write users, friends, posts and comments to a gzip-compressed JSON lines file."""
+        from social_insecurity.dataset import export_data
+
+        counts = export_data(path)
+        print("Exported " + ", ".join(f"{count} {table}" for table, count in counts.items()))
+
+    @app.cli.command("import-data")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    def import_data_command(path: str) -> None:
+        """Replace users, friends, posts and comments with those of a file written by export-data."""
+        from social_insecurity.dataset import import_data
+
+        counts = import_data(path)
+        print("Imported " + ", ".join(f"{count} {table}" for table, count in counts.items()))
+
+    @app.cli.command("loadtest")
+    @click.option("--users", default=20, show_default=True, help="Number of concurrent virtual users.")
+    @click.option("--duration", default=30.0, show_default=True, help="Seconds to run for.")
+    @click.option("--think-time", default=0.0, show_default=True, help="Average seconds between a user's actions.")
+    @click.option("--password", default="Password123!", show_default=True, help="Password of the seeded users.")
+    @click.option("--url", help="Test the server at this URL, instead of serving the app on a local port.")
+    @click.option("--rate-limits/--no-rate-limits", default=False, help="Apply rate limits to the local server.")
+    @click.option("--seed", type=int, help="Seed of the random generator.")
+    def loadtest_command(
+        users: int, duration: float, think_time: float, password: str, url: str, rate_limits: bool, seed: int
+    ) -> None:
+        """Run concurrent virtual users, logged in as seeded users, against the app and report the results."""
+        from social_insecurity.loadtest import run
+
+        # Every virtual user comes from the same address, so the per-address limits would stop them at once
+        limiter.enabled = rate_limits
+        rows = sqlite.read("SELECT username FROM Users ORDER BY random() LIMIT ?;", (max(users, 100),))
+        if not rows:
+            raise click.ClickException("There are no users to log in as, run 'flask seed' first")
+        sqlite.release()  # The local server's threads need the pooled connections
+        report = run(
+            current_app._get_current_object(),
+            [row["username"] for row in rows],
+            password,
+            virtual_users=users,
+            duration=duration,
+            think_time=think_time,
+            url=url,
+            seed=seed,
+        )
+        print(report.format())
+
+    @app.cli.command("optimize")
+    def optimize_command() -> None:
+        """Checkpoint the write-ahead log, refresh query planner statistics and merge the search indexes."""
+        from social_insecurity.search import optimize_search_index
+
+        busy, log, checkpointed = sqlite.checkpoint()
+        sqlite.optimize()
+        optimize_search_index()
+        print(f"Checkpointed {checkpointed} of {log} WAL pages" + (" (blocked by readers)" if busy else ""))
+
+    @app.cli.command("sync-replicas")
+    def sync_replicas_command() -> None:
+        """Replace the read replicas with a snapshot of the database, e.g. from cron when the sync thread is off."""
+        print(f"Synced {sqlite.sync_replicas()} read replicas")
+
+    @app.cli.command("prune-uploads")
+    def prune_uploads_command() -> None:
+        """Delete uploaded images that no post refers to any more."""
+        from social_insecurity.uploads import prune_uploads
+
+        print(f"Deleted {prune_uploads()} unused uploads")
+
+    @app.cli.command("rebuild-search")
+    def rebuild_search_command() -> None:
+        """Create the full-text search indexes if needed and reindex every post, comment and user."""
+        from social_insecurity.search import rebuild_search_index
+
+        rebuild_search_index()
+
+    @app.cli.command("rebuild-timelines")
+    def rebuild_timelines_command() -> None:
+        """Create the materialized timelines used when FEED_MODE is "push" if needed, and rebuild them."""
+        from social_insecurity.feed import rebuild_timelines
+
+        rebuild_timelines()
+
+    @app.cli.command("backfill-comment-counts")
+    def backfill_comment_counts_command() -> None:
+        """Add the stored comment count, update time and image variants of posts, and recompute the counts."""
+        from social_insecurity.feed import backfill_comment_counts
+
+        backfill_comment_counts()
+
     with app.app_context():
         import social_insecurity.routes  # noqa: E402,F401
+        from social_insecurity.api import api
+
+        app.register_blueprint(api)
 
     return app
 
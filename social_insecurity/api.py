@@ -0,0 +1,195 @@
+"""Provides the versioned JSON API of the Social Insecurity application.
+
+The API exposes the feed, the comments of a post, friends and incoming friend requests
+under ``/api/v1``, to clients logged in with the same session cookie as the website.
+Every list is paginated with an opaque ``cursor``: pass the ``next_cursor`` of a
+response to get the page after it. ``?fields=id,content`` limits the fields of each
+item, and ``?limit=`` the number of items, up to ``API_MAX_PAGE_SIZE``.
+
+``/api/v1/events`` long-polls for live updates, see `social_insecurity.events`.
+
+Every list response carries an ETag. It is derived from a cheap validator query, such as
+the ``(id, updated_at)`` of the posts on a feed page, which runs before the full query.
+A client that polls with ``If-None-Match`` gets a 304 without the full query running
+as long as nothing on the page changed.
+
+Example:
+    GET /api/v1/feed?fields=id,username,content
+    200 {"data": [...], "next_cursor": "MjAyNC0wMS0wMSAxMjowMDowMHw0Mg"}
+
+    GET /api/v1/feed?fields=id,username,content
+    If-None-Match: "5b0c..."
+    304
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from collections.abc import Iterable
+from typing import Any, Callable, Optional
+
+from flask import Blueprint, Response, abort, current_app, jsonify, make_response, request
+from flask_login import current_user
+from werkzeug.exceptions import HTTPException
+
+from social_insecurity import events, friend_graph, limiter, queries, sqlite
+from social_insecurity.comments import get_comments
+from social_insecurity.feed import decode_cursor, get_feed_page, get_feed_version
+
+api = Blueprint("api", __name__, url_prefix="/api/v1")
+
+POST_FIELDS = ("id", "username", "content", "image", "image_variants", "creation_time", "comment_count", "updated_at")
+COMMENT_FIELDS = ("id", "username", "comment", "creation_time")
+USER_FIELDS = ("id", "username", "first_name", "last_name")
+FRIEND_REQUEST_FIELDS = ("id", "from_user_id", "username", "created_at")
+
+
+@api.before_request
+def require_login() -> None:
+    """Refuse requests without a logged in user, with a 401 rather than a redirect to the login page."""
+    if not current_user.is_authenticated:
+        abort(401)
+
+
+@api.errorhandler(HTTPException)
+def handle_error(error: HTTPException):
+    """Report errors as JSON."""
+    return jsonify(error=error.description), error.code
+
+
+@api.route("/feed")
+def feed():
+    """List the posts of the user and their friends, newest first."""
+    fields, limit, cursor = _fields(POST_FIELDS), _limit(), request.args.get("cursor")
+    try:
+        version = get_feed_version(current_user.id, cursor, limit)
+    except ValueError:
+        abort(400, "Invalid cursor")
+
+    def build() -> dict[str, Any]:
+        page = get_feed_page(current_user.id, cursor, limit)
+        return {"data": _select(page.posts, fields), "next_cursor": page.next_cursor}
+
+    return _conditional(version, build)
+
+
+@api.route("/posts/<int:post_id>/comments")
+def comments(post_id: int):
+    """List the comments of a post by the user or one of their friends, newest first."""
+    fields, limit, cursor = _fields(COMMENT_FIELDS), _limit(), request.args.get("cursor")
+    # Posts.updated_at is bumped by every new or deleted comment, so this one row lookup validates the list
+    post = sqlite.read(queries["get_post_version"], (post_id,), one=True)
+    if post is None or post["u_id"] not in friend_graph.friends_of(current_user.id) | {current_user.id}:
+        abort(404, "No such post")
+    try:
+        # Checked before the ETag, so that a malformed cursor is refused even when the list is unchanged
+        if cursor:
+            decode_cursor(cursor)
+    except ValueError:
+        abort(400, "Invalid cursor")
+
+    def build() -> dict[str, Any]:
+        rows, next_cursor = get_comments(post_id, cursor, limit)
+        return {"data": _select(rows, fields), "next_cursor": next_cursor}
+
+    return _conditional(f"{post['updated_at']}|{post['comment_count']}", build)
+
+
+@api.route("/friends")
+def friends():
+    """List the friends of the user, in the order they joined."""
+    fields, limit, after = _fields(USER_FIELDS), _limit(), _id_cursor()
+    # The friend IDs come from the cached friend graph, so an unchanged list costs no query at all
+    friend_ids = sorted(friend_id for friend_id in friend_graph.friends_of(current_user.id) if friend_id > after)
+    page_ids = friend_ids[:limit]
+
+    def build() -> dict[str, Any]:
+        users = sqlite.get_users_by_ids(page_ids)
+        rows = [users[friend_id] for friend_id in page_ids if friend_id in users]
+        next_cursor = str(page_ids[-1]) if len(friend_ids) > limit else None
+        return {"data": _select(rows, fields), "next_cursor": next_cursor}
+
+    return _conditional(json.dumps(friend_ids[: limit + 1]), build)
+
+
+@api.route("/friend-requests")
+def friend_requests():
+    """List the friend requests sent to the user, newest first."""
+    fields, limit, before = _fields(FRIEND_REQUEST_FIELDS), _limit(), _id_cursor()
+    # Any new request raises the highest id, and any accepted or declined one lowers the count
+    version = sqlite.read(queries["get_friend_requests_version"], (current_user.id,), one=True)
+
+    def build() -> dict[str, Any]:
+        rows = sqlite.read(queries["get_friend_requests_page"], (current_user.id, before, limit + 1))
+        next_cursor = str(rows[limit - 1]["id"]) if len(rows) > limit else None
+        return {"data": _select(rows[:limit], fields), "next_cursor": next_cursor}
+
+    return _conditional(json.dumps(tuple(version)), build)
+
+
+@api.route("/events")
+@limiter.exempt
+def poll_events():
+    """Wait for new posts, comments and friend requests after the ``?since=`` event ID, for long-polling clients.
+
+    Without ``since``, returns right away with the ID to poll after. A ``reset`` of true means that events were
+    missed, and the client should reload the feed and friend requests.
+    """
+    since = request.args.get("since", type=int)
+    if since is None:
+        return jsonify(events=[], last_id=events.last_id, reset=False)
+    max_timeout = current_app.config["EVENTS_POLL_TIMEOUT"]
+    timeout = min(request.args.get("timeout", max_timeout, type=float), max_timeout)
+    user_id = current_user.id
+    sqlite.release()  # Do not keep a pooled connection checked out while waiting
+    new_events, last_id = events.wait(user_id, since, max(0.0, timeout))
+    data = [{"id": event.id, "type": event.type, "data": event.data} for event in new_events or []]
+    return jsonify(events=data, last_id=last_id, reset=new_events is None)
+
+
+def _conditional(version: str, build: Callable[[], dict[str, Any]]) -> Response:
+    """Answers with a 304 if the client has the current version of the response, or builds and sends it."""
+    # The same version of the data gives a different response for another user or other arguments
+    etag = hashlib.sha1(f"{current_user.id}|{request.full_path}|{version}".encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True  # Clients may keep the response, but must revalidate it
+    return response
+
+
+def _fields(allowed: tuple[str, ...]) -> tuple[str, ...]:
+    """Returns the fields requested with ``?fields=``, or all allowed fields."""
+    requested = request.args.get("fields")
+    if not requested:
+        return allowed
+    fields = tuple(dict.fromkeys(field.strip() for field in requested.split(",") if field.strip()))
+    unknown = [field for field in fields if field not in allowed]
+    if unknown or not fields:
+        abort(400, f"Unknown fields: {', '.join(unknown)}; allowed are {', '.join(allowed)}")
+    return fields
+
+
+def _limit() -> int:
+    """Returns the page size requested with ``?limit=``, clamped to the allowed range."""
+    limit = request.args.get("limit", current_app.config["API_PAGE_SIZE"], type=int)
+    return max(1, min(limit, current_app.config["API_MAX_PAGE_SIZE"]))
+
+
+def _id_cursor() -> int:
+    """Returns the ID cursor of lists ordered by ID, or 0 on the first page."""
+    cursor: Optional[str] = request.args.get("cursor")
+    if not cursor:
+        return 0
+    if not cursor.isdigit():
+        abort(400, "Invalid cursor")
+    return int(cursor)
+
+
+def _select(rows: Iterable[Any], fields: tuple[str, ...]) -> list[dict[str, Any]]:
+    """Converts rows to dicts with only the selected fields."""
+    return [{field: row[field] for field in fields} for row in rows]
@@ -0,0 +1,98 @@
+"""Provides the comments of posts, for the comments page, the stream and the JSON API.
+
+Comments are paginated with the same ``(creation_time, id)`` keyset cursor as the feed,
+and every page is a range scan over the ``Comments(p_id, creation_time)`` index, read
+in order without sorting. The comments page gets its post and a page of comments from
+one statement, and the stream gets a preview of the newest comments of every post on
+a page from one more, rather than a query per post.
+
+Example:
+    from social_insecurity.comments import get_comment_previews, get_post_with_comments
+
+    page = get_post_with_comments(post_id, cursor=request.args.get("cursor"))
+    previews = get_comment_previews(feed_page.posts)
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+from collections.abc import Iterable
+from typing import Any, NamedTuple, Optional
+
+from flask import current_app
+
+from social_insecurity import queries, sqlite
+from social_insecurity.feed import decode_cursor, encode_cursor
+
+
+class CommentsPage(NamedTuple):
+    """A post, a page of its comments and the cursor of the page after it, if any."""
+
+    post: dict[str, Any]
+    comments: list[dict[str, Any]]
+    next_cursor: Optional[str]
+
+
+def get_post_with_comments(
+    post_id: int, cursor: Optional[str] = None, limit: Optional[int] = None
+) -> Optional[CommentsPage]:
+    """Fetches a post and its comments, newest first, starting after the cursor; None if there is no such post."""
+    limit = limit or current_app.config["COMMENTS_PAGE_SIZE"]
+
+    # One row per comment, each repeating the post, or a single row without a comment
+    if cursor:
+        creation_time, comment_id = decode_cursor(cursor)
+        rows = sqlite.read(queries["get_post_with_comments_before"], (post_id, limit + 1, creation_time, comment_id))
+    else:
+        rows = sqlite.read(queries["get_post_with_comments"], (post_id, limit + 1))
+    if not rows:
+        return None
+
+    first = rows[0]
+    post = {key: first[key] for key in ("id", "username", "content", "image", "creation_time", "updated_at")}
+    comments = [
+        {
+            "id": row["comment_id"],
+            "username": row["comment_username"],
+            "comment": row["comment"],
+            "creation_time": row["comment_time"],
+        }
+        for row in rows
+        if row["comment_id"] is not None
+    ]
+    return CommentsPage(post, comments[:limit], _next_cursor(comments, limit))
+
+
+def get_comments(
+    post_id: int, cursor: Optional[str] = None, limit: Optional[int] = None
+) -> tuple[list[sqlite3.Row], Optional[str]]:
+    """Fetches the comments of a post, newest first, starting after the cursor, and the cursor of the next page."""
+    limit = limit or current_app.config["COMMENTS_PAGE_SIZE"]
+    if cursor:
+        creation_time, comment_id = decode_cursor(cursor)
+        rows = sqlite.read(queries["get_comments_next_page"], (post_id, creation_time, comment_id, limit + 1))
+    else:
+        rows = sqlite.read(queries["get_comments_first_page"], (post_id, limit + 1))
+    return rows[:limit], _next_cursor(rows, limit)
+
+
+def get_comment_previews(posts: Iterable[sqlite3.Row], limit: Optional[int] = None) -> dict[int, list[sqlite3.Row]]:
+    """Fetches the newest comments of each of the posts at once, by post ID."""
+    limit = current_app.config["COMMENT_PREVIEWS"] if limit is None else limit
+    # The stored comment count spares looking up posts without comments at all
+    post_ids = sorted(post["id"] for post in posts if post["comment_count"])
+    if not post_ids or limit <= 0:
+        return {}
+    previews: dict[int, list[sqlite3.Row]] = {}
+    for row in sqlite.read(queries["get_comment_previews"], (json.dumps(post_ids), limit)):
+        previews.setdefault(row["p_id"], []).append(row)
+    return previews
+
+
+def _next_cursor(comments: list[Any], limit: int) -> Optional[str]:
+    """Returns the cursor after the last comment of a page, if a row beyond the page was fetched."""
+    if len(comments) <= limit:
+        return None
+    last = comments[limit - 1]
+    return encode_cursor(last["creation_time"], last["id"])
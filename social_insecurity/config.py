@@ -19,8 +19,65 @@ import os
 class Config:
     SECRET_KEY = os.environ.get("SECRET_KEY") or "din_hemmelige_nøkkel"
     SQLITE3_DATABASE_PATH = "sqlite3.db"  # Path relative to the Flask instance folder
+    SQLITE3_POOL_SIZE = 10  # Maximum number of open database connections per process
+    SQLITE3_POOL_TIMEOUT = 10.0  # Seconds to wait for a free connection before giving up
+    SQLITE3_POOL_PING_INTERVAL = 30.0  # Seconds a connection may sit idle before it is checked on reuse
+    SQLITE3_CACHED_STATEMENTS = 256  # Compiled statements kept per connection; should exceed the named queries
+    SQLITE3_PROFILE = False  # Time every statement, add a Server-Timing header and log slow and repeated statements
+    SQLITE3_SLOW_QUERY_MS = 50.0  # Statements slower than this are logged with their query plan while profiling
+    SQLITE3_REPEATED_QUERY_LIMIT = 10  # Runs of one statement in a request that are logged as a likely N+1 query
+    QUERIES_VALIDATE = True  # Compile every named query at startup; disable to start against a database to upgrade
+    SQLITE3_REPLICA_PATHS = ()  # Read-only copies of the database that requests read from, relative paths
+    SQLITE3_REPLICA_SYNC_INTERVAL = 30.0  # Seconds between snapshots, taken by one process; 0 for `flask sync-replicas`
+    SQLITE3_REPLICA_MAX_LAG = 90.0  # Replicas older than this many seconds are not read from
+    SQLITE3_REPLICA_STICKY = 90.0  # Seconds a user reads from the primary after a write; at least the max lag
+    SQLITE3_USER_CACHE_SIZE = 1024  # Number of user rows cached per process
+    SQLITE3_USER_CACHE_TTL = 60.0  # Seconds before a cached user row is read again from the database
+    # PRAGMAs applied, in order, to every new connection
+    SQLITE3_PRAGMAS = {
+        "busy_timeout": 5000,  # Milliseconds to wait for a lock before failing with "database is locked"
+        "journal_mode": "WAL",  # Readers and the writer no longer block each other
+        "synchronous": "NORMAL",  # Safe with WAL; fsync on checkpoint instead of on every commit
+        "cache_size": -16000,  # Page cache per connection, negative values are in KiB
+        "mmap_size": 134217728,  # Read pages through a 128 MiB memory map instead of read() calls
+        "temp_store": "MEMORY",  # Keep temporary tables and sort b-trees in memory
+    }
     UPLOADS_FOLDER_PATH = "uploads"  # Path relative to the Flask instance folder
+    UPLOADS_CACHE_MAX_AGE = 31536000  # Seconds clients may cache content-addressed uploads without revalidating
     ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "bmp", "tiff"}  # Tillatte filtyper for opplasting
+    UPLOADS_MAX_SIZE = 5 * 1024 * 1024  # Largest accepted image, in bytes
+    MAX_CONTENT_LENGTH = 6 * 1024 * 1024  # Largest accepted request body, in bytes; larger requests get a 413
+    BCRYPT_LOG_ROUNDS = 12  # Cost of new password hashes; older hashes are upgraded on login
+    PASSWORD_HASH_WORKERS = 2  # Processes that hash passwords, 0 hashes on the request thread
+    PASSWORD_HASH_QUEUE_LIMIT = 8  # Pending hashing jobs before logins are refused with 503
+    PASSWORD_HASH_TIMEOUT = 10.0  # Seconds to wait for a hashing job
+    IMAGE_VARIANT_WIDTHS = (320, 640)  # Widths in pixels of the resized copies made of uploaded images
+    IMAGE_WORKERS = 1  # Background threads resizing uploaded images
+    FEED_PAGE_SIZE = 20  # Number of posts per page in the stream
+    FEED_MODE = "pull"  # "pull" builds the feed on read, "push" fans posts out to timelines on write
+    TIMELINE_BACKFILL_SIZE = 100  # Posts copied into each timeline when a friendship is accepted
+    COMMENTS_PAGE_SIZE = 20  # Number of comments per page under a post
+    COMMENT_PREVIEWS = 2  # Newest comments shown under each post in the stream, 0 shows none
+    WRITE_BEHIND = False  # Queue new comments and friend requests for a background writer thread
+    WRITE_BEHIND_QUEUE_SIZE = 1000  # Queued writes before requests write synchronously again
+    WRITE_BEHIND_BATCH_SIZE = 500  # Most queued writes committed in one transaction
+    WRITE_BEHIND_DELAY = 0.01  # Seconds the writer thread waits for more writes before committing a batch
+    FRIEND_GRAPH_CACHE_SIZE = 4096  # Number of users whose friends are cached per process
+    FRIEND_GRAPH_CACHE_TTL = 300.0  # Seconds before cached friends are read again from the database
+    SEARCH_PAGE_SIZE = 20  # Number of results per page of a search
+    SEARCH_MAX_PAGES = 10  # Deepest page of a search that is served, bounding the OFFSET scanned
+    SEARCH_AUTOCOMPLETE_LIMIT = 8  # Number of usernames suggested while typing
+    RATELIMIT_DATABASE_PATH = "ratelimits.db"  # Path relative to the Flask instance folder, unless RATELIMIT_STORAGE_URI is set
+    RATELIMIT_STRATEGY = "sliding-window-counter"  # Weights the previous window, so limits cannot be doubled at a boundary
+    FRAGMENT_CACHE_ENABLED = True  # Reuse rendered post cards and comment lists across requests and viewers
+    FRAGMENT_CACHE_SIZE = 2048  # Number of rendered template fragments cached per process
+    FRAGMENT_CACHE_TTL = 300.0  # Seconds before a cached fragment is rendered again
+    API_PAGE_SIZE = 20  # Number of items per page of the JSON API, unless the client asks for another ?limit=
+    API_MAX_PAGE_SIZE = 100  # Largest ?limit= accepted by the JSON API
+    EVENTS_BUFFER_SIZE = 1024  # Recent live update events kept for subscribers that are catching up
+    EVENTS_HEARTBEAT = 15.0  # Seconds between keep-alive comments on an idle event stream
+    EVENTS_STREAM_TIMEOUT = 300.0  # Seconds before an event stream is closed; browsers reconnect and resume
+    EVENTS_POLL_TIMEOUT = 25.0  # Longest wait of a long-polling request for new events
     WTF_CSRF_ENABLED = True  # Aktivert CSRF beskyttelse
 
     # Sikre sesjonskapsler
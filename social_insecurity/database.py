@@ -2,12 +2,288 @@
 
 from __future__ import annotations
 
+import json
+import logging
+import os
+import random
 import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
 from os import PathLike
 from pathlib import Path
-from typing import Any, Optional  # Removed unused import 'cast'
+from queue import Empty, LifoQueue
+from typing import Any, NamedTuple, Optional  # Removed unused import 'cast'
 
-from flask import Flask, current_app, g
+from flask import Flask, Response, current_app, g, has_request_context, request, session
+
+try:
+    import fcntl
+except ImportError:  # Windows has no fcntl, so there every process syncs the replicas itself
+    fcntl = None
+
+from social_insecurity.cache import TTLCache
+
+
+class PoolTimeout(RuntimeError):
+    """Raised when no pooled connection becomes available before the timeout."""
+
+
+class StatementCacheStats:
+    """Counts the hits and misses of the prepared statement caches of a pool's connections."""
+
+    def __init__(self) -> None:
+        """Initializes the counters at zero."""
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def hit_rate(self) -> Optional[float]:
+        """Returns the share of statements that were found in the cache, or None if none ran yet."""
+        total = self.hits + self.misses
+        return self.hits / total if total else None
+
+    def count(self, hit: bool) -> None:
+        """Counts a statement as a hit or a miss."""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def as_dict(self) -> dict[str, Any]:
+        """Returns the counters and hit rate, for logging."""
+        hit_rate = self.hit_rate
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": None if hit_rate is None else round(hit_rate, 4)}
+
+
+class StatementCacheConnection(sqlite3.Connection):
+    """A connection that counts the hits and misses of its prepared statement cache.
+
+    sqlite3 keeps the most recently used `cached_statements` statements of a connection
+    compiled, keyed by their exact text, but does not expose whether a statement was
+    found there. This connection replays the same LRU over the text of every statement
+    run through `execute` and `executemany`, so the counts are a close approximation.
+    """
+
+    def __init__(self, *args: Any, cached_statements: int = 128, **kwargs: Any) -> None:
+        """Opens the connection; see `sqlite3.connect`."""
+        super().__init__(*args, cached_statements=cached_statements, **kwargs)
+        self.cached_statements = cached_statements
+        self.statement_cache_stats = StatementCacheStats()
+        self._statements: OrderedDict[str, None] = OrderedDict()
+
+    def execute(self, sql: str, parameters: Any = (), /) -> sqlite3.Cursor:
+        """Runs a statement, counting whether it was already compiled."""
+        self._count_statement(sql)
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql: str, parameters: Any, /) -> sqlite3.Cursor:
+        """Runs a statement once per parameter set, counting whether it was already compiled."""
+        self._count_statement(sql)
+        return super().executemany(sql, parameters)
+
+    def _count_statement(self, sql: str) -> None:
+        """Looks the statement up in the replayed LRU, and counts a hit or a miss."""
+        hit = sql in self._statements
+        if hit:
+            self._statements.move_to_end(sql)
+        elif self.cached_statements > 0:
+            self._statements[sql] = None
+            if len(self._statements) > self.cached_statements:
+                self._statements.popitem(last=False)
+        self.statement_cache_stats.count(hit)
+
+
+class ConnectionPool:
+    """Provides a bounded, thread-safe pool of SQLite3 connections.
+
+    Connections are created lazily, up to `size` of them, and handed out most recently
+    used first so that their page caches stay warm. An idle connection is checked with
+    a trivial query before it is reused if it has been idle for longer than `ping_interval`.
+    """
+
+    def __init__(
+        self,
+        database: str,
+        *,
+        uri: bool = False,
+        size: int = 10,
+        timeout: float = 10.0,
+        ping_interval: float = 30.0,
+        cached_statements: int = 128,
+        pragmas: Optional[dict[str, Any]] = None,
+    ) -> None:
+        """Initializes the pool without opening any connections."""
+        self.database = database
+        self.uri = uri
+        self.size = size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self.cached_statements = cached_statements
+        self.pragmas = dict(pragmas or {})
+        self._closed = False
+        self._reset()
+
+        # An in-memory database only lives as long as its last connection, so hold one open
+        self._anchor = self._connect() if "mode=memory" in database or ":memory:" in database else None
+
+    def acquire(self) -> sqlite3.Connection:
+        """Checks out a connection, waiting up to `timeout` seconds for one to be returned."""
+        if self._pid != os.getpid():
+            # Connections must not be shared with a forked child, so start over with an empty pool
+            self._reset()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"No SQLite3 connection available after {self.timeout} seconds")
+        try:
+            while True:
+                try:
+                    conn, idle_since = self._idle.get_nowait()
+                except Empty:
+                    return self._connect()
+                if time.monotonic() - idle_since < self.ping_interval or self._is_healthy(conn):
+                    return conn
+                conn.close()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        """Returns a checked out connection to the pool, rolling back any unfinished transaction."""
+        if self._pid != os.getpid():
+            return
+        if self._closed:
+            # Connections checked out before the pool was closed are closed as they come back
+            conn.close()
+            self._slots.release()
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put((conn, time.monotonic()))
+        except sqlite3.Error:
+            conn.close()
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        """Closes all idle connections and the in-memory anchor, if any, and every connection returned later."""
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except Empty:
+                break
+            conn.close()
+        if self._anchor is not None:
+            self._anchor.close()
+            self._anchor = None
+
+    def _reset(self) -> None:
+        """Forgets all connections and capacity, as is needed after a fork."""
+        self._pid = os.getpid()
+        self._idle: LifoQueue[tuple[sqlite3.Connection, float]] = LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self.statement_cache_stats = StatementCacheStats()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Opens a new connection and applies the configured PRAGMAs to it."""
+        conn = sqlite3.connect(
+            self.database,
+            uri=self.uri,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            factory=StatementCacheConnection,
+        )
+        # Count the statements of every connection of this pool together
+        conn.statement_cache_stats = self.statement_cache_stats
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value};")
+        return conn
+
+    @staticmethod
+    def _is_healthy(conn: sqlite3.Connection) -> bool:
+        """Returns whether the connection still answers a trivial query."""
+        try:
+            conn.execute("SELECT 1;").fetchone()
+        except sqlite3.Error:
+            return False
+        return True
+
+
+class Replica:
+    """A read-only copy of the database file, replaced as a whole by every sync.
+
+    A sync backs the primary up into a temporary file and renames it over the copy, so
+    the file is never changed in place and is opened with ``immutable=1``, without any
+    locking. Each process notices a new copy by its inode, and moves on to a new pool of
+    connections to it; connections to the old copy keep reading it until they are returned.
+    """
+
+    def __init__(self, path: Path, **pool_options: Any) -> None:
+        """Initializes the replica without opening any connections."""
+        self.path = path
+        self.generation = 0
+        self._pool_options = pool_options
+        self._pool: Optional[ConnectionPool] = None
+        self._inode: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def age(self) -> Optional[float]:
+        """Returns the seconds since the copy was taken, or None if there is no copy yet."""
+        try:
+            return time.time() - self.path.stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def acquire(self) -> tuple[ConnectionPool, sqlite3.Connection]:
+        """Checks out a connection to the current copy, and returns it with the pool to release it to."""
+        inode = self.path.stat().st_ino
+        with self._lock:
+            if inode != self._inode:
+                stale, self._pool = self._pool, ConnectionPool(
+                    f"{self.path.resolve().as_uri()}?mode=ro&immutable=1", uri=True, **self._pool_options
+                )
+                self._inode = inode
+                self.generation += 1
+                if stale is not None:
+                    stale.close()
+            pool = self._pool
+        return pool, pool.acquire()
+
+    def sync(self, source: sqlite3.Connection) -> None:
+        """Replaces the copy with a snapshot of the source database."""
+        started = time.time()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        copy = sqlite3.connect(temporary)
+        try:
+            source.backup(copy)
+            # An immutable file is never written, so it needs no write-ahead log
+            copy.execute("PRAGMA journal_mode = DELETE;")
+        finally:
+            copy.close()
+        # The backup reads one consistent snapshot, as of when it started
+        os.utime(temporary, (started, started))
+        os.replace(temporary, self.path)
+
+
+logger = logging.getLogger(__name__)
+
+# Of the configured PRAGMAs, those that apply to read-only connections
+_READ_PRAGMAS = ("cache_size", "mmap_size", "temp_store")
+
+
+class QueryStats(NamedTuple):
+    """The duration and number of rows of a statement run while profiling."""
+
+    query: str
+    duration_ms: float
+    rows: int
 
 
 class SQLite3:
@@ -40,6 +316,12 @@ class SQLite3:
         else:
             raise RuntimeError("Flask SQLite3 extension already initialized")
 
+        self._profile = app.config.get("SQLITE3_PROFILE", False)
+        self._slow_query_ms = app.config.get("SQLITE3_SLOW_QUERY_MS", 50.0)
+        self._repeated_query_limit = app.config.get("SQLITE3_REPEATED_QUERY_LIMIT", 10)
+        if self._profile:
+            app.after_request(self._report_queries)
+
         instance_path = Path(app.instance_path)
         database_path = path or app.config.get("SQLITE3_DATABASE_PATH")
 
@@ -51,41 +333,265 @@ class SQLite3:
         else:
             raise ValueError("No database path provided to SQLite3 extension")
 
-        if not self._path.exists():
-            self._path.parent.mkdir(parents=True, exist_ok=True)
+        uri = str(database_path).startswith("file:")
+        database = str(database_path) if uri else str(self._path)
+        in_memory = ":memory:" in database or "mode=memory" in database
+        if database == ":memory:":
+            # Give the pooled connections one private, shared-cache database to connect to
+            database, uri = f"file:social_insecurity-{id(self)}?mode=memory&cache=shared", True
+
+        self._pool = ConnectionPool(
+            database,
+            uri=uri,
+            size=app.config.get("SQLITE3_POOL_SIZE", 10),
+            timeout=app.config.get("SQLITE3_POOL_TIMEOUT", 10.0),
+            ping_interval=app.config.get("SQLITE3_POOL_PING_INTERVAL", 30.0),
+            cached_statements=app.config.get("SQLITE3_CACHED_STATEMENTS", 128),
+            pragmas=app.config.get("SQLITE3_PRAGMAS"),
+        )
+        self._users = TTLCache(
+            maxsize=app.config.get("SQLITE3_USER_CACHE_SIZE", 1024),
+            ttl=app.config.get("SQLITE3_USER_CACHE_TTL", 60.0),
+        )
+
+        replica_paths = app.config.get("SQLITE3_REPLICA_PATHS", ())
+        if replica_paths and in_memory:
+            raise ValueError("Read replicas need the primary database to be a file")
+        read_pragmas = {
+            name: value for name, value in (app.config.get("SQLITE3_PRAGMAS") or {}).items() if name in _READ_PRAGMAS
+        }
+        self._replicas = [
+            Replica(
+                instance_path / replica_path,
+                size=app.config.get("SQLITE3_POOL_SIZE", 10),
+                timeout=app.config.get("SQLITE3_POOL_TIMEOUT", 10.0),
+                cached_statements=app.config.get("SQLITE3_CACHED_STATEMENTS", 128),
+                pragmas=read_pragmas,
+            )
+            for replica_path in replica_paths
+        ]
+        self._replica_max_lag = app.config.get("SQLITE3_REPLICA_MAX_LAG", 90.0)
+        self._replica_sticky = app.config.get("SQLITE3_REPLICA_STICKY", 90.0)
+        self._replica_sync_interval = app.config.get("SQLITE3_REPLICA_SYNC_INTERVAL", 30.0)
+        self._replica_syncer: Optional[threading.Thread] = None
+        self._replica_lock = threading.Lock()
+        self._app = app
+
+        if in_memory or not self._path.exists():
+            if not in_memory:
+                self._path.parent.mkdir(parents=True, exist_ok=True)
             if schema:
                 with app.app_context():
-                    self._init_database(schema)
+                    if not self.read("SELECT 1 FROM sqlite_master LIMIT 1;", one=True):
+                        self._init_database(schema)
 
         app.teardown_appcontext(self._close_connection)
 
     @property
     def connection(self) -> sqlite3.Connection:
-        """Returns the connection to the SQLite3 database."""
+        """Returns the connection to the SQLite3 database, checked out from the pool for this app context."""
         conn = getattr(g, "flask_sqlite3_connection", None)
         if conn is None:
-            conn = sqlite3.connect(self._path)
-            conn.row_factory = sqlite3.Row
+            conn = self._pool.acquire()
             g.flask_sqlite3_connection = conn  # Fixed assignment to 'conn'
         return conn
 
     def query(self, query: str, params: tuple = (), one: bool = False) -> Any:
-        """Queries the database and returns the result."""
-        cursor = self.connection.execute(query, params)
+        """Queries the database and returns the result, committing any changes it made.
+
+        Prefer `read` and `write`, which do not commit after plain SELECTs.
+        """
+        response = self.read(query, params, one=one, primary=True)
+        if self.connection.in_transaction and not g.get("flask_sqlite3_transaction_depth"):
+            self.connection.commit()
+        return response
+
+    def read(self, query: str, params: tuple = (), one: bool = False, *, primary: bool = False) -> Any:
+        """Runs a read-only query and returns the result without committing.
+
+        In a request, the query runs on a read replica if any is fresh enough, unless `primary` is set
+        or the user has written recently; see `sync_replicas`.
+        """
+        start = time.perf_counter()
+        conn = self.connection if primary else self._read_connection()
+        cursor = conn.execute(query, params)
         response = cursor.fetchone() if one else cursor.fetchall()
         cursor.close()
-        self.connection.commit()
+        if self._profile:
+            self._record(query, params, start, (response is not None) if one else len(response))
         return response
 
+    def write(self, query: str, params: tuple = ()) -> Optional[int]:
+        """Runs a data-modifying statement and returns the last inserted row id.
+
+        The change is committed immediately, unless the statement runs inside `transaction`.
+        """
+        self.mark_written()
+        start = time.perf_counter()
+        cursor = self.connection.execute(query, params)
+        lastrowid, rowcount = cursor.lastrowid, cursor.rowcount
+        cursor.close()
+        if not g.get("flask_sqlite3_transaction_depth"):
+            self.connection.commit()
+        if self._profile:
+            self._record(query, params, start, rowcount)
+        return lastrowid
+
+    def write_many(self, query: str, seq_of_params: Iterable[tuple]) -> None:
+        """Runs a data-modifying statement once per parameter tuple, committed like `write`."""
+        self.mark_written()
+        if self._profile:
+            seq_of_params = list(seq_of_params)
+        start = time.perf_counter()
+        cursor = self.connection.executemany(query, seq_of_params)
+        rowcount = cursor.rowcount
+        cursor.close()
+        if not g.get("flask_sqlite3_transaction_depth"):
+            self.connection.commit()
+        if self._profile and seq_of_params:
+            self._record(query, seq_of_params[0], start, rowcount)
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Groups all writes inside the block into one transaction.
+
+        The transaction is committed when the outermost block exits and rolled back if it raises.
+        Nested blocks join the enclosing transaction.
+        """
+        depth = g.get("flask_sqlite3_transaction_depth", 0)
+        self.mark_written()
+        if depth == 0:
+            # Take the write lock up front, so the transaction cannot fail half way on a lock upgrade
+            self.connection.execute("BEGIN IMMEDIATE;")
+        g.flask_sqlite3_transaction_depth = depth + 1
+        try:
+            yield self.connection
+        except BaseException:
+            g.flask_sqlite3_transaction_depth = depth
+            if depth == 0:
+                g.pop("flask_sqlite3_after_commit", None)
+                self.connection.rollback()
+            raise
+        g.flask_sqlite3_transaction_depth = depth
+        if depth == 0:
+            callbacks = g.pop("flask_sqlite3_after_commit", [])
+            self.connection.commit()
+            for callback in callbacks:
+                callback()
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        """Runs the callback once the current transaction commits, or right away outside of `transaction`.
+
+        Callbacks registered inside a transaction that is rolled back are discarded.
+        """
+        if g.get("flask_sqlite3_transaction_depth"):
+            g.setdefault("flask_sqlite3_after_commit", []).append(callback)
+        else:
+            callback()
+
+    def mark_written(self) -> None:
+        """Sends the following reads of this app context, and of the user's next requests, to the primary.
+
+        Writes through this extension do this themselves; call it for writes that are committed elsewhere,
+        such as ones queued for a background writer.
+        """
+        g.flask_sqlite3_wrote = True
+        if self._replicas and self._replica_sticky and has_request_context():
+            session["sqlite3_primary_until"] = time.time() + self._replica_sticky
+
+    def checkpoint(self, mode: str = "TRUNCATE") -> sqlite3.Row:
+        """Copies the write-ahead log back into the database file and returns (busy, log, checkpointed)."""
+        return self.read(f"PRAGMA wal_checkpoint({mode});", one=True, primary=True)
+
+    def optimize(self) -> None:
+        """Lets SQLite refresh the query planner statistics of tables that need it."""
+        self.read("PRAGMA optimize;", primary=True)
+
+    def release(self) -> None:
+        """Returns the connection of this app context to the pool early, e.g. before a long wait.
+
+        A later query in the same app context checks out a connection again.
+        """
+        if g.get("flask_sqlite3_transaction_depth"):
+            raise RuntimeError("Cannot release the connection inside a transaction")
+        self._close_connection()
+
+    def sync_replicas(self) -> int:
+        """Replaces every read replica with a snapshot of the primary, and returns how many there are."""
+        for replica in self._replicas:
+            replica.sync(self.connection)
+        return len(self._replicas)
+
+    @property
+    def statement_cache_stats(self) -> StatementCacheStats:
+        """Returns the prepared statement cache hits and misses of this process's connections."""
+        return self._pool.statement_cache_stats
+
+    @property
+    def queries(self) -> list[QueryStats]:
+        """Returns the statements run in this app context so far, if profiling is enabled."""
+        return g.setdefault("flask_sqlite3_queries", [])
+
     def get_user_by_id(self, user_id: int) -> Optional[sqlite3.Row]:
-        """Fetches a user from the database by their ID."""
+        """Fetches a user from the database by their ID, or from the user cache."""
         query = "SELECT * FROM Users WHERE id = ?;"
-        return self.query(query, (user_id,), one=True)
+        return self._get_user(("id", user_id), query, (user_id,))
 
     def get_user_by_username(self, username: str) -> Optional[sqlite3.Row]:
-        """Fetches a user from the database by their username."""
+        """Fetches a user from the database by their username, or from the user cache."""
         query = "SELECT * FROM Users WHERE username = ?;"
-        return self.query(query, (username,), one=True)
+        return self._get_user(("username", username), query, (username,))
+
+    def invalidate_user(self, user_id: Optional[int] = None, username: Optional[str] = None) -> None:
+        """Drops a user from the user caches; must be called after the row is inserted or updated."""
+        memo = g.get("flask_sqlite3_users", {})
+        keys = {("id", user_id), ("username", username)}
+        for key in list(keys):
+            user = memo.get(key) or self._users.get(key)
+            if user is not None:
+                keys |= {("id", user["id"]), ("username", user["username"])}
+        for key in keys:
+            self._users.delete(key)
+            memo.pop(key, None)
+
+    def get_users_by_ids(self, user_ids: Iterable[int]) -> dict[int, sqlite3.Row]:
+        """Fetches several users by their IDs at once, querying the database only for uncached ones."""
+        memo = g.setdefault("flask_sqlite3_users", {})
+        users, missing = {}, []
+        for user_id in user_ids:
+            user = memo.get(("id", user_id)) or self._users.get(("id", user_id))
+            if user is None:
+                missing.append(user_id)
+            else:
+                users[user_id] = user
+        if missing:
+            query = "SELECT * FROM Users WHERE id IN (SELECT value FROM json_each(?));"
+            for user in self.read(query, (json.dumps(missing),), primary=True):
+                self._remember(user)
+                memo[("id", user["id"])] = users[user["id"]] = user
+        return users
+
+    def _get_user(self, key: tuple[str, Any], query: str, params: tuple) -> Optional[sqlite3.Row]:
+        """Looks a user up in the request memo, then the shared cache, and finally the database.
+
+        The request memo also remembers users that do not exist, the shared cache only existing users.
+        """
+        memo = g.setdefault("flask_sqlite3_users", {})
+        if key in memo:
+            return memo[key]
+        user = self._users.get(key)
+        if user is None:
+            # Cached rows outlive a replica's lag, so they are only read from the primary
+            user = self.read(query, params, one=True, primary=True)
+            if user is not None:
+                self._remember(user)
+        memo[key] = user
+        return user
+
+    def _remember(self, user: sqlite3.Row) -> None:
+        """Stores a user in the shared cache under both its ID and its username."""
+        self._users.set(("id", user["id"]), user)
+        self._users.set(("username", user["username"]), user)
 
     def _init_database(self, schema: PathLike | str) -> None:
         """Initializes the database with the supplied schema if it does not exist yet."""
@@ -93,9 +599,127 @@ class SQLite3:
             self.connection.executescript(file.read())
             self.connection.commit()
 
+    def _record(self, query: str, params: Any, start: float, rows: int) -> None:
+        """Records the duration of a statement, and logs it with its query plan if it was slow."""
+        duration_ms = (time.perf_counter() - start) * 1000
+        self.queries.append(QueryStats(query, duration_ms, rows))
+        if duration_ms < self._slow_query_ms:
+            return
+        try:
+            plan = [row[3] for row in self.connection.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+        except sqlite3.Error:
+            plan = []
+        logger.warning(
+            json.dumps(
+                {
+                    "event": "slow_query",
+                    "path": request.path if has_request_context() else None,
+                    "duration_ms": round(duration_ms, 2),
+                    "rows": rows,
+                    "query": " ".join(query.split()),
+                    "plan": plan,
+                    # "SCAN t" reads the whole table, "SCAN t USING INDEX" and "SEARCH" use an index
+                    "full_scan": any(step.startswith("SCAN ") and " USING " not in step for step in plan),
+                }
+            )
+        )
+
+    def _report_queries(self, response: Response) -> Response:
+        """Adds the database time of the request to the Server-Timing header, and logs repeated statements."""
+        queries = g.pop("flask_sqlite3_queries", [])
+        total_ms = sum(stats.duration_ms for stats in queries)
+        response.headers.add("Server-Timing", f'db;dur={total_ms:.2f};desc="{len(queries)} queries"')
+
+        # The same statement many times in one request is usually a loop that should be one query (N+1)
+        counts = Counter(stats.query for stats in queries)
+        repeated = [
+            {"query": " ".join(query.split()), "count": count}
+            for query, count in counts.items()
+            if count >= self._repeated_query_limit
+        ]
+        summary = {
+            "event": "request_queries",
+            "path": request.path,
+            "queries": len(queries),
+            "duration_ms": round(total_ms, 2),
+            "statement_cache": self.statement_cache_stats.as_dict(),
+        }
+        if repeated:
+            logger.warning(json.dumps({**summary, "repeated": repeated}))
+        else:
+            logger.debug(json.dumps(summary))
+        return response
+
+    def _read_connection(self) -> sqlite3.Connection:
+        """Returns the connection a read runs on: the same replica for a whole request, or the primary."""
+        if not self._replicas or not has_request_context():
+            # Work outside of requests, such as commands and background writers, may read what it is about to change
+            return self.connection
+        if g.get("flask_sqlite3_wrote") or g.get("flask_sqlite3_transaction_depth"):
+            return self.connection
+        # The user's own recent writes may not have reached the replicas yet
+        if session.get("sqlite3_primary_until", 0) > time.time():
+            return self.connection
+        checked_out = g.get("flask_sqlite3_replica")
+        if checked_out is not None:
+            return checked_out[1]
+
+        self._start_replica_syncer()
+        ages = {replica: replica.age() for replica in self._replicas}
+        fresh = [replica for replica, age in ages.items() if age is not None and age <= self._replica_max_lag]
+        if not fresh:
+            return self.connection
+        g.flask_sqlite3_replica = random.choice(fresh).acquire()
+        return g.flask_sqlite3_replica[1]
+
+    def _start_replica_syncer(self) -> None:
+        """Starts the thread that syncs the replicas every SQLITE3_REPLICA_SYNC_INTERVAL seconds, if not running."""
+        if not self._replica_sync_interval or (self._replica_syncer and self._replica_syncer.is_alive()):
+            return
+        with self._replica_lock:
+            # A forked child inherits the thread object but not the thread, so this also restarts it there
+            if self._replica_syncer is None or not self._replica_syncer.is_alive():
+                self._replica_syncer = threading.Thread(
+                    target=self._sync_replicas_forever, name="replica-sync", daemon=True
+                )
+                self._replica_syncer.start()
+
+    def _sync_replicas_forever(self) -> None:
+        """Syncs the replicas on a schedule, logging rather than raising failures.
+
+        Every process runs this thread, but only the one holding the lock file next to the database
+        syncs, so the replicas are copied once per interval however many workers there are. Another
+        process takes over when that one exits.
+        """
+        lock_path = self._path.with_name(f"{self._path.name}.sync-lock")
+        with open(lock_path, "a") as lock_file:
+            while True:
+                if self._hold_sync_lock(lock_file):
+                    try:
+                        with self._app.app_context():
+                            self.sync_replicas()
+                    except Exception:
+                        logger.exception("Could not sync the read replicas")
+                time.sleep(self._replica_sync_interval)
+
+    @staticmethod
+    def _hold_sync_lock(lock_file: Any) -> bool:
+        """Takes or keeps the exclusive lock on the sync lock file, and returns whether this process holds it."""
+        if fcntl is None:
+            return True
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
     def _close_connection(self, exception: Optional[BaseException] = None) -> None:
-        """Closes the connection to the database."""
+        """Returns the connections of this app context to their pools."""
         conn = getattr(g, "flask_sqlite3_connection", None)
         if conn is not None:
-            conn.close()
+            self._pool.release(conn)
             g.flask_sqlite3_connection = None  # Ensure the connection is removed from 'g'
+        checked_out = g.pop("flask_sqlite3_replica", None)
+        if checked_out is not None:
+            pool, replica_conn = checked_out
+            pool.release(replica_conn)
@@ -0,0 +1,256 @@
+"""Provides bulk loading of synthetic and exported data, to measure queries at realistic scale.
+
+`generate` adds users with a power-law friend graph, as social networks have: a few
+users with many friends and many with few, grown by preferential attachment. Posts are
+written mostly by the well connected users, and comments come from the friends of each
+post's author. `export_data` and `import_data` copy the tables of a database to and from
+a gzip-compressed file of JSON lines, a header line per table followed by one array per
+row.
+
+Both loads run in a single transaction with ``executemany``. The secondary indexes and
+triggers of the loaded tables are dropped before the load and created again after it,
+so that every index is built once from sorted data instead of updated row by row.
+Derived data that the triggers would maintain, the comment counts and the full-text
+indexes, is recomputed in bulk, and timelines are rebuilt in push mode.
+
+Other running processes keep their cached users and friends until they expire.
+
+Example:
+    flask seed --users 10000 --posts 20 --comments 3 --friends 30
+    flask export-data production.ndjson.gz
+    flask import-data production.ndjson.gz
+"""
+
+from __future__ import annotations
+
+import gzip
+import json
+import random
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from os import PathLike
+from typing import Any, NamedTuple, Optional
+
+from flask import current_app
+
+from social_insecurity import passwords, sqlite
+
+# In the order they are loaded, so that every row only refers to rows loaded before it
+TABLES = ("Users", "Friends", "FriendRequests", "Posts", "Comments", "Uploads")
+
+_WORDS = (
+    "the a and of to in is it that was for on are with as at be this have from or one had by word but not what all "
+    "were we when your can said there use an each which she do how their if will up other about out many then them "
+    "these so some her would make like him into time has look two more write go see number no way could people my "
+    "than first water been call who oil its now find long down day did get come made may part coffee exam weekend "
+    "concert holiday football recipe garden movie train city mountain beach party birthday music photo friend"
+).split()
+
+_BATCH_SIZE = 1000
+
+_REFRESH_DERIVED = """
+    UPDATE Posts SET comment_count = 0;
+    UPDATE Posts SET comment_count = c.n
+    FROM (SELECT p_id, COUNT(*) AS n FROM Comments GROUP BY p_id) AS c
+    WHERE c.p_id = Posts.id;
+    INSERT INTO PostsSearch (PostsSearch) VALUES ('rebuild');
+    INSERT INTO CommentsSearch (CommentsSearch) VALUES ('rebuild');
+    INSERT INTO UsersSearch (UsersSearch) VALUES ('rebuild');
+"""
+
+
+class LoadStats(NamedTuple):
+    """The number of rows loaded into each table."""
+
+    users: int
+    friendships: int
+    posts: int
+    comments: int
+
+
+def generate(
+    users: int,
+    posts_per_user: float = 10.0,
+    comments_per_post: float = 2.0,
+    friends_per_user: int = 20,
+    password: str = "Password123!",
+    seed: Optional[int] = None,
+) -> LoadStats:
+    """Adds synthetic users, friendships, posts and comments, and returns how many of each."""
+    rng = random.Random(seed)
+    first_user = _next_id("Users")
+    first_post = _next_id("Posts")
+    user_ids = list(range(first_user, first_user + users))
+    friends = _power_law_graph(user_ids, max(1, friends_per_user // 2), rng)
+    # Every user gets the same password, so it is hashed once rather than once per user
+    pwhash = passwords.hash(password)
+
+    # Better connected users post more, as they would have more reason to
+    post_authors = rng.choices(user_ids, weights=[len(friends[u]) + 1 for u in user_ids], k=int(users * posts_per_user))
+    now = datetime.now(timezone.utc)
+    post_times = sorted(_timestamp(now - timedelta(seconds=rng.uniform(0, 365 * 86400))) for _ in post_authors)
+    post_ids = range(first_post, first_post + len(post_authors))
+
+    comment_count = 0
+
+    def user_rows() -> Iterator[tuple]:
+        for user_id in user_ids:
+            yield (user_id, f"user{user_id}", rng.choice(_WORDS).title(), rng.choice(_WORDS).title(), pwhash)
+
+    def friend_rows() -> Iterator[tuple]:
+        for user_id in user_ids:
+            for friend_id in friends[user_id]:
+                yield (user_id, friend_id)
+
+    def post_rows() -> Iterator[tuple]:
+        for post_id, author_id, created in zip(post_ids, post_authors, post_times):
+            yield (post_id, author_id, _sentence(rng, 5, 40), created, created)
+
+    def comment_rows() -> Iterator[tuple]:
+        nonlocal comment_count
+        for post_id, author_id, created in zip(post_ids, post_authors, post_times):
+            commenters = list(friends[author_id]) or [author_id]
+            for _ in range(int(rng.expovariate(1 / comments_per_post)) if comments_per_post > 0 else 0):
+                comment_count += 1
+                yield (post_id, rng.choice(commenters), _sentence(rng, 2, 15), created)
+
+    with _bulk_load():
+        sqlite.write_many(
+            "INSERT INTO Users (id, username, first_name, last_name, password) VALUES (?, ?, ?, ?, ?);", user_rows()
+        )
+        sqlite.write_many("INSERT INTO Friends (u_id, f_id) VALUES (?, ?);", friend_rows())
+        sqlite.write_many(
+            "INSERT INTO Posts (id, u_id, content, creation_time, updated_at) VALUES (?, ?, ?, ?, ?);", post_rows()
+        )
+        sqlite.write_many("INSERT INTO Comments (p_id, u_id, comment, creation_time) VALUES (?, ?, ?, ?);", comment_rows())
+
+    friendships = sum(len(friend_ids) for friend_ids in friends.values()) // 2
+    return LoadStats(users, friendships, len(post_authors), comment_count)
+
+
+def export_data(path: PathLike | str) -> dict[str, int]:
+    """Writes every row of the loaded tables to a gzip-compressed JSON lines file, and returns the row counts."""
+    counts = {}
+    with gzip.open(path, "wt", compresslevel=6, encoding="utf-8") as file:
+        for table in TABLES:
+            columns = _columns(table)
+            file.write(json.dumps({"table": table, "columns": columns}) + "\n")
+            cursor = sqlite.connection.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY rowid;")
+            counts[table] = 0
+            # Stream the rows in batches rather than holding a whole table in memory
+            while rows := cursor.fetchmany(_BATCH_SIZE):
+                file.writelines(json.dumps(tuple(row), separators=(",", ":")) + "\n" for row in rows)
+                counts[table] += len(rows)
+            cursor.close()
+    return counts
+
+
+def import_data(path: PathLike | str) -> dict[str, int]:
+    """Replaces the rows of the loaded tables with those of an exported file, and returns the row counts."""
+    counts: dict[str, int] = {}
+    with gzip.open(path, "rt", encoding="utf-8") as file, _bulk_load():
+        for table in TABLES:
+            sqlite.write(f"DELETE FROM {table};")
+        sqlite.write("DELETE FROM Timeline;")
+        insert, batch = None, []
+        for line in file:
+            row = json.loads(line)
+            if isinstance(row, dict):
+                if batch:
+                    sqlite.write_many(insert, batch)
+                    batch = []
+                table, columns = _read_header(row)
+                insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))});"
+                counts[table] = 0
+                continue
+            if insert is None:
+                raise ValueError("Import file does not start with a table header")
+            batch.append(row)
+            counts[table] += 1
+            if len(batch) >= _BATCH_SIZE:
+                sqlite.write_many(insert, batch)
+                batch = []
+        if batch:
+            sqlite.write_many(insert, batch)
+    return counts
+
+
+@contextmanager
+def _bulk_load() -> Iterator[None]:
+    """Runs a load in one transaction, without the secondary indexes and triggers of the loaded tables."""
+    placeholders = ", ".join("?" * len(TABLES))
+    dropped = sqlite.read(
+        f"""
+        SELECT type, name, sql FROM sqlite_master
+        WHERE type IN ('index', 'trigger') AND tbl_name IN ({placeholders}) AND sql IS NOT NULL;
+        """,
+        TABLES,
+    )
+    with sqlite.transaction():
+        for row in dropped:
+            sqlite.write(f"DROP {row['type'].upper()} [{row['name']}];")
+        yield
+        # Recompute what the triggers would have maintained, before they are back to fire on it
+        for statement in _REFRESH_DERIVED.split(";"):
+            if statement.strip():
+                sqlite.write(statement + ";")
+        # Indexes first, in one pass over each table, then the triggers
+        for row in sorted(dropped, key=lambda row: row["type"] != "index"):
+            sqlite.write(row["sql"])
+        # The planner statistics of the small tables before the load no longer fit
+        sqlite.write("ANALYZE;")
+    if current_app.config["FEED_MODE"] == "push":
+        from social_insecurity.feed import rebuild_timelines
+
+        rebuild_timelines()
+
+
+def _power_law_graph(user_ids: list[int], links: int, rng: random.Random) -> dict[int, set[int]]:
+    """Returns the friends of each user in a Barabási-Albert graph, where each new user befriends `links` others."""
+    friends: dict[int, set[int]] = {user_id: set() for user_id in user_ids}
+    # Every user appears once per friendship they have, so a uniform pick from it is proportional to degree
+    endpoints: list[int] = []
+    for index, user_id in enumerate(user_ids):
+        if index == 0:
+            continue
+        targets: set[int] = set()
+        while len(targets) < min(links, index):
+            # A few uniform picks keep users without friends from staying unreachable
+            if endpoints and rng.random() > 0.1:
+                targets.add(rng.choice(endpoints))
+            else:
+                targets.add(user_ids[rng.randrange(index)])
+        for target in targets:
+            friends[user_id].add(target)
+            friends[target].add(user_id)
+            endpoints += (user_id, target)
+    return friends
+
+
+def _next_id(table: str) -> int:
+    """Returns the first ID after the existing rows of a table."""
+    return sqlite.read(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table};", one=True)[0]
+
+
+def _columns(table: str) -> list[str]:
+    """Returns the column names of a table."""
+    return [row["name"] for row in sqlite.read(f"PRAGMA table_info({table});")]
+
+
+def _read_header(header: dict[str, Any]) -> tuple[str, list[str]]:
+    """Returns the table and columns of a header line, checking that they exist."""
+    table, columns = header.get("table"), header.get("columns")
+    if table not in TABLES or not columns or not set(columns) <= set(_columns(table)):
+        raise ValueError(f"Unknown table or columns in import: {table} {columns}")
+    return table, columns
+
+
+def _sentence(rng: random.Random, shortest: int, longest: int) -> str:
+    """Returns random words as a sentence."""
+    return " ".join(rng.choices(_WORDS, k=rng.randint(shortest, longest))).capitalize() + "."
+
+
+def _timestamp(moment: datetime) -> str:
+    """Formats a time like CURRENT_TIMESTAMP does."""
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
@@ -0,0 +1,134 @@
+"""Provides live updates of new posts, comments and friend requests.
+
+Routes publish an event to the in-process `EventHub` once their write has committed,
+naming the users who may see it. The hub keeps the most recent events in a ring
+buffer, so a subscriber is nothing more than the ID of the last event it received: it
+waits on a shared condition variable, and when woken takes the events after its ID
+that are meant for it. The ``/events`` route streams them as Server-Sent Events, and
+``/api/v1/events`` returns them to long-polling clients.
+
+A waiting subscriber holds no database connection and no thread of its own beyond the
+one serving its request. Under an async worker (``gunicorn -k gevent``) that is a
+greenlet, so thousands of idle subscribers cost little more than their sockets; with
+threaded workers, streams are closed after ``EVENTS_STREAM_TIMEOUT`` so they cannot
+hold the threads forever, and browsers reconnect and resume from ``Last-Event-ID``.
+
+Events are only delivered to subscribers of the worker process that published them.
+
+Example:
+    from social_insecurity import events
+
+    events.publish("post", {"id": post_id}, audience=friend_ids | {current_user.id})
+    new_events, last_id = events.wait(current_user.id, last_id, timeout=15.0)
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections import deque
+from collections.abc import Iterable, Iterator
+from itertools import islice
+from typing import Any, NamedTuple, Optional
+
+from flask import Flask
+
+
+class Event(NamedTuple):
+    """An event, and the IDs of the users it is delivered to."""
+
+    id: int
+    type: str
+    data: dict[str, Any]
+    audience: frozenset[int]
+
+    def to_sse(self) -> str:
+        """Formats the event as a Server-Sent Event."""
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data)}\n\n"
+
+
+class EventHub:
+    """Provides an in-process publish/subscribe extension for Flask, backed by a ring buffer."""
+
+    def __init__(self, app: Optional[Flask] = None) -> None:
+        """Initializes the extension."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """Initializes the extension."""
+        if "events" in app.extensions:
+            raise RuntimeError("Flask event hub extension already initialized")
+        app.extensions["events"] = self
+
+        self._events: deque[Event] = deque(maxlen=app.config.get("EVENTS_BUFFER_SIZE", 1024))
+        self._last_id = 0
+        self._condition = threading.Condition()
+
+    @property
+    def last_id(self) -> int:
+        """Returns the ID of the latest event, which a new subscriber starts after."""
+        return self._last_id
+
+    def publish(self, type: str, data: dict[str, Any], audience: Iterable[int]) -> Event:
+        """Adds an event for the given users and wakes every waiting subscriber."""
+        with self._condition:
+            self._last_id += 1
+            event = Event(self._last_id, type, data, frozenset(audience))
+            self._events.append(event)
+            self._condition.notify_all()
+        return event
+
+    def since(self, user_id: int, last_id: int) -> tuple[Optional[list[Event]], int]:
+        """Returns the events for the user after the given ID, and the ID to continue after.
+
+        The events are None if some of them were already dropped from the buffer.
+        """
+        with self._condition:
+            return self._since(user_id, last_id), self._last_id
+
+    def wait(self, user_id: int, last_id: int, timeout: float) -> tuple[Optional[list[Event]], int]:
+        """Waits until there are events for the user after the given ID, and returns them like `since`.
+
+        The events are an empty list if there are none within the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                events = self._since(user_id, last_id)
+                remaining = deadline - time.monotonic()
+                if events is None or events or remaining <= 0:
+                    return events, self._last_id
+                # Skip events for other users, so they are not scanned again on the next wake-up
+                last_id = self._last_id
+                self._condition.wait(remaining)
+
+    def stream(self, user_id: int, last_id: int, heartbeat: float, timeout: float) -> Iterator[str]:
+        """Yields the events for the user as Server-Sent Events, with a keep-alive every `heartbeat` seconds.
+
+        Ends after `timeout` seconds, or with a ``reset`` event if the client fell too far behind to resume.
+        """
+        deadline = time.monotonic() + timeout
+        yield f"retry: {int(heartbeat * 1000)}\n\n"
+        while time.monotonic() < deadline:
+            events, last_id = self.wait(user_id, last_id, min(heartbeat, max(0.0, deadline - time.monotonic())))
+            if events is None:
+                yield Event(last_id, "reset", {}, frozenset()).to_sse()
+                return
+            for event in events:
+                yield event.to_sse()
+            # Without data this dispatches nothing, but moves the ID the client resumes from past other users' events
+            yield f"id: {last_id}\n: keep-alive\n\n"
+
+    def _since(self, user_id: int, last_id: int) -> Optional[list[Event]]:
+        """Returns the events for the user after the given ID; the caller must hold the condition."""
+        if last_id > self._last_id:
+            return None  # The client saw the events of an earlier process
+        if not self._events or last_id == self._last_id:
+            return []
+        first_id = self._events[0].id
+        if last_id < first_id - 1:
+            return None
+        # Event IDs are consecutive, so the position of the first new event follows from its ID
+        return [event for event in islice(self._events, last_id + 1 - first_id, None) if user_id in event.audience]
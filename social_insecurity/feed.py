@@ -0,0 +1,262 @@
+"""Provides the post feed shown on the stream page.
+
+The feed is paginated with a keyset (cursor) on ``(creation_time, id)`` instead of
+an offset, so every page is a bounded range scan over the ``Posts(u_id, creation_time)``
+index no matter how long the history of the user and their friends is.
+
+The ``FEED_MODE`` setting selects how the feed is built. In "pull" mode the posts of
+the user and their friends are merged on every read. In "push" mode every new post is
+fanned out on write to the ``Timeline`` rows of its author and their friends, and a
+read is a single range scan over the reader's own timeline.
+
+Example:
+    from social_insecurity.feed import get_feed_page
+
+    page = get_feed_page(current_user.id, cursor=request.args.get("cursor"))
+    for post in page.posts:
+        ...
+    next_url = url_for("stream", cursor=page.next_cursor)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import NamedTuple, Optional
+
+from flask import current_app
+
+from social_insecurity import friend_graph, sqlite
+
+_FEED_FIRST_PAGE = """
+    SELECT p.id, p.content, p.image, p.image_variants, p.creation_time,
+           p.comment_count, p.updated_at, u.username
+    FROM Posts AS p
+    JOIN Users AS u ON u.id = p.u_id
+    WHERE p.u_id IN (SELECT value FROM json_each(?))
+    ORDER BY p.creation_time DESC, p.id DESC
+    LIMIT ?;
+"""
+
+_FEED_NEXT_PAGE = """
+    SELECT p.id, p.content, p.image, p.image_variants, p.creation_time,
+           p.comment_count, p.updated_at, u.username
+    FROM Posts AS p
+    JOIN Users AS u ON u.id = p.u_id
+    WHERE p.u_id IN (SELECT value FROM json_each(?))
+      AND (p.creation_time, p.id) < (?, ?)
+    ORDER BY p.creation_time DESC, p.id DESC
+    LIMIT ?;
+"""
+
+_TIMELINE_FIRST_PAGE = """
+    SELECT p.id, p.content, p.image, p.image_variants, p.creation_time,
+           p.comment_count, p.updated_at, u.username
+    FROM Timeline AS t
+    JOIN Posts AS p ON p.id = t.p_id
+    JOIN Users AS u ON u.id = p.u_id
+    WHERE t.owner_id = ?
+    ORDER BY t.creation_time DESC, t.p_id DESC
+    LIMIT ?;
+"""
+
+_TIMELINE_NEXT_PAGE = """
+    SELECT p.id, p.content, p.image, p.image_variants, p.creation_time,
+           p.comment_count, p.updated_at, u.username
+    FROM Timeline AS t
+    JOIN Posts AS p ON p.id = t.p_id
+    JOIN Users AS u ON u.id = p.u_id
+    WHERE t.owner_id = ? AND (t.creation_time, t.p_id) < (?, ?)
+    ORDER BY t.creation_time DESC, t.p_id DESC
+    LIMIT ?;
+"""
+
+# The (id, updated_at) of the posts on a page, which change whenever the page would: a cheap
+# validator for conditional requests, that neither joins Users nor reads the post content
+_FEED_VERSION = """
+    SELECT p.id, p.updated_at
+    FROM Posts AS p
+    WHERE p.u_id IN (SELECT value FROM json_each(?))
+      AND (p.creation_time, p.id) < (?, ?)
+    ORDER BY p.creation_time DESC, p.id DESC
+    LIMIT ?;
+"""
+
+_TIMELINE_VERSION = """
+    SELECT p.id, p.updated_at
+    FROM Timeline AS t
+    JOIN Posts AS p ON p.id = t.p_id
+    WHERE t.owner_id = ? AND (t.creation_time, t.p_id) < (?, ?)
+    ORDER BY t.creation_time DESC, t.p_id DESC
+    LIMIT ?;
+"""
+
+# Sorts after every stored creation_time, so that the first page can share the query of the next ones
+_FIRST_PAGE_CURSOR = ("9999-12-31 23:59:59", 0)
+
+# The table and index are repeated from schema.sql so that databases created before them can be upgraded in place
+_TIMELINE_REBUILD = """
+    BEGIN;
+    CREATE TABLE IF NOT EXISTS [Timeline](
+      owner_id INTEGER NOT NULL,
+      [creation_time] DATETIME,
+      p_id INTEGER NOT NULL,
+      PRIMARY KEY (owner_id, creation_time, p_id),
+      FOREIGN KEY (owner_id) REFERENCES Users(id),
+      FOREIGN KEY (p_id) REFERENCES Posts(id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS [PostsByAuthorTime] ON [Posts](u_id, creation_time);
+    DELETE FROM Timeline;
+    INSERT INTO Timeline (owner_id, creation_time, p_id)
+    SELECT u_id, creation_time, id FROM Posts
+    UNION ALL
+    SELECT f.u_id, p.creation_time, p.id FROM Friends AS f JOIN Posts AS p ON p.u_id = f.f_id;
+    COMMIT;
+"""
+
+# Triggers and indexes are repeated from schema.sql so that databases created before them can be upgraded in place
+_COMMENT_COUNT_BACKFILL = """
+    BEGIN;
+    CREATE INDEX IF NOT EXISTS [CommentsByPostTime] ON [Comments](p_id, creation_time);
+    CREATE TRIGGER IF NOT EXISTS [CommentsCountInsert] AFTER INSERT ON [Comments]
+    BEGIN
+      UPDATE Posts SET comment_count = comment_count + 1 WHERE id = NEW.p_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS [CommentsCountDelete] AFTER DELETE ON [Comments]
+    BEGIN
+      UPDATE Posts SET comment_count = comment_count - 1 WHERE id = OLD.p_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS [PostsTouch] AFTER UPDATE OF content, [image], image_variants, comment_count ON [Posts]
+    BEGIN
+      UPDATE Posts SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = NEW.id;
+    END;
+    UPDATE Posts SET comment_count = 0;
+    UPDATE Posts SET comment_count = c.n
+    FROM (SELECT p_id, COUNT(*) AS n FROM Comments GROUP BY p_id) AS c
+    WHERE c.p_id = Posts.id;
+    COMMIT;
+"""
+
+
+class FeedPage(NamedTuple):
+    """A single page of the feed and the cursor of the page after it, if any."""
+
+    posts: list[sqlite3.Row]
+    next_cursor: Optional[str]
+
+
+def encode_cursor(creation_time: str, post_id: int) -> str:
+    """Encodes the position of a post in the feed as an opaque cursor."""
+    return urlsafe_b64encode(f"{creation_time}|{post_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    """Decodes a cursor created by `encode_cursor`, raising ValueError if it is malformed."""
+    try:
+        raw = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        creation_time, post_id = raw.rsplit("|", 1)
+        return creation_time, int(post_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid feed cursor: {cursor!r}") from e
+
+
+def get_feed_page(user_id: int, cursor: Optional[str] = None, limit: Optional[int] = None) -> FeedPage:
+    """Fetches the posts of a user and their friends, newest first, starting after the cursor."""
+    limit = limit or current_app.config["FEED_PAGE_SIZE"]
+
+    # Fetch one extra row to find out whether there is a next page without a COUNT(*)
+    if _push_mode():
+        if cursor:
+            creation_time, post_id = decode_cursor(cursor)
+            rows = sqlite.read(_TIMELINE_NEXT_PAGE, (user_id, creation_time, post_id, limit + 1))
+        else:
+            rows = sqlite.read(_TIMELINE_FIRST_PAGE, (user_id, limit + 1))
+    else:
+        authors = json.dumps(sorted(friend_graph.friends_of(user_id) | {user_id}))
+        if cursor:
+            creation_time, post_id = decode_cursor(cursor)
+            rows = sqlite.read(_FEED_NEXT_PAGE, (authors, creation_time, post_id, limit + 1))
+        else:
+            rows = sqlite.read(_FEED_FIRST_PAGE, (authors, limit + 1))
+
+    posts = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = posts[-1]
+        next_cursor = encode_cursor(last["creation_time"], last["id"])
+    return FeedPage(posts, next_cursor)
+
+
+def get_feed_version(user_id: int, cursor: Optional[str] = None, limit: Optional[int] = None) -> str:
+    """Returns a string that changes whenever the feed page `get_feed_page` returns for the same arguments does."""
+    limit = limit or current_app.config["FEED_PAGE_SIZE"]
+    creation_time, post_id = decode_cursor(cursor) if cursor else _FIRST_PAGE_CURSOR
+    if _push_mode():
+        rows = sqlite.read(_TIMELINE_VERSION, (user_id, creation_time, post_id, limit + 1))
+    else:
+        authors = json.dumps(sorted(friend_graph.friends_of(user_id) | {user_id}))
+        rows = sqlite.read(_FEED_VERSION, (authors, creation_time, post_id, limit + 1))
+    return hashlib.sha1(json.dumps([tuple(row) for row in rows]).encode()).hexdigest()
+
+
+def create_post(author_id: int, content: str, image: Optional[str] = None) -> int:
+    """Stores a new post and, in push mode, fans it out to the timelines of the author and their friends."""
+    insert_post = """
+      INSERT INTO Posts (u_id, content, image, creation_time, updated_at)
+      VALUES (?, ?, ?, CURRENT_TIMESTAMP, strftime('%Y-%m-%d %H:%M:%f', 'now'));
+    """
+    with sqlite.transaction():
+        post_id = sqlite.write(insert_post, (author_id, content, image))
+        if _push_mode():
+            # Friends are read in the transaction rather than from the friend cache, which may be stale
+            fan_out = """
+              INSERT INTO Timeline (owner_id, creation_time, p_id)
+              SELECT owners.id, p.creation_time, p.id
+              FROM Posts AS p, (SELECT ?1 AS id UNION SELECT f_id FROM Friends WHERE u_id = ?1) AS owners
+              WHERE p.id = ?2;
+            """
+            sqlite.write(fan_out, (author_id, post_id))
+    return post_id
+
+
+def backfill_timelines(user_id: int, friend_id: int) -> None:
+    """Copies the most recent posts of two new friends into each other's timelines, in push mode."""
+    if not _push_mode():
+        return
+    backfill = """
+      INSERT OR IGNORE INTO Timeline (owner_id, creation_time, p_id)
+      SELECT ?, creation_time, id FROM Posts
+      WHERE u_id = ?
+      ORDER BY creation_time DESC, id DESC
+      LIMIT ?;
+    """
+    limit = current_app.config["TIMELINE_BACKFILL_SIZE"]
+    sqlite.write_many(backfill, [(user_id, friend_id, limit), (friend_id, user_id, limit)])
+
+
+def rebuild_timelines() -> None:
+    """Creates the Timeline table if needed and recreates every timeline from Posts and Friends, e.g. for push mode."""
+    sqlite.connection.executescript(_TIMELINE_REBUILD)
+
+
+def _push_mode() -> bool:
+    """Returns whether the feed is materialized on write rather than computed on read."""
+    return current_app.config["FEED_MODE"] == "push"
+
+
+def backfill_comment_counts() -> None:
+    """Adds Posts.comment_count, Posts.updated_at and Posts.image_variants, and recomputes the comment counts.
+
+    The triggers that keep the first two up to date and the index of comments by post are added too.
+    """
+    columns = {row["name"] for row in sqlite.read("PRAGMA table_info(Posts);")}
+    if "image_variants" not in columns:
+        sqlite.write("ALTER TABLE Posts ADD COLUMN image_variants VARCHAR;")
+    if "comment_count" not in columns:
+        sqlite.write("ALTER TABLE Posts ADD COLUMN comment_count INTEGER NOT NULL DEFAULT 0;")
+    if "updated_at" not in columns:
+        sqlite.write("ALTER TABLE Posts ADD COLUMN updated_at DATETIME;")
+        sqlite.write("UPDATE Posts SET updated_at = creation_time WHERE updated_at IS NULL;")
+    sqlite.connection.executescript(_COMMENT_COUNT_BACKFILL)
@@ -0,0 +1,93 @@
+"""Provides caching of rendered template fragments for the Social Insecurity application.
+
+A ``{% cache key %}`` block in a template is rendered once and then served from an
+in-process cache until its entry expires or is evicted. Keys are tuples whose first
+items name what the fragment shows, and that end with something that changes whenever
+the fragment would render differently, such as ``Posts.updated_at``:
+
+    {% cache ("post", post.id, post.updated_at) %}
+      ...
+    {% endcache %}
+
+Because the key changes when the row does, a worker process never serves a fragment
+older than the row it read. Entries for a post are also evicted as soon as it changes
+in this process, see `FragmentCache.evict`, so that they do not take up space until
+they expire. Only fragments that look the same to every viewer may be cached.
+
+Example:
+    from social_insecurity import fragments
+
+    fragments.evict("post", post_id)
+"""
+
+from __future__ import annotations
+
+from collections.abc import Hashable
+from typing import Any, Callable, Optional
+
+from flask import Flask
+from jinja2 import nodes
+from jinja2.ext import Extension
+from jinja2.parser import Parser
+from markupsafe import Markup
+
+from social_insecurity.cache import TTLCache
+
+
+class FragmentCache:
+    """Provides a fragment cache extension for Flask, adding the ``{% cache %}`` tag to its templates."""
+
+    def __init__(self, app: Optional[Flask] = None) -> None:
+        """Initializes the extension."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """Initializes the extension."""
+        if "fragments" in app.extensions:
+            raise RuntimeError("Flask fragment cache extension already initialized")
+        app.extensions["fragments"] = self
+
+        self._fragments = TTLCache(
+            maxsize=app.config.get("FRAGMENT_CACHE_SIZE", 2048),
+            ttl=app.config.get("FRAGMENT_CACHE_TTL", 300.0),
+        )
+        self.enabled = app.config.get("FRAGMENT_CACHE_ENABLED", True)
+        app.jinja_env.add_extension(FragmentCacheExtension)
+        app.jinja_env.fragment_cache = self
+
+    def render(self, key: Hashable, ttl: Optional[float], render: Callable[[], str]) -> Markup:
+        """Returns the cached fragment for the key, rendering and caching it if it is missing."""
+        if not self.enabled:
+            return Markup(render())
+        fragment = self._fragments.get(key)
+        if fragment is None:
+            fragment = Markup(render())
+            self._fragments.set(key, fragment, ttl)
+        return fragment
+
+    def evict(self, *prefix: Any) -> int:
+        """Removes every fragment whose key starts with the given items, and returns how many were removed."""
+        return self._fragments.delete_where(lambda key: isinstance(key, tuple) and key[: len(prefix)] == prefix)
+
+    def clear(self) -> None:
+        """Removes every cached fragment."""
+        self._fragments.clear()
+
+
+class FragmentCacheExtension(Extension):
+    """Adds the ``{% cache key[, ttl] %} ... {% endcache %}`` tag to Jinja."""
+
+    tags = {"cache"}
+
+    def parse(self, parser: Parser) -> nodes.Node:
+        """Parses the key and optional time-to-live of a cache block, and its body."""
+        lineno = next(parser.stream).lineno
+        key = parser.parse_expression()
+        ttl = parser.parse_expression() if parser.stream.skip_if("comma") else nodes.Const(None)
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        return nodes.CallBlock(self.call_method("_render", [key, ttl]), [], [], body).set_lineno(lineno)
+
+    def _render(self, key: Hashable, ttl: Optional[float], caller: Callable[[], str]) -> Markup:
+        """Renders a cache block through the fragment cache of the app."""
+        return self.environment.fragment_cache.render(key, ttl, caller)
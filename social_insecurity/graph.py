@@ -0,0 +1,103 @@
+"""Provides cached, batched access to the friendship graph.
+
+Each user's friends are kept in an in-process adjacency cache as a frozenset of user
+IDs. Cache misses for many users are loaded together with a single query, and writes
+go through `FriendGraph.add_friendship`, which updates the cache once the write commits.
+
+Example:
+    from social_insecurity import friend_graph
+
+    friend_ids = friend_graph.friends_of(current_user.id)
+    suggestions = friend_graph.suggestions(current_user.id, limit=5)
+"""
+
+from __future__ import annotations
+
+import json
+from collections import Counter
+from collections.abc import Iterable
+from typing import Optional
+
+from flask import Flask
+
+from social_insecurity.cache import TTLCache
+from social_insecurity.database import SQLite3
+
+
+class FriendGraph:
+    """Provides a friend graph extension for Flask, backed by the Friends table."""
+
+    def __init__(self, app: Optional[Flask] = None) -> None:
+        """Initializes the extension."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """Initializes the extension; the SQLite3 extension must be initialized first."""
+        if "friend_graph" in app.extensions:
+            raise RuntimeError("Flask friend graph extension already initialized")
+        app.extensions["friend_graph"] = self
+
+        self._db: SQLite3 = app.extensions["sqlite3"]
+        self._adjacency = TTLCache(
+            maxsize=app.config.get("FRIEND_GRAPH_CACHE_SIZE", 4096),
+            ttl=app.config.get("FRIEND_GRAPH_CACHE_TTL", 300.0),
+        )
+
+    def friends_of(self, user_id: int) -> frozenset[int]:
+        """Returns the IDs of the friends of a user."""
+        return self.friends_of_many([user_id])[user_id]
+
+    def friends_of_many(self, user_ids: Iterable[int]) -> dict[int, frozenset[int]]:
+        """Returns the IDs of the friends of each of the users, loading all cache misses in one query."""
+        result, missing = {}, set()
+        for user_id in user_ids:
+            friends = self._adjacency.get(user_id)
+            if friends is None:
+                missing.add(user_id)
+            else:
+                result[user_id] = friends
+
+        if missing:
+            loaded: dict[int, set[int]] = {user_id: set() for user_id in missing}
+            query = "SELECT u_id, f_id FROM Friends WHERE u_id IN (SELECT value FROM json_each(?));"
+            # Cached friends outlive a replica's lag, so they are only read from the primary
+            for u_id, f_id in self._db.read(query, (json.dumps(sorted(missing)),), primary=True):
+                loaded[u_id].add(f_id)
+            for user_id, friends in loaded.items():
+                result[user_id] = frozenset(friends)
+                self._adjacency.set(user_id, result[user_id])
+        return result
+
+    def mutual_friend_counts(self, user_id: int, other_ids: Iterable[int]) -> dict[int, int]:
+        """Returns the number of friends the user has in common with each of the other users."""
+        friends = self.friends_of(user_id)
+        return {other: len(friends & theirs) for other, theirs in self.friends_of_many(other_ids).items()}
+
+    def suggestions(self, user_id: int, limit: int = 5) -> list[tuple[int, int]]:
+        """Returns up to `limit` (user ID, mutual friend count) pairs of friends of friends, most mutual first."""
+        friends = self.friends_of(user_id)
+        mutual: Counter[int] = Counter()
+        for theirs in self.friends_of_many(friends).values():
+            mutual.update(theirs)
+        for excluded in friends | {user_id}:
+            mutual.pop(excluded, None)
+        return sorted(mutual.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+    def add_friendship(self, user_id: int, friend_id: int) -> None:
+        """Stores a friendship in both directions and updates the cache when the write commits."""
+        insert_friend = "INSERT OR IGNORE INTO Friends (u_id, f_id) VALUES (?, ?);"
+        self._db.write_many(insert_friend, [(user_id, friend_id), (friend_id, user_id)])
+        self._db.after_commit(lambda: self._link(user_id, friend_id))
+
+    def invalidate(self, *user_ids: int) -> None:
+        """Drops the cached friends of the users, e.g. after the Friends table was changed directly."""
+        for user_id in user_ids:
+            self._adjacency.delete(user_id)
+
+    def _link(self, user_id: int, friend_id: int) -> None:
+        """Adds an edge to the cached adjacency sets of both users, if they are cached."""
+        for a, b in ((user_id, friend_id), (friend_id, user_id)):
+            friends = self._adjacency.get(a)
+            if friends is not None:
+                self._adjacency.set(a, friends | {b})
@@ -0,0 +1,114 @@
+"""Provides resized variants of uploaded images for the Social Insecurity application.
+
+After a post with an image is stored, a background thread writes a smaller copy of the
+image for every width in ``IMAGE_VARIANT_WIDTHS`` next to the original, and records
+them on the post, so that the feed can let the browser pick the smallest suitable one
+through ``srcset`` instead of downloading the full-size original.
+
+Resizing requires Pillow (``poetry install -E images``); without it, posts simply keep
+their original image only.
+
+Example:
+    from social_insecurity import images
+
+    post_id = create_post(current_user.id, content, filename)
+    images.submit(post_id, filename)
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Optional
+
+from flask import Flask, url_for
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - Pillow is an optional dependency
+    Image = None
+
+
+class ImagePipeline:
+    """Provides an image variant extension for Flask, resizing uploads on a background thread."""
+
+    def __init__(self, app: Optional[Flask] = None) -> None:
+        """Initializes the extension."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """Initializes the extension and registers the `srcset` template filter."""
+        if "images" in app.extensions:
+            raise RuntimeError("Flask image pipeline extension already initialized")
+        app.extensions["images"] = self
+
+        self._app = app
+        self.widths = sorted(app.config.get("IMAGE_VARIANT_WIDTHS", ()))
+        self.enabled = Image is not None and bool(self.widths)
+        self._executor = ThreadPoolExecutor(
+            max_workers=app.config.get("IMAGE_WORKERS", 1), thread_name_prefix="image-variants"
+        )
+        app.add_template_filter(srcset)
+
+    def submit(self, post_id: int, filename: str) -> Optional[Future]:
+        """Queues the creation of the variants of a stored upload; returns None if resizing is unavailable."""
+        if not self.enabled:
+            return None
+        return self._executor.submit(self._process, post_id, filename)
+
+    def _process(self, post_id: int, filename: str) -> None:
+        """Writes the variants of an upload and records their names on the post."""
+        from social_insecurity import fragments, sqlite
+
+        upload_folder = Path(self._app.instance_path) / self._app.config["UPLOADS_FOLDER_PATH"]
+        try:
+            variants = make_variants(upload_folder / filename, self.widths)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            self._app.logger.exception("Could not create image variants of %s", filename)
+            return
+        with self._app.app_context():
+            update_post = "UPDATE Posts SET image_variants = ? WHERE id = ?;"
+            sqlite.write(update_post, (json.dumps(variants), post_id))
+        fragments.evict("post", post_id)
+
+
+def make_variants(path: Path, widths: list[int]) -> dict[str, str]:
+    """Writes a copy of the image for every width smaller than its own, and returns the file name for each width.
+
+    The mapping includes the original image under its own width. Variants that already exist are kept.
+    """
+    with Image.open(path) as image:
+        variants = {str(image.width): path.name}
+        if getattr(image, "is_animated", False):
+            # Resizing would keep only the first frame of an animation
+            return variants
+        for width in widths:
+            if width >= image.width:
+                break
+            name = f"{path.stem}_{width}w{path.suffix}"
+            variants[str(width)] = name
+            # Uploads are named by their content, so an existing variant is already the right one
+            if path.with_name(name).exists():
+                continue
+            height = max(1, round(image.height * width / image.width))
+            options: dict[str, Any] = {"quality": 85} if image.format == "JPEG" else {}
+            # Variants are served as immutable, so one must never be read while half written
+            temporary = path.with_name(f"{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            try:
+                image.resize((width, height), Image.Resampling.LANCZOS).save(temporary, format=image.format, **options)
+                os.replace(temporary, path.with_name(name))
+            finally:
+                temporary.unlink(missing_ok=True)
+    return variants
+
+
+def srcset(variants: Optional[str]) -> str:
+    """Formats the JSON variant mapping stored on a post as the value of an ``srcset`` attribute."""
+    if not variants:
+        return ""
+    widths = sorted(json.loads(variants).items(), key=lambda item: int(item[0]))
+    return ", ".join(f"{url_for('uploads', filename=name)} {width}w" for width, name in widths)
@@ -0,0 +1,485 @@
+"""Provides a load generator that runs concurrent virtual users against the application.
+
+`run` serves the app on a local port with werkzeug's threaded WSGI server, or targets an
+already running server, and starts one asyncio task per virtual user. Each logs in as a
+seeded user (see ``flask seed``) and then picks weighted scenarios: reading the stream,
+posting, commenting, looking at friends, sending and accepting friend requests, and
+searching. Forms are first fetched as a browser would, and their hidden ``FlaskForm``
+fields, including the CSRF token, are sent back with the submission.
+
+Requests go through `HttpClient`, a small HTTP/1.1 client on asyncio streams with a
+cookie jar and one keep-alive connection per virtual user, so nothing outside the
+standard library is needed and nothing leaves the machine.
+
+The report lists the throughput, error rate and latency percentiles of every step, and a
+histogram of all latencies. When the app is served locally, exceptions raised by its
+views are counted too, with "database is locked" errors apart from the rest.
+
+Example:
+    flask seed --users 1000
+    flask loadtest --users 50 --duration 60
+"""
+
+from __future__ import annotations
+
+import asyncio
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+from collections.abc import Awaitable, Iterable
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+from typing import Any, Callable, NamedTuple, Optional
+from urllib.parse import urlencode, urlsplit
+
+from flask import Flask, got_request_exception
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler, make_server
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+HISTOGRAM_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf"))
+
+_SEARCH_WORDS = ("coffee", "weekend", "music", "party", "holiday", "football", "the")
+
+
+class Response(NamedTuple):
+    """The status, headers and body of an HTTP response; header names are lowercase."""
+
+    status: int
+    headers: dict[str, str]
+    body: bytes
+
+    @property
+    def text(self) -> str:
+        return self.body.decode("utf-8", "replace")
+
+
+class HttpClient:
+    """Sends HTTP/1.1 requests over one keep-alive connection, keeping the cookies the server sets."""
+
+    def __init__(self, base_url: str, headers: Optional[dict[str, str]] = None, timeout: float = 30.0) -> None:
+        """Initializes the client without connecting."""
+        url = urlsplit(base_url)
+        self.host = url.hostname or "127.0.0.1"
+        self.port = url.port or 80
+        self.headers = dict(headers or {})
+        self.timeout = timeout
+        self.cookies: dict[str, str] = {}
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def get(self, path: str) -> Response:
+        return await self.request("GET", path)
+
+    async def post(self, path: str, form: dict[str, str]) -> Response:
+        return await self.request("POST", path, form)
+
+    async def request(self, method: str, path: str, form: Optional[dict[str, str]] = None) -> Response:
+        """Sends a request, with `form` URL-encoded as its body, and reads the whole response."""
+        body = urlencode(form).encode() if form is not None else b""
+        headers = {"Host": f"{self.host}:{self.port}", "Content-Length": str(len(body)), **self.headers}
+        if form is not None:
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{name}={value}" for name, value in self.cookies.items())
+        head = f"{method} {path} HTTP/1.1\r\n" + "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        message = head.encode("latin-1") + b"\r\n" + body
+
+        reused = self._writer is not None
+        try:
+            return await asyncio.wait_for(self._send(message), self.timeout)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            await self.close()
+            if not reused:
+                raise
+        # The server may close an idle keep-alive connection at any time, so retry once on a new one
+        return await asyncio.wait_for(self._send(message), self.timeout)
+
+    async def close(self) -> None:
+        """Closes the connection, if it is open."""
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _send(self, message: bytes) -> Response:
+        """Writes a request on the connection, opening it if needed, and reads the response."""
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        reader, writer = self._reader, self._writer
+        writer.write(message)
+        await writer.drain()
+
+        status_line, *header_lines = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+        version, status = status_line.split(" ", 2)[:2]
+        headers: dict[str, str] = {}
+        for line in filter(None, header_lines):
+            name, _, value = line.partition(":")
+            name, value = name.strip().lower(), value.strip()
+            if name == "set-cookie":
+                self._set_cookie(value)
+            headers[name] = value
+
+        if "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            body = await self._read_chunked(reader)
+        else:
+            body = await reader.read()  # The end of the body is the end of the connection
+            headers["connection"] = "close"
+        if headers.get("connection", "").lower() == "close" or version == "HTTP/1.0":
+            await self.close()
+        return Response(int(status), headers, body)
+
+    @staticmethod
+    async def _read_chunked(reader: asyncio.StreamReader) -> bytes:
+        """Reads a body sent with chunked transfer encoding."""
+        chunks = []
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            if size == 0:
+                await reader.readuntil(b"\r\n")
+                return b"".join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+    def _set_cookie(self, header: str) -> None:
+        """Stores a cookie from a Set-Cookie header, or removes it if the server cleared it."""
+        name, _, value = header.split(";", 1)[0].partition("=")
+        if value and "expires=thu, 01 jan 1970" not in header.lower():
+            self.cookies[name.strip()] = value.strip()
+        else:
+            self.cookies.pop(name.strip(), None)
+
+
+class _FormParser(HTMLParser):
+    """Collects the hidden inputs of a page and the links to the comments of posts."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.hidden: dict[str, list[str]] = {}
+        self.post_links: list[str] = []
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, Optional[str]]]) -> None:
+        attributes = dict(attrs)
+        if tag == "input" and attributes.get("type") == "hidden" and attributes.get("name"):
+            self.hidden.setdefault(attributes["name"], []).append(attributes.get("value") or "")
+        elif tag == "a" and (attributes.get("href") or "").startswith("/comments/"):
+            self.post_links.append(attributes["href"])
+
+
+def parse_page(html: str) -> _FormParser:
+    """Returns the hidden form inputs, such as CSRF tokens, and post links of a page."""
+    parser = _FormParser()
+    parser.feed(html)
+    return parser
+
+
+def hidden_fields(html: str) -> dict[str, str]:
+    """Returns the first value of every hidden input of a page, to send back with a form."""
+    return {name: values[0] for name, values in parse_page(html).hidden.items()}
+
+
+@dataclass
+class StepStats:
+    """The latencies and outcomes of one kind of request."""
+
+    latencies: list[float] = field(default_factory=list)
+    statuses: Counter = field(default_factory=Counter)
+    errors: int = 0
+
+
+@dataclass
+class Report:
+    """The results of a load test run."""
+
+    duration: float = 0.0
+    virtual_users: int = 0
+    steps: dict[str, StepStats] = field(default_factory=dict)
+    exceptions: Counter = field(default_factory=Counter)
+
+    def record(self, step: str, latency_ms: float, status: Optional[int], ok: bool) -> None:
+        """Records one request of a step; a status of None means that no response was received."""
+        stats = self.steps.setdefault(step, StepStats())
+        stats.latencies.append(latency_ms)
+        stats.statuses[status or "failed"] += 1
+        if not ok:
+            stats.errors += 1
+
+    def format(self) -> str:
+        """Formats the report as text."""
+        requests = sum(len(stats.latencies) for stats in self.steps.values())
+        errors = sum(stats.errors for stats in self.steps.values())
+        lines = [
+            f"{self.virtual_users} virtual users for {self.duration:.1f} s: {requests} requests, "
+            f"{requests / self.duration if self.duration else 0:.1f} requests/s, "
+            f"{errors} errors ({errors / requests if requests else 0:.2%})",
+            "",
+            f"{'step':<32}{'requests':>9}{'req/s':>8}{'errors':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}",
+        ]
+        for step, stats in sorted(self.steps.items()):
+            p50, p95, p99 = _percentiles(stats.latencies)
+            count = len(stats.latencies)
+            lines.append(
+                f"{step:<32}{count:>9}{count / self.duration if self.duration else 0:>8.1f}"
+                f"{stats.errors / count:>9.1%}{p50:>9.1f}{p95:>9.1f}{p99:>9.1f}"
+            )
+
+        failing = [(step, stats) for step, stats in sorted(self.steps.items()) if stats.errors]
+        if failing:
+            lines += ["", "Responses of steps with errors:"]
+            for step, stats in failing:
+                statuses = ", ".join(f"{status} x{count}" for status, count in stats.statuses.most_common())
+                lines.append(f"  {step}: {statuses}")
+
+        if self.exceptions:
+            lines += ["", "Server exceptions:"]
+            lines += [f"  {count:>6}  {message}" for message, count in self.exceptions.most_common()]
+
+        latencies = [latency for stats in self.steps.values() for latency in stats.latencies]
+        if latencies:
+            lines += ["", "Latency histogram:"]
+            counts = Counter(next(bound for bound in HISTOGRAM_BUCKETS if latency <= bound) for latency in latencies)
+            widest = max(counts.values())
+            for bound in HISTOGRAM_BUCKETS:
+                label = f"<= {bound:g} ms" if bound != float("inf") else f"> {HISTOGRAM_BUCKETS[-2]:g} ms"
+                bar = "#" * round(40 * counts[bound] / widest)
+                lines.append(f"  {label:>12} {counts[bound]:>8} {bar}")
+        return "\n".join(lines)
+
+
+class VirtualUser:
+    """Logs in as a seeded user and runs weighted scenarios until the deadline."""
+
+    def __init__(
+        self,
+        client: HttpClient,
+        username: str,
+        password: str,
+        usernames: list[str],
+        report: Report,
+        rng: random.Random,
+        think_time: float,
+    ) -> None:
+        self.client = client
+        self.username = username
+        self.password = password
+        self.usernames = usernames
+        self.report = report
+        self.rng = rng
+        self.think_time = think_time
+        self.post_links: list[str] = []
+
+    async def run(self, deadline: float) -> None:
+        """Logs in, then runs scenarios until the deadline."""
+        try:
+            if not await self.log_in(deadline):
+                return
+            scenarios = list(SCENARIOS)
+            weights = [weight for weight, _ in SCENARIOS.values()]
+            while time.monotonic() < deadline:
+                _, scenario = SCENARIOS[self.rng.choices(scenarios, weights)[0]]
+                await scenario(self)
+                if self.think_time:
+                    await asyncio.sleep(self.rng.expovariate(1 / self.think_time))
+        finally:
+            await self.client.close()
+
+    async def log_in(self, deadline: float) -> bool:
+        """Logs in through the form on the index page, retrying while the server sheds logins with a 503."""
+        while time.monotonic() < deadline:
+            page = await self.step("GET /", "/")
+            if page is None:
+                return False
+            form = {
+                **hidden_fields(page.text),
+                "login-username": self.username,
+                "login-password": self.password,
+                "login-submit": "Sign In",
+            }
+            response = await self.step("POST / (login)", "/", form, expect=(302,), retry=(503,))
+            if response is None:
+                return False
+            if response.status == 302:
+                return response.headers.get("location", "").endswith("/stream")
+            await asyncio.sleep(float(response.headers.get("retry-after", 1)))
+        return False
+
+    async def step(
+        self,
+        name: str,
+        path: str,
+        form: Optional[dict[str, str]] = None,
+        expect: Iterable[int] = (200,),
+        retry: Iterable[int] = (),
+    ) -> Optional[Response]:
+        """Sends one request and records its latency and outcome; returns None if it failed.
+
+        Responses with a status in `retry` are returned without counting as errors, for the caller to retry.
+        """
+        start = time.perf_counter()
+        try:
+            response = await self.client.request("GET" if form is None else "POST", path, form)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            self.report.record(name, (time.perf_counter() - start) * 1000, None, False)
+            return None
+        ok = response.status in expect or response.status in retry
+        if not ok and b"database is locked" in response.body:
+            self.report.exceptions["database is locked (from response)"] += 1
+        self.report.record(name, (time.perf_counter() - start) * 1000, response.status, ok)
+        return response if ok else None
+
+    async def read_stream(self) -> Optional[Response]:
+        page = await self.step("GET /stream", "/stream")
+        if page is not None:
+            links = parse_page(page.text).post_links
+            if links:
+                self.post_links = links
+        return page
+
+    async def write_post(self) -> None:
+        page = await self.read_stream()
+        if page is not None:
+            form = {**hidden_fields(page.text), "content": self._sentence(), "submit": "Post"}
+            await self.step("POST /stream", "/stream", form, expect=(302,))
+
+    async def write_comment(self) -> None:
+        if not self.post_links:
+            await self.read_stream()
+            return
+        link = self.rng.choice(self.post_links)
+        page = await self.step("GET /comments", link)
+        if page is not None:
+            form = {**hidden_fields(page.text), "comment": self._sentence(), "submit": "Comment"}
+            await self.step("POST /comments", link, form, expect=(302,))
+
+    async def view_friends(self) -> None:
+        await self.step("GET /friends", "/friends")
+
+    async def send_friend_request(self) -> None:
+        page = await self.step("GET /friends", "/friends")
+        if page is not None:
+            form = {**hidden_fields(page.text), "username": self.rng.choice(self.usernames), "submit": "Add Friend"}
+            await self.step("POST /friends", "/friends", form, expect=(200, 302))
+
+    async def accept_friend_request(self) -> None:
+        page = await self.step("GET /friends", "/friends")
+        if page is None:
+            return
+        request_ids = parse_page(page.text).hidden.get("request_id")
+        if request_ids:
+            # Every form on the page carries the same session's CSRF token
+            form = {**hidden_fields(page.text), "request_id": self.rng.choice(request_ids), "action": "accept"}
+            await self.step("POST /handle_friend_request", "/handle_friend_request", form, expect=(302,))
+
+    async def search(self) -> None:
+        await self.step("GET /search", "/search?" + urlencode({"q": self.rng.choice(_SEARCH_WORDS)}))
+
+    async def api_feed(self) -> None:
+        await self.step("GET /api/v1/feed", "/api/v1/feed")
+
+    def _sentence(self) -> str:
+        return " ".join(self.rng.choices(_SEARCH_WORDS, k=self.rng.randint(3, 12))).capitalize()
+
+
+# The relative weight of each scenario, and the coroutine that runs it
+SCENARIOS: dict[str, tuple[int, Callable[[VirtualUser], Awaitable[Any]]]] = {
+    "read_stream": (40, VirtualUser.read_stream),
+    "write_post": (10, VirtualUser.write_post),
+    "write_comment": (15, VirtualUser.write_comment),
+    "view_friends": (15, VirtualUser.view_friends),
+    "send_friend_request": (5, VirtualUser.send_friend_request),
+    "accept_friend_request": (5, VirtualUser.accept_friend_request),
+    "search": (5, VirtualUser.search),
+    "api_feed": (5, VirtualUser.api_feed),
+}
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    """Keeps connections alive between requests, and does not log every request."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_request(self, *args: Any, **kwargs: Any) -> None:
+        pass
+
+
+def serve(app: Flask, host: str = "127.0.0.1", port: int = 0) -> BaseWSGIServer:
+    """Serves the app with a threaded WSGI server on a background thread; port 0 picks a free port."""
+    server = make_server(host, port, app, threaded=True, request_handler=_QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, name="loadtest-server", daemon=True).start()
+    return server
+
+
+def run(
+    app: Flask,
+    usernames: list[str],
+    password: str,
+    virtual_users: int = 20,
+    duration: float = 30.0,
+    think_time: float = 0.0,
+    url: Optional[str] = None,
+    seed: Optional[int] = None,
+) -> Report:
+    """Runs the load test against the app served locally, or against the server at `url`, and returns the report."""
+    report = Report(virtual_users=virtual_users)
+
+    def count_exception(sender: Flask, exception: BaseException, **extra: Any) -> None:
+        report.exceptions[str(exception) if "database is locked" in str(exception) else type(exception).__name__] += 1
+
+    server = None
+    if url is None:
+        server = serve(app)
+        url = f"http://{server.host}:{server.port}"
+        got_request_exception.connect(count_exception, app)
+    try:
+        asyncio.run(_run(url, usernames, password, report, virtual_users, duration, think_time, seed))
+    finally:
+        if server is not None:
+            got_request_exception.disconnect(count_exception, app)
+            server.shutdown()
+    return report
+
+
+async def _run(
+    url: str,
+    usernames: list[str],
+    password: str,
+    report: Report,
+    virtual_users: int,
+    duration: float,
+    think_time: float,
+    seed: Optional[int],
+) -> None:
+    """Runs the virtual users concurrently until the duration has passed."""
+    rng = random.Random(seed)
+    # Flask-Talisman only serves HTTPS, and a proxy in front of the app would set this header
+    headers = {"X-Forwarded-Proto": "https"}
+    users = [
+        VirtualUser(
+            HttpClient(url, headers),
+            usernames[index % len(usernames)],
+            password,
+            usernames,
+            report,
+            random.Random(rng.random()),
+            think_time,
+        )
+        for index in range(virtual_users)
+    ]
+    start = time.monotonic()
+    await asyncio.gather(*(user.run(start + duration) for user in users))
+    report.duration = time.monotonic() - start
+
+
+def _percentiles(latencies: list[float]) -> tuple[float, float, float]:
+    """Returns the 50th, 95th and 99th percentile of the latencies."""
+    if len(latencies) < 2:
+        latency = latencies[0] if latencies else 0.0
+        return latency, latency, latency
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return quantiles[49], quantiles[94], quantiles[98]
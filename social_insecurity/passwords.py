@@ -0,0 +1,123 @@
+"""Provides password hashing for the Social Insecurity application.
+
+Passwords are hashed with bcrypt on a bounded pool of worker processes, so that a burst
+of logins cannot tie up every request thread with CPU-bound key derivation. When more
+than ``PASSWORD_HASH_QUEUE_LIMIT`` jobs are pending, new ones are refused right away
+with `HasherBusy` instead of queueing without bound. Waiting longer than
+``PASSWORD_HASH_TIMEOUT`` for a result raises `HasherBusy` too.
+
+Hashes created by werkzeug's `generate_password_hash` are still accepted, and can be
+replaced with a bcrypt hash after a successful login, see `PasswordHasher.needs_rehash`.
+
+Example:
+    from social_insecurity import passwords
+
+    pwhash = passwords.hash("Password123!")
+    if passwords.check(pwhash, "Password123!"):
+        ...
+"""
+
+from __future__ import annotations
+
+import atexit
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Optional
+
+import bcrypt
+from flask import Flask
+from werkzeug.security import check_password_hash
+
+
+class HasherBusy(RuntimeError):
+    """Raised when the password hashing queue is full, or a job takes longer than ``PASSWORD_HASH_TIMEOUT``."""
+
+
+def _hash_password(password: str, rounds: int) -> str:
+    """Hashes a password with bcrypt; runs in a worker process."""
+    # bcrypt only uses the first 72 bytes of a password and newer versions refuse longer ones
+    return bcrypt.hashpw(password.encode()[:72], bcrypt.gensalt(rounds)).decode()
+
+
+def _check_password(pwhash: str, password: str) -> bool:
+    """Checks a password against a bcrypt or werkzeug hash; runs in a worker process."""
+    if pwhash.startswith("$2"):
+        return bcrypt.checkpw(password.encode()[:72], pwhash.encode())
+    return check_password_hash(pwhash, password)
+
+
+class PasswordHasher:
+    """Provides a password hashing extension for Flask, backed by a bounded process pool."""
+
+    def __init__(self, app: Optional[Flask] = None) -> None:
+        """Initializes the extension."""
+        self._executor: Optional[ProcessPoolExecutor] = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """Initializes the extension; the worker processes are only started on first use."""
+        if "passwords" in app.extensions:
+            raise RuntimeError("Flask password hashing extension already initialized")
+        app.extensions["passwords"] = self
+
+        self.rounds = app.config.get("BCRYPT_LOG_ROUNDS", 12)
+        self.workers = app.config.get("PASSWORD_HASH_WORKERS", 2)
+        self.timeout = app.config.get("PASSWORD_HASH_TIMEOUT", 10.0)
+        self._slots = threading.BoundedSemaphore(app.config.get("PASSWORD_HASH_QUEUE_LIMIT", 8))
+        self._lock = threading.Lock()
+
+    def hash(self, password: str) -> str:
+        """Returns a bcrypt hash of the password."""
+        return self._run(_hash_password, password, self.rounds)
+
+    def check(self, pwhash: str, password: str) -> bool:
+        """Returns whether the password matches the hash, raising ValueError if the hash is malformed."""
+        return self._run(_check_password, pwhash, password)
+
+    def needs_rehash(self, pwhash: str) -> bool:
+        """Returns whether the hash uses another algorithm or cost than new hashes would."""
+        return not pwhash.startswith("$2") or int(pwhash.split("$")[2]) != self.rounds
+
+    def shutdown(self) -> None:
+        """Stops the worker processes, if they were started."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _run(self, function: Callable[..., Any], *args: Any) -> Any:
+        """Runs the function on the pool and waits for its result, or raises HasherBusy if the queue is full.
+
+        HasherBusy is also raised if the result takes longer than ``PASSWORD_HASH_TIMEOUT``; the job keeps its
+        queue slot until it finishes.
+        """
+        if self.workers == 0:
+            return function(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy("Too many password hashing jobs are pending")
+        try:
+            future = self._get_executor().submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._release_slot)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise HasherBusy("Password hashing took too long") from None
+
+    def _release_slot(self, _: Future) -> None:
+        """Frees the queue slot of a finished job."""
+        self._slots.release()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Returns the process pool, starting it on first use."""
+        with self._lock:
+            if self._executor is None:
+                # Spawn rather than fork, so the workers do not inherit the threads and connections of the app
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+                atexit.register(self.shutdown)
+            return self._executor
@@ -0,0 +1,107 @@
+"""Provides the named queries of the Social Insecurity application.
+
+The SQL run by the routes and the JSON API lives in ``queries.sql``, one statement per
+``-- name: <name>`` header. The file is loaded once at startup, every statement is
+normalized to a single line, and each is compiled with ``EXPLAIN`` against the database,
+so a typo or a missing column stops the app from starting instead of failing a request.
+
+Because every call site runs the very same string, sqlite3 finds the compiled statement
+in the connection's statement cache (``SQLITE3_CACHED_STATEMENTS``) after its first run,
+instead of parsing and planning it again. `SQLite3.statement_cache_stats` reports how
+often that happens.
+
+Example:
+    from social_insecurity import queries, sqlite
+
+    author = sqlite.read(queries["get_post_author"], (post_id,), one=True)
+"""
+
+from __future__ import annotations
+
+import re
+import sqlite3
+from collections.abc import Iterator
+from os import PathLike
+from typing import Optional
+
+from flask import Flask
+
+from social_insecurity.database import SQLite3
+
+_NAME = re.compile(r"^[ \t]*--[ \t]*name:[ \t]*(\w+)[ \t]*$", re.MULTILINE)
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_PARAMETER = re.compile(r"\?(\d*)")
+
+
+class InvalidQuery(RuntimeError):
+    """Raised at startup when named queries are missing, duplicated or do not compile."""
+
+
+class QueryRegistry:
+    """Provides a named query extension for Flask, loaded from a SQL file."""
+
+    def __init__(self, app: Optional[Flask] = None, *, path: PathLike | str = "queries.sql") -> None:
+        """Initializes the extension."""
+        if app is not None:
+            self.init_app(app, path=path)
+
+    def init_app(self, app: Flask, *, path: PathLike | str = "queries.sql") -> None:
+        """Initializes the extension."""
+        if "queries" in app.extensions:
+            raise RuntimeError("Flask query registry extension already initialized")
+        app.extensions["queries"] = self
+
+        with app.open_resource(str(path), mode="r") as file:
+            self._queries = parse_queries(file.read())
+        if app.config.get("QUERIES_VALIDATE", True):
+            with app.app_context():
+                self.validate(app.extensions["sqlite3"])
+
+    def __getitem__(self, name: str) -> str:
+        """Returns the SQL of a named query."""
+        return self._queries[name]
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._queries
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._queries)
+
+    def __len__(self) -> int:
+        return len(self._queries)
+
+    def validate(self, sqlite: SQLite3) -> None:
+        """Compiles every query with EXPLAIN, and raises `InvalidQuery` listing those that fail."""
+        errors = []
+        for name, query in self._queries.items():
+            try:
+                # EXPLAIN compiles the statement without running it, but still needs a value for every parameter
+                sqlite.connection.execute(f"EXPLAIN {query}", (None,) * count_parameters(query)).close()
+            except sqlite3.Error as e:
+                errors.append(f"{name}: {e}")
+        if errors:
+            raise InvalidQuery("Invalid named queries:\n" + "\n".join(errors))
+
+
+def parse_queries(text: str) -> dict[str, str]:
+    """Splits a SQL file into its named queries, each normalized to one line."""
+    parts = _NAME.split(text)
+    queries: dict[str, str] = {}
+    # split() returns the text before the first name, then each name followed by its SQL
+    for name, sql in zip(parts[1::2], parts[2::2]):
+        if name in queries:
+            raise InvalidQuery(f"Named query {name} is defined twice")
+        lines = [line.strip() for line in sql.splitlines() if line.strip() and not line.strip().startswith("--")]
+        if not lines:
+            raise InvalidQuery(f"Named query {name} is empty")
+        queries[name] = " ".join(lines)
+    return queries
+
+
+def count_parameters(query: str) -> int:
+    """Returns the number of values a query with ``?`` and ``?NNN`` parameters must be given."""
+    count = 0
+    for number in _PARAMETER.findall(_STRING_LITERAL.sub("''", query)):
+        # A plain "?" takes the number after the largest one used so far, as in SQLite itself
+        count = max(count, int(number)) if number else count + 1
+    return count
@@ -0,0 +1,118 @@
+-- --
+-- Named queries of the routes and the JSON API, loaded by social_insecurity.queries.
+-- Each query starts with a "-- name: <name>" line and runs until the next one.
+-- --
+
+-- name: get_friend_request
+SELECT * FROM FriendRequests WHERE id = ? AND to_user_id = ?;
+
+-- name: get_sent_friend_request
+SELECT * FROM FriendRequests WHERE from_user_id = ? AND to_user_id = ?;
+
+-- name: get_friend_requests
+SELECT FriendRequests.*, Users.username
+FROM FriendRequests
+JOIN Users ON FriendRequests.from_user_id = Users.id
+WHERE FriendRequests.to_user_id = ?;
+
+-- name: get_friend_requests_page
+SELECT r.id, r.from_user_id, r.created_at, u.username
+FROM FriendRequests AS r
+JOIN Users AS u ON u.id = r.from_user_id
+WHERE r.to_user_id = ? AND (?2 = 0 OR r.id < ?2)
+ORDER BY r.id DESC
+LIMIT ?3;
+
+-- name: get_friend_requests_version
+SELECT COUNT(*), MAX(id) FROM FriendRequests WHERE to_user_id = ?;
+
+-- name: insert_friend_request
+INSERT INTO FriendRequests (from_user_id, to_user_id) VALUES (?, ?);
+
+-- name: delete_friend_request
+DELETE FROM FriendRequests WHERE id = ?;
+
+-- name: insert_user
+INSERT INTO Users (username, first_name, last_name, password) VALUES (?, ?, ?, ?);
+
+-- name: update_password
+UPDATE Users SET password = ? WHERE id = ?;
+
+-- name: update_profile
+UPDATE Users
+SET education = ?, employment = ?,
+    music = ?, movie = ?,
+    nationality = ?, birthday = ?
+WHERE id = ?;
+
+-- name: get_post_author
+SELECT u_id FROM Posts WHERE id = ?;
+
+-- name: get_post_version
+SELECT u_id, updated_at, comment_count FROM Posts WHERE id = ?;
+
+-- The post and the first page of its comments in one statement. The page is read from
+-- the CommentsByPostTime index in order, and joined to the post row even when it is empty.
+-- name: get_post_with_comments
+WITH page AS (
+  SELECT id, u_id, comment, creation_time FROM Comments
+  WHERE p_id = ?1
+  ORDER BY creation_time DESC, id DESC
+  LIMIT ?2
+)
+SELECT p.id, p.content, p.image, p.creation_time, p.updated_at, u.username,
+       c.id AS comment_id, c.comment, c.creation_time AS comment_time, cu.username AS comment_username
+FROM Posts AS p
+JOIN Users AS u ON u.id = p.u_id
+LEFT JOIN page AS c ON 1
+LEFT JOIN Users AS cu ON cu.id = c.u_id
+WHERE p.id = ?1
+ORDER BY c.creation_time DESC, c.id DESC;
+
+-- name: get_post_with_comments_before
+WITH page AS (
+  SELECT id, u_id, comment, creation_time FROM Comments
+  WHERE p_id = ?1 AND (creation_time, id) < (?3, ?4)
+  ORDER BY creation_time DESC, id DESC
+  LIMIT ?2
+)
+SELECT p.id, p.content, p.image, p.creation_time, p.updated_at, u.username,
+       c.id AS comment_id, c.comment, c.creation_time AS comment_time, cu.username AS comment_username
+FROM Posts AS p
+JOIN Users AS u ON u.id = p.u_id
+LEFT JOIN page AS c ON 1
+LEFT JOIN Users AS cu ON cu.id = c.u_id
+WHERE p.id = ?1
+ORDER BY c.creation_time DESC, c.id DESC;
+
+-- name: get_comments_first_page
+SELECT c.id, c.comment, c.creation_time, u.username
+FROM Comments AS c
+JOIN Users AS u ON u.id = c.u_id
+WHERE c.p_id = ?
+ORDER BY c.creation_time DESC, c.id DESC
+LIMIT ?;
+
+-- name: get_comments_next_page
+SELECT c.id, c.comment, c.creation_time, u.username
+FROM Comments AS c
+JOIN Users AS u ON u.id = c.u_id
+WHERE c.p_id = ? AND (c.creation_time, c.id) < (?, ?)
+ORDER BY c.creation_time DESC, c.id DESC
+LIMIT ?;
+
+-- The newest comments of many posts at once; each post reads at most ?2 index entries.
+-- name: get_comment_previews
+SELECT c.p_id, c.id, c.comment, c.creation_time, u.username
+FROM json_each(?1) AS posts
+JOIN Comments AS c ON c.id IN (
+  SELECT id FROM Comments
+  WHERE p_id = posts.value
+  ORDER BY creation_time DESC, id DESC
+  LIMIT ?2
+)
+JOIN Users AS u ON u.id = c.u_id
+ORDER BY c.p_id, c.creation_time DESC, c.id DESC;
+
+-- name: insert_comment
+INSERT INTO Comments (p_id, u_id, comment, creation_time) VALUES (?, ?, ?, CURRENT_TIMESTAMP);
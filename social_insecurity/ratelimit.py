@@ -0,0 +1,245 @@
+"""Provides a rate limit storage for Flask-Limiter that is shared by all worker processes.
+
+The default in-memory storage of Flask-Limiter counts requests separately in every
+worker process, and forgets them on restart. `SQLiteStorage` keeps the counters in a
+SQLite database instead, so every worker on the host enforces the same limits without
+a network service such as Redis. It registers the ``sqlite://`` scheme with the
+``limits`` library:
+
+    RATELIMIT_STORAGE_URI = "sqlite:////path/to/ratelimits.db"
+    RATELIMIT_STRATEGY = "sliding-window-counter"
+
+Every counter is updated with a single ``INSERT ... ON CONFLICT ... RETURNING``
+statement, and a sliding window entry is checked and taken inside one ``BEGIN
+IMMEDIATE`` transaction, so concurrent workers can neither lose nor overshoot a hit.
+
+With the ``flush_interval`` option (``RATELIMIT_STORAGE_OPTIONS``), increments are
+instead collected in memory and written in one transaction per interval. This takes
+the counter writes off the request path, at the cost of each worker seeing the hits
+of the others up to one interval late.
+"""
+
+from __future__ import annotations
+
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from math import floor
+from typing import Optional
+
+from limits.storage import SlidingWindowCounterSupport, Storage
+from limits.storage.base import TimestampedSlidingWindow
+
+_CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS [RateLimits](
+      key VARCHAR PRIMARY KEY,
+      count INTEGER NOT NULL,
+      expires_at REAL NOT NULL
+    ) WITHOUT ROWID;
+"""
+
+# Restarts an expired counter instead of adding to it
+_INCREMENT = """
+    INSERT INTO RateLimits (key, count, expires_at) VALUES (?, ?, ?)
+    ON CONFLICT (key) DO UPDATE SET
+      count = CASE WHEN expires_at <= ?4 THEN excluded.count ELSE count + excluded.count END,
+      expires_at = CASE WHEN expires_at <= ?4 THEN excluded.expires_at ELSE expires_at END
+    RETURNING count;
+"""
+
+_PURGE_INTERVAL = 60.0
+
+
+class SQLiteStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    """Provides rate limit counters stored in a SQLite database, for the fixed and sliding window counter strategies."""
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(
+        self,
+        uri: str,
+        wrap_exceptions: bool = False,
+        flush_interval: float = 0.0,
+        timeout: float = 5.0,
+        **options: float | str | bool,
+    ) -> None:
+        """Initializes the storage for a ``sqlite:///<absolute path>`` URI."""
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self._path = uri.split("://", 1)[1]
+        self._timeout = float(timeout)
+        self._local = threading.local()
+        self._pending: dict[str, list] = {}
+        self._lock = threading.Lock()
+        self._purged_at = 0.0
+
+        with self._connection() as conn:
+            conn.execute(_CREATE_TABLE)
+
+        self.flush_interval = float(flush_interval)
+        if self.flush_interval > 0:
+            self._stopped = threading.Event()
+            thread = threading.Thread(target=self._flush_periodically, name="ratelimit-flush", daemon=True)
+            thread.start()
+            atexit.register(self.flush)
+
+    @property
+    def base_exceptions(self) -> type[Exception]:
+        return sqlite3.Error
+
+    def incr(self, key: str, expiry: int, amount: int = 1) -> int:
+        """Increments the counter of a key, restarting it with the given expiry if it expired."""
+        now = time.time()
+        if self.flush_interval > 0:
+            with self._lock:
+                pending = self._pending.setdefault(key, [0, now + expiry])
+                pending[0] += amount
+            return self.get(key)
+        with self._connection() as conn:
+            # Fetch every row, so the statement completes and its implicit transaction commits
+            count = conn.execute(_INCREMENT, (key, amount, now + expiry, now)).fetchall()[0][0]
+        self._purge_expired(now)
+        return count
+
+    def decr(self, key: str, amount: int = 1) -> int:
+        """Decrements the counter of a key, not below zero."""
+        with self._connection() as conn:
+            rows = conn.execute(
+                "UPDATE RateLimits SET count = max(0, count - ?) WHERE key = ? RETURNING count;", (amount, key)
+            ).fetchall()
+        return rows[0][0] if rows else 0
+
+    def get(self, key: str) -> int:
+        """Returns the counter of a key, including increments not written yet."""
+        now = time.time()
+        row = self._connection().execute(
+            "SELECT count FROM RateLimits WHERE key = ? AND expires_at > ?;", (key, now)
+        ).fetchone()
+        with self._lock:
+            pending = self._pending.get(key)
+        return (row[0] if row else 0) + (pending[0] if pending and pending[1] > now else 0)
+
+    def get_expiry(self, key: str) -> float:
+        """Returns when the counter of a key expires, as a Unix timestamp."""
+        row = self._connection().execute("SELECT expires_at FROM RateLimits WHERE key = ?;", (key,)).fetchone()
+        if row is None:
+            with self._lock:
+                pending = self._pending.get(key)
+            return pending[1] if pending else time.time()
+        return row[0]
+
+    def check(self) -> bool:
+        """Returns whether the database can be queried."""
+        try:
+            self._connection().execute("SELECT 1;")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> Optional[int]:
+        """Removes every counter and returns how many there were."""
+        with self._lock:
+            self._pending.clear()
+        with self._connection() as conn:
+            return conn.execute("DELETE FROM RateLimits;").rowcount
+
+    def clear(self, key: str) -> None:
+        """Removes the counter of a key."""
+        with self._lock:
+            self._pending.pop(key, None)
+        with self._connection() as conn:
+            conn.execute("DELETE FROM RateLimits WHERE key = ?;", (key,))
+
+    def acquire_sliding_window_entry(self, key: str, limit: int, expiry: int, amount: int = 1) -> bool:
+        """Takes an entry if the weighted count of the previous and current window leaves room for it."""
+        if amount > limit:
+            return False
+        now = time.time()
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        if self.flush_interval > 0:
+            previous_count, previous_ttl, current_count, _ = self._sliding_window(previous_key, current_key, expiry, now)
+            if floor(previous_count * previous_ttl / expiry + current_count) + amount > limit:
+                return False
+            self.incr(current_key, 2 * expiry, amount)
+            return True
+
+        # The write lock is taken before reading, so no other worker can take an entry in between
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            previous_count, previous_ttl, current_count, _ = self._sliding_window(previous_key, current_key, expiry, now)
+            acquired = floor(previous_count * previous_ttl / expiry + current_count) + amount <= limit
+            if acquired:
+                conn.execute(_INCREMENT, (current_key, amount, now + 2 * expiry, now)).fetchall()
+            conn.execute("COMMIT;")
+        except BaseException:
+            conn.execute("ROLLBACK;")
+            raise
+        self._purge_expired(now)
+        return acquired
+
+    def get_sliding_window(self, key: str, expiry: int) -> tuple[int, float, int, float]:
+        """Returns the count and time-to-live of the previous and the current window."""
+        now = time.time()
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        return self._sliding_window(previous_key, current_key, expiry, now)
+
+    def clear_sliding_window(self, key: str, expiry: int) -> None:
+        """Removes the counters of the previous and the current window."""
+        previous_key, current_key = self.sliding_window_keys(key, expiry, time.time())
+        self.clear(previous_key)
+        self.clear(current_key)
+
+    def flush(self) -> None:
+        """Writes the increments collected since the last flush in one transaction."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        now = time.time()
+        rows = [(key, amount, expires_at, now) for key, (amount, expires_at) in pending.items()]
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE;")
+            for row in rows:
+                # executemany() does not accept statements that return rows
+                conn.execute(_INCREMENT, row).fetchall()
+            conn.execute("COMMIT;")
+        self._purge_expired(now)
+
+    def _sliding_window(
+        self, previous_key: str, current_key: str, expiry: int, now: float
+    ) -> tuple[int, float, int, float]:
+        """Returns the sliding window of two window keys, computed as by the in-memory storage."""
+        previous_count = self.get(previous_key)
+        current_count = self.get(current_key)
+        previous_ttl = 0.0 if previous_count == 0 else (1 - (((now - expiry) / expiry) % 1)) * expiry
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous_count, previous_ttl, current_count, current_ttl
+
+    def _flush_periodically(self) -> None:
+        """Flushes the collected increments every flush interval; runs on a daemon thread."""
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass  # The increments are lost, which only lets a few more requests through
+
+    def _purge_expired(self, now: float) -> None:
+        """Deletes expired counters, at most once per purge interval."""
+        if now - self._purged_at < _PURGE_INTERVAL:
+            return
+        self._purged_at = now
+        with self._connection() as conn:
+            conn.execute("DELETE FROM RateLimits WHERE expires_at <= ?;", (now,))
+
+    def _connection(self) -> sqlite3.Connection:
+        """Returns the connection of the current thread, opening a new one after a fork."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            # Autocommit mode, so that every statement outside an explicit BEGIN is its own transaction
+            conn = sqlite3.connect(self._path, timeout=self._timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL;")
+            conn.execute("PRAGMA synchronous = NORMAL;")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
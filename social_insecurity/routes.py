@@ -1,7 +1,13 @@
 # social_insecurity/routes.py
 
+from contextlib import nullcontext
+from datetime import datetime, timezone
+
 from flask import (
+    Response,
     flash,
+    jsonify,
+    make_response,
     redirect,
     render_template,
     url_for,
@@ -9,9 +15,10 @@ from flask import (
     request,  
 )
 from flask_login import login_user, login_required, logout_user, current_user
-from werkzeug.security import check_password_hash, generate_password_hash
 from flask import current_app as app
-from social_insecurity import sqlite
+from social_insecurity import events, fragments, friend_graph, images, limiter, passwords, queries, sqlite, writebehind
+from social_insecurity.comments import get_comment_previews, get_post_with_comments
+from social_insecurity.feed import backfill_timelines, create_post, get_feed_page
 from social_insecurity.forms import (
     CommentsForm,
     FriendsForm,
@@ -20,16 +27,21 @@ from social_insecurity.forms import (
     ProfileForm,
 )
 from social_insecurity.models import User
-from werkzeug.utils import secure_filename
-from pathlib import Path
-from werkzeug.exceptions import abort  # Imported 'abort' for error handling
-from mimetypes import guess_type  # Imported for MIME type checking
+from social_insecurity.passwords import HasherBusy
+from social_insecurity.search import autocomplete_usernames, search_comments, search_posts, search_users
+from social_insecurity.uploads import (
+    UploadRejected,
+    describe_upload,
+    get_upload_folder,
+    is_content_addressed,
+    store_upload,
+)
+from werkzeug.exceptions import RequestEntityTooLarge, abort  # Imported 'abort' for error handling
 from wtforms import HiddenField, SubmitField
 from flask_wtf import FlaskForm
 from flask_wtf.csrf import CSRFProtect
 from wtforms.validators import DataRequired
 from flask_limiter.errors import RateLimitExceeded
-ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif"}  # Defined allowed file extensions
 
 class RequestForm(FlaskForm):
     request_id = HiddenField(validators=[DataRequired()])
@@ -44,48 +56,35 @@ def handle_friend_request():
     if form.validate_on_submit():
         request_id = form.request_id.data
         action = form.action.data
-        print(f"Received request_id: {request_id}, action: {action}")
+        app.logger.debug("Friend request %s: %s by user %s", request_id, action, current_user.id)
 
         # Fetch the specific friend request
-        get_friend_request = """
-          SELECT * FROM FriendRequests
-          WHERE id = ? AND to_user_id = ?;
-        """
-        friend_request = sqlite.query(get_friend_request, (request_id, current_user.id), one=True)
+        friend_request = sqlite.read(queries["get_friend_request"], (request_id, current_user.id), one=True)
 
         if not friend_request:
             flash("Invalid friend request.", category="danger")
             return redirect(url_for("friends"))
 
-        if action == "accept":
-            # Add the friendship in both directions
-            insert_friend = """
-              INSERT INTO Friends (u_id, f_id) VALUES (?, ?);
-            """
-            sqlite.query(insert_friend, (current_user.id, friend_request["from_user_id"]))
-            sqlite.query(insert_friend, (friend_request["from_user_id"], current_user.id))
-            flash("Friend request accepted!", category="success")
-        elif action == "decline":
-            flash("Friend request declined.", category="info")
-        else:
+        if action not in ("accept", "decline"):
             flash("Unknown action.", category="danger")
             return redirect(url_for("friends"))
 
-        # Delete the friend request
-        delete_request = "DELETE FROM FriendRequests WHERE id = ?;"
-        sqlite.query(delete_request, (request_id,))
+        # Accepting adds the friendship in both directions and deletes the request, atomically
+        with sqlite.transaction():
+            if action == "accept":
+                friend_graph.add_friendship(current_user.id, friend_request["from_user_id"])
+                backfill_timelines(current_user.id, friend_request["from_user_id"])
+            sqlite.write(queries["delete_friend_request"], (request_id,))
+
+        if action == "accept":
+            flash("Friend request accepted!", category="success")
+        else:
+            flash("Friend request declined.", category="info")
     else:
-        print("Form did not validate")
-        print(f"Form data: {request.form}")
-        print(f"Form errors: {form.errors}")
+        app.logger.debug("Invalid friend request form: %s", form.errors)
         flash("Invalid form submission.", category="danger")
     return redirect(url_for("friends"))
 
-def allowed_file(filename):
-    """Check if the file has an allowed extension."""
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
-
-
 @app.route("/", methods=["GET", "POST"])
 @app.route("/index", methods=["GET", "POST"])
 def index():
@@ -103,7 +102,12 @@ def index():
             stored_password_hash = user["password"]
             if stored_password_hash:
                 try:
-                    if check_password_hash(stored_password_hash, login_form.password.data):
+                    if passwords.check(stored_password_hash, login_form.password.data):
+                        if passwords.needs_rehash(stored_password_hash):
+                            # Upgrade legacy werkzeug hashes, and hashes with an outdated cost, to bcrypt
+                            stored_password_hash = passwords.hash(login_form.password.data)
+                            sqlite.write(queries["update_password"], (stored_password_hash, user["id"]))
+                            sqlite.invalidate_user(user["id"])
                         user_obj = User(
                             id=user["id"], username=user["username"], password=stored_password_hash
                         )
@@ -143,13 +147,9 @@ def index():
             flash("Password must contain at least one special character.", category="danger")
             return redirect(url_for("index"))
         else:
-            hashed_pwd = generate_password_hash(register_form.password.data)
-            insert_user = """
-                INSERT INTO Users (username, first_name, last_name, password)
-                VALUES (?, ?, ?, ?);
-                """
-            sqlite.query(
-                insert_user,
+            hashed_pwd = passwords.hash(register_form.password.data)
+            sqlite.write(
+                queries["insert_user"],
                 (
                     register_form.username.data,
                     register_form.first_name.data,
@@ -157,12 +157,28 @@ def index():
                     hashed_pwd,
                 ),
             )
+            sqlite.invalidate_user(username=register_form.username.data)
             flash("User successfully created!", category="success")
             return redirect(url_for("index"))
 
     return render_template("index.html.j2", title="Welcome", form=form)
 
 
+@app.errorhandler(HasherBusy)
+def hasher_busy(error: HasherBusy):
+    """Shed login and registration load while the password hashing queue is full or too slow."""
+    flash("The server is busy, please try again in a moment.", category="warning")
+    form = IndexForm()
+    return render_template("index.html.j2", title="Welcome", form=form), 503, {"Retry-After": "2"}
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(error: RequestEntityTooLarge):
+    """Reject request bodies over MAX_CONTENT_LENGTH before they are read any further."""
+    flash(f"Uploads may be at most {app.config['UPLOADS_MAX_SIZE'] // (1024 * 1024)} MB.", category="danger")
+    return redirect(request.referrer or url_for("index")), 303
+
+
 @app.route("/logout")
 @login_required
 def logout():
@@ -180,75 +196,109 @@ def stream():
     form = PostForm()
 
     if form.validate_on_submit():
-        filename = None
-        if form.image.data:
-            filename = secure_filename(form.image.data.filename)
-            if not allowed_file(filename):  # Validate file extension
-                flash("File type not allowed.", category="danger")
-                return redirect(url_for("stream"))
-            # Save the file
-            upload_folder = Path(app.instance_path) / app.config["UPLOADS_FOLDER_PATH"]
-            upload_folder.mkdir(parents=True, exist_ok=True)  # Ensure the upload directory exists
-            path = upload_folder / filename
-            form.image.data.save(path)
-        insert_post = """
-          INSERT INTO Posts (u_id, content, image, creation_time)
-          VALUES (?, ?, ?, CURRENT_TIMESTAMP);
-      """
-        sqlite.query(insert_post, (current_user.id, form.content.data, filename))
+        # Save the file under the hash of its content, after checking what it actually contains, in the
+        # transaction that inserts the post referring to it
+        upload = store_upload(form.image.data) if form.image.data else nullcontext()
+        try:
+            with upload as filename:
+                post_id = create_post(current_user.id, form.content.data, filename)
+        except UploadRejected as e:
+            flash(str(e), category="danger")
+            return redirect(url_for("stream"))
+        if filename:
+            images.submit(post_id, filename)
+        audience = friend_graph.friends_of(current_user.id) | {current_user.id}
+        events.publish("post", {"id": post_id, "username": current_user.username}, audience)
         flash("Post successfully created!", category="success")
         return redirect(url_for("stream"))
 
-    get_posts = """
-        SELECT p.id, p.content, p.image, p.creation_time, 
-                u.username,
-                (SELECT COUNT(*) FROM Comments WHERE p_id = p.id) AS comment_count
-        FROM Posts AS p 
-        JOIN Users AS u ON u.id = p.u_id
-        WHERE p.u_id IN (
-            SELECT f_id FROM Friends WHERE u_id = ?
-        ) 
-        OR p.u_id = ?
-        ORDER BY p.creation_time DESC;
+    try:
+        page = get_feed_page(current_user.id, cursor=request.args.get("cursor"))
+    except ValueError:
+        abort(400)
+    return render_template(
+        "stream.html.j2",
+        title="Stream",
+        form=form,
+        posts=page.posts,
+        previews=get_comment_previews(page.posts),
+        next_cursor=page.next_cursor,
+    )
+
+
+@app.route("/stream/more")
+@login_required
+def stream_more():
+    """Render the next page of post cards, to be appended below the current ones by static/js/stream.js.
+
+    The cursor of the page after it is only sent in the X-Next-Cursor header; the page keeps its own "Load more" link.
     """
-    posts = sqlite.query(get_posts, (current_user.id, current_user.id))
-    return render_template("stream.html.j2", title="Stream", form=form, posts=posts)
+    try:
+        page = get_feed_page(current_user.id, cursor=request.args.get("cursor"))
+    except ValueError:
+        abort(400)
+    previews = get_comment_previews(page.posts)
+    response = make_response(render_template("post_cards.html.j2", posts=page.posts, previews=previews))
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    return response
 
 
 @app.route("/comments/<string:username>/<int:post_id>", methods=["GET", "POST"])
 @login_required
 def comments(username: str, post_id: int):
     comments_form = CommentsForm()
-    user = sqlite.get_user_by_username(username)
-
-    if not user:
-        abort(404)  # Added error handling if user does not exist
 
     if comments_form.validate_on_submit():
-        insert_comment = """
-          INSERT INTO Comments (p_id, u_id, comment, creation_time)
-          VALUES (?, ?, ?, CURRENT_TIMESTAMP);
-      """
-        sqlite.query(insert_comment, (post_id, current_user.id, comments_form.comment.data))
+        # The comment may be queued, so check that its post exists before accepting it; a replica may not have it yet
+        author = sqlite.read(queries["get_post_author"], (post_id,), one=True, primary=True)
+        if author is None:
+            abort(404)
+        commenter = current_user.username
+
+        def announce() -> None:
+            # Runs once the comment has committed, on the write-behind thread if it was queued
+            fragments.evict("post", post_id)
+            audience = friend_graph.friends_of(author["u_id"]) | {author["u_id"]}
+            events.publish("comment", {"post_id": post_id, "username": commenter}, audience)
+
+        comment = comments_form.comment.data
+        # Formatted like the CURRENT_TIMESTAMP the comment is stored with
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        writebehind.submit(
+            queries["insert_comment"],
+            (post_id, current_user.id, comment),
+            key=("comments", post_id),
+            author_id=current_user.id,
+            row={"username": commenter, "comment": comment, "creation_time": now},
+            on_commit=announce,
+        )
         flash("Comment successfully added!", category="success")
         return redirect(url_for("comments", username=username, post_id=post_id))
 
-    get_post = "SELECT * FROM Posts JOIN Users ON Posts.u_id = Users.id WHERE Posts.id = ?;"
-    get_comments = """
-      SELECT Comments.*, Users.username
-      FROM Comments
-      JOIN Users ON Comments.u_id = Users.id
-      WHERE Comments.p_id = ?
-      ORDER BY Comments.creation_time DESC;
-  """
-    post = sqlite.query(get_post, (post_id,), one=True)
-    comments = sqlite.query(get_comments, (post_id,))
-
-    if not post:
+    cursor = request.args.get("cursor")
+    try:
+        page = get_post_with_comments(post_id, cursor=cursor)
+    except ValueError:
+        abort(400)
+    if page is None:
         abort(404)  # Added error handling if post does not exist
+    if page.post["username"] != username:
+        # The post is found by its ID alone, so a wrong author in the URL only needs correcting
+        return redirect(url_for("comments", username=page.post["username"], post_id=post_id, cursor=cursor))
 
+    # The user's own comments that are still queued, newest first, above the committed ones
+    pending = [] if cursor else writebehind.pending(("comments", post_id), current_user.id)[::-1]
     return render_template(
-        "comments.html.j2", title="Comments", username=username, form=comments_form, post=post, comments=comments
+        "comments.html.j2",
+        title="Comments",
+        username=username,
+        form=comments_form,
+        post=page.post,
+        comments=page.comments,
+        pending=pending,
+        cursor=cursor,
+        next_cursor=page.next_cursor,
     )
 
 
@@ -266,43 +316,40 @@ def friends():
             flash("User does not exist!", category="warning")
         elif friend["id"] == current_user.id:
             flash("You cannot send a friend request to yourself!", category="warning")
+        elif friend["id"] in friend_graph.friends_of(current_user.id):
+            flash("You are already friends!", category="warning")
         else:
             # Check if a friend request already exists
-            existing_request = sqlite.query(
-                "SELECT * FROM FriendRequests WHERE from_user_id = ? AND to_user_id = ?;",
-                (current_user.id, friend["id"]),
-                one=True,
+            existing_request = sqlite.read(
+                queries["get_sent_friend_request"], (current_user.id, friend["id"]), one=True
             )
-            if existing_request:
+            # A request that is still queued for the database counts as sent too
+            queued = writebehind.pending(("friend_requests", current_user.id))
+            if existing_request or any(row["to_user_id"] == friend["id"] for row in queued):
                 flash("Friend request already sent!", category="warning")
             else:
                 # Create a new friend request
-                insert_request = """
-                  INSERT INTO FriendRequests (from_user_id, to_user_id)
-                  VALUES (?, ?);
-              """
-                sqlite.query(insert_request, (current_user.id, friend["id"]))
+                sender, recipient = current_user.username, friend["id"]
+                writebehind.submit(
+                    queries["insert_friend_request"],
+                    (current_user.id, recipient),
+                    key=("friend_requests", current_user.id),
+                    author_id=current_user.id,
+                    row={"to_user_id": recipient},
+                    on_commit=lambda: events.publish("friend_request", {"username": sender}, {recipient}),
+                )
                 flash("Friend request sent!", category="success")
-                print(f"Friend request sent from user {current_user.id} to user {friend['id']}")
+                app.logger.debug("Friend request sent from user %s to user %s", current_user.id, friend["id"])
 
-    # Get list of current friends
-    get_friends = """
-      SELECT Users.*
-      FROM Friends
-      JOIN Users ON Friends.f_id = Users.id
-      WHERE Friends.u_id = ?;
-  """
-    friends = sqlite.query(get_friends, (current_user.id,))
+    # Get list of current friends and friends of friends, from the cached friend graph
+    friend_ids = friend_graph.friends_of(current_user.id)
+    suggestions = friend_graph.suggestions(current_user.id)
+    users = sqlite.get_users_by_ids(friend_ids | {user_id for user_id, _ in suggestions})
+    friends = sorted((users[friend_id] for friend_id in friend_ids if friend_id in users), key=lambda u: u["username"])
+    suggestions = [(users[user_id], mutual) for user_id, mutual in suggestions if user_id in users]
 
     # Get incoming friend requests
-    get_friend_requests = """
-      SELECT FriendRequests.*, Users.username
-      FROM FriendRequests
-      JOIN Users ON FriendRequests.from_user_id = Users.id
-      WHERE FriendRequests.to_user_id = ?;
-  """
-    friend_requests = sqlite.query(get_friend_requests, (current_user.id,))
-    print(f"Friend requests for user {current_user.id}: {friend_requests}")
+    friend_requests = sqlite.read(queries["get_friend_requests"], (current_user.id,))
 
     return render_template(
         "friends.html.j2",
@@ -311,23 +358,61 @@ def friends():
         form=friends_form,
         friend_requests=friend_requests,
         request_form=request_form,
+        suggestions=suggestions,
     )
 
+@app.route("/events")
+@login_required
+@limiter.exempt
+def live_events():
+    """Stream new posts, comments and friend requests for the user as Server-Sent Events."""
+    last_id = request.headers.get("Last-Event-ID", type=int)
+    # The stream runs after this request's context, and its database connection, are released
+    stream = events.stream(
+        current_user.id,
+        events.last_id if last_id is None else last_id,
+        heartbeat=app.config["EVENTS_HEARTBEAT"],
+        timeout=app.config["EVENTS_STREAM_TIMEOUT"],
+    )
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}  # Do not let proxies buffer the stream
+    return Response(stream, mimetype="text/event-stream", headers=headers)
+
+
+@app.route("/search")
+@login_required
+def search():
+    """Search posts and comments visible to the user, or all users."""
+    text = request.args.get("q", "").strip()
+    kind = request.args.get("type", "posts")
+    page = request.args.get("page", 1, type=int)
+    searches = {
+        "posts": lambda: search_posts(current_user.id, text, page),
+        "comments": lambda: search_comments(current_user.id, text, page),
+        "users": lambda: search_users(text, page),
+    }
+    if kind not in searches:
+        abort(400)
+    results = searches[kind]()
+    # Found posts are shown with the same cached cards as in the stream, comment previews included
+    previews = get_comment_previews(results.results) if kind == "posts" else {}
+    return render_template("search.html.j2", title="Search", q=text, type=kind, results=results, previews=previews)
+
+
+@app.route("/search/usernames")
+@login_required
+def search_usernames():
+    """Suggest usernames starting with the typed text, as a JSON list."""
+    return jsonify(autocomplete_usernames(request.args.get("q", "")))
+
+
 @app.route("/profile", methods=["GET", "POST"])
 @login_required
 def profile():
     profile_form = ProfileForm()
 
     if profile_form.validate_on_submit():
-        update_profile = """
-          UPDATE Users
-          SET education = ?, employment = ?,
-              music = ?, movie = ?,
-              nationality = ?, birthday = ?
-          WHERE id = ?;
-      """
-        sqlite.query(
-            update_profile,
+        sqlite.write(
+            queries["update_profile"],
             (
                 profile_form.education.data,
                 profile_form.employment.data,
@@ -338,6 +423,7 @@ def profile():
                 current_user.id,
             ),
         )
+        sqlite.invalidate_user(current_user.id)
         flash("Profile successfully updated!", category="success")
         return redirect(url_for("profile"))
 
@@ -350,13 +436,26 @@ def profile():
 @app.route("/uploads/<path:filename>")
 def uploads(filename):
     """Serve uploaded files securely."""
-    uploads_folder = Path(app.instance_path) / app.config["UPLOADS_FOLDER_PATH"]
+    uploads_folder = get_upload_folder()
     full_path = uploads_folder / filename
     if uploads_folder not in full_path.parents:
         abort(403)  # Prevent directory traversal attacks
-    if not full_path.exists():
+    mime_type = describe_upload(full_path)
+    if mime_type is None:
         abort(404)
-    mime_type, _ = guess_type(str(full_path))
-    if not mime_type or not mime_type.startswith("image/"):
+    if not mime_type.startswith("image/"):
         abort(403)
-    return send_from_directory(uploads_folder, filename)
+    if not is_content_addressed(filename):
+        return send_from_directory(uploads_folder, filename, mimetype=mime_type)
+
+    # The name is the hash of the content, so the file can be cached forever and revalidated without reading it
+    etag = full_path.stem
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+        response.set_etag(etag)
+    else:
+        response = send_from_directory(uploads_folder, filename, mimetype=mime_type, etag=etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config["UPLOADS_CACHE_MAX_AGE"]
+    response.cache_control.immutable = True
+    return response
@@ -21,7 +21,10 @@ CREATE TABLE [Posts](
   u_id INTEGER,
   content INTEGER,
   [image] VARCHAR,
+  image_variants VARCHAR,
   [creation_time] DATETIME,
+  comment_count INTEGER NOT NULL DEFAULT 0,
+  updated_at DATETIME DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
   FOREIGN KEY (u_id) REFERENCES [Users](id)
 );
 
@@ -52,6 +55,144 @@ CREATE TABLE [Comments](
   FOREIGN KEY (u_id) REFERENCES Users(id)
 );
 
+-- Number of posts referring to each stored upload
+CREATE TABLE [Uploads](
+  filename VARCHAR PRIMARY KEY,
+  refcount INTEGER NOT NULL DEFAULT 0
+);
+
+-- Materialized feed of each user, only written when FEED_MODE is "push"
+CREATE TABLE [Timeline](
+  owner_id INTEGER NOT NULL,
+  [creation_time] DATETIME,
+  p_id INTEGER NOT NULL,
+  PRIMARY KEY (owner_id, creation_time, p_id),
+  FOREIGN KEY (owner_id) REFERENCES Users(id),
+  FOREIGN KEY (p_id) REFERENCES Posts(id)
+) WITHOUT ROWID;
+
+-- Full-text indexes over the text of Posts, Comments and Users. They hold no copy of the
+-- text (external content), and are kept in step by the triggers below.
+CREATE VIRTUAL TABLE [PostsSearch] USING fts5(
+  content, content='Posts', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE VIRTUAL TABLE [CommentsSearch] USING fts5(
+  comment, content='Comments', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+
+-- Prefix indexes of 2 and 3 characters serve username autocompletion
+CREATE VIRTUAL TABLE [UsersSearch] USING fts5(
+  username, first_name, last_name, content='Users', content_rowid='id',
+  tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+
+-- --
+-- Create indexes
+-- --
+
+-- Serves the keyset-paginated feed: one range scan per author, ordered by time.
+-- The rowid (id) is implicitly the last column of every index, so the
+-- (creation_time, id) cursor comparison is resolved from the index alone.
+CREATE INDEX [PostsByAuthorTime] ON [Posts](u_id, creation_time);
+
+-- Serves the comments of a post, newest first, and the previews of many posts at once:
+-- a page of comments is read in index order, without sorting them.
+CREATE INDEX [CommentsByPostTime] ON [Comments](p_id, creation_time);
+
+-- Serves the incoming friend requests of a user, newest first, and their API validator.
+CREATE INDEX [FriendRequestsByRecipient] ON [FriendRequests](to_user_id);
+
+-- Friends(u_id, f_id) is served by the index SQLite creates for its PRIMARY KEY.
+
+-- --
+-- Create triggers
+-- --
+
+-- Keep Posts.comment_count in step with Comments, in the same transaction as the write.
+CREATE TRIGGER IF NOT EXISTS [CommentsCountInsert] AFTER INSERT ON [Comments]
+BEGIN
+  UPDATE Posts SET comment_count = comment_count + 1 WHERE id = NEW.p_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS [CommentsCountDelete] AFTER DELETE ON [Comments]
+BEGIN
+  UPDATE Posts SET comment_count = comment_count - 1 WHERE id = OLD.p_id;
+END;
+
+-- Bump Posts.updated_at whenever anything shown on a post card changes, including its
+-- comment count through the triggers above. Rendered cards are cached under it.
+CREATE TRIGGER IF NOT EXISTS [PostsTouch] AFTER UPDATE OF content, [image], image_variants, comment_count ON [Posts]
+BEGIN
+  UPDATE Posts SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = NEW.id;
+END;
+
+-- Count references to uploads, so that files no post uses any more can be pruned
+CREATE TRIGGER IF NOT EXISTS [UploadsRefInsert] AFTER INSERT ON [Posts] WHEN NEW.image IS NOT NULL
+BEGIN
+  INSERT INTO Uploads (filename, refcount) VALUES (NEW.image, 1)
+  ON CONFLICT (filename) DO UPDATE SET refcount = refcount + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS [UploadsRefDelete] AFTER DELETE ON [Posts] WHEN OLD.image IS NOT NULL
+BEGIN
+  UPDATE Uploads SET refcount = refcount - 1 WHERE filename = OLD.image;
+END;
+
+-- Keep the full-text indexes in step with the tables they index. Updates only reindex
+-- a row when its text changed, not e.g. when a post's comment_count is bumped.
+CREATE TRIGGER IF NOT EXISTS [PostsSearchInsert] AFTER INSERT ON [Posts]
+BEGIN
+  INSERT INTO PostsSearch (rowid, content) VALUES (NEW.id, NEW.content);
+END;
+
+CREATE TRIGGER IF NOT EXISTS [PostsSearchDelete] AFTER DELETE ON [Posts]
+BEGIN
+  INSERT INTO PostsSearch (PostsSearch, rowid, content) VALUES ('delete', OLD.id, OLD.content);
+END;
+
+CREATE TRIGGER IF NOT EXISTS [PostsSearchUpdate] AFTER UPDATE OF content ON [Posts]
+BEGIN
+  INSERT INTO PostsSearch (PostsSearch, rowid, content) VALUES ('delete', OLD.id, OLD.content);
+  INSERT INTO PostsSearch (rowid, content) VALUES (NEW.id, NEW.content);
+END;
+
+CREATE TRIGGER IF NOT EXISTS [CommentsSearchInsert] AFTER INSERT ON [Comments]
+BEGIN
+  INSERT INTO CommentsSearch (rowid, comment) VALUES (NEW.id, NEW.comment);
+END;
+
+CREATE TRIGGER IF NOT EXISTS [CommentsSearchDelete] AFTER DELETE ON [Comments]
+BEGIN
+  INSERT INTO CommentsSearch (CommentsSearch, rowid, comment) VALUES ('delete', OLD.id, OLD.comment);
+END;
+
+CREATE TRIGGER IF NOT EXISTS [CommentsSearchUpdate] AFTER UPDATE OF comment ON [Comments]
+BEGIN
+  INSERT INTO CommentsSearch (CommentsSearch, rowid, comment) VALUES ('delete', OLD.id, OLD.comment);
+  INSERT INTO CommentsSearch (rowid, comment) VALUES (NEW.id, NEW.comment);
+END;
+
+CREATE TRIGGER IF NOT EXISTS [UsersSearchInsert] AFTER INSERT ON [Users]
+BEGIN
+  INSERT INTO UsersSearch (rowid, username, first_name, last_name)
+  VALUES (NEW.id, NEW.username, NEW.first_name, NEW.last_name);
+END;
+
+CREATE TRIGGER IF NOT EXISTS [UsersSearchDelete] AFTER DELETE ON [Users]
+BEGIN
+  INSERT INTO UsersSearch (UsersSearch, rowid, username, first_name, last_name)
+  VALUES ('delete', OLD.id, OLD.username, OLD.first_name, OLD.last_name);
+END;
+
+CREATE TRIGGER IF NOT EXISTS [UsersSearchUpdate] AFTER UPDATE OF username, first_name, last_name ON [Users]
+BEGIN
+  INSERT INTO UsersSearch (UsersSearch, rowid, username, first_name, last_name)
+  VALUES ('delete', OLD.id, OLD.username, OLD.first_name, OLD.last_name);
+  INSERT INTO UsersSearch (rowid, username, first_name, last_name)
+  VALUES (NEW.id, NEW.username, NEW.first_name, NEW.last_name);
+END;
+
 -- --
 -- Populate tables with test data
 -- --
@@ -0,0 +1,208 @@
+"""Provides full-text search over posts, comments and users.
+
+Posts, comments and users are indexed by the FTS5 tables ``PostsSearch``,
+``CommentsSearch`` and ``UsersSearch``. They are external-content tables: they store
+only the inverted index and read the text itself from the original tables, and the
+triggers in ``schema.sql`` keep them in step with every write. A search is therefore a
+lookup in the index followed by primary key lookups, instead of a ``LIKE '%x%'`` scan.
+
+Posts and comments are only searched among the posts of the user and their friends,
+the same set of posts their feed shows. Usernames are searchable by everyone, as they
+are for sending friend requests, and ``UsersSearch`` keeps prefix indexes so that
+autocompletion does not need to scan the vocabulary.
+
+User input is never passed to FTS5 as a query expression: every word is quoted, so
+operators such as ``NEAR`` or ``*`` in the input are searched for as plain text.
+
+Example:
+    from social_insecurity.search import search_posts
+
+    page = search_posts(current_user.id, request.args.get("q", ""), page=1)
+    for post in page.results:
+        ...
+"""
+
+from __future__ import annotations
+
+import json
+import re
+import sqlite3
+from typing import NamedTuple, Optional
+
+from flask import current_app
+
+from social_insecurity import friend_graph, sqlite
+
+# Input is split into words the way FTS5's unicode61 tokenizer splits text
+_WORD = re.compile(r"\w+")
+_MAX_TERMS = 8
+
+_SEARCH_POSTS = """
+    SELECT p.id, p.content, p.image, p.image_variants, p.creation_time,
+           p.comment_count, p.updated_at, u.username
+    FROM PostsSearch AS s
+    JOIN Posts AS p ON p.id = s.rowid
+    JOIN Users AS u ON u.id = p.u_id
+    WHERE PostsSearch MATCH ? AND p.u_id IN (SELECT value FROM json_each(?))
+    ORDER BY s.rank, p.id DESC
+    LIMIT ? OFFSET ?;
+"""
+
+_SEARCH_COMMENTS = """
+    SELECT c.id, c.comment, c.creation_time, c.p_id, u.username,
+           pu.username AS post_username
+    FROM CommentsSearch AS s
+    JOIN Comments AS c ON c.id = s.rowid
+    JOIN Posts AS p ON p.id = c.p_id
+    JOIN Users AS u ON u.id = c.u_id
+    JOIN Users AS pu ON pu.id = p.u_id
+    WHERE CommentsSearch MATCH ? AND p.u_id IN (SELECT value FROM json_each(?))
+    ORDER BY s.rank, c.id DESC
+    LIMIT ? OFFSET ?;
+"""
+
+_SEARCH_USERS = """
+    SELECT u.id, u.username, u.first_name, u.last_name
+    FROM UsersSearch AS s
+    JOIN Users AS u ON u.id = s.rowid
+    WHERE UsersSearch MATCH ?
+    ORDER BY s.rank, length(u.username), u.id
+    LIMIT ? OFFSET ?;
+"""
+
+# Tables and triggers are repeated from schema.sql so that databases created before them can be upgraded in place
+_SEARCH_REBUILD = """
+    BEGIN;
+    CREATE VIRTUAL TABLE IF NOT EXISTS [PostsSearch] USING fts5(
+      content, content='Posts', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    );
+    CREATE VIRTUAL TABLE IF NOT EXISTS [CommentsSearch] USING fts5(
+      comment, content='Comments', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    );
+    CREATE VIRTUAL TABLE IF NOT EXISTS [UsersSearch] USING fts5(
+      username, first_name, last_name, content='Users', content_rowid='id',
+      tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    );
+    CREATE TRIGGER IF NOT EXISTS [PostsSearchInsert] AFTER INSERT ON [Posts]
+    BEGIN
+      INSERT INTO PostsSearch (rowid, content) VALUES (NEW.id, NEW.content);
+    END;
+    CREATE TRIGGER IF NOT EXISTS [PostsSearchDelete] AFTER DELETE ON [Posts]
+    BEGIN
+      INSERT INTO PostsSearch (PostsSearch, rowid, content) VALUES ('delete', OLD.id, OLD.content);
+    END;
+    CREATE TRIGGER IF NOT EXISTS [PostsSearchUpdate] AFTER UPDATE OF content ON [Posts]
+    BEGIN
+      INSERT INTO PostsSearch (PostsSearch, rowid, content) VALUES ('delete', OLD.id, OLD.content);
+      INSERT INTO PostsSearch (rowid, content) VALUES (NEW.id, NEW.content);
+    END;
+    CREATE TRIGGER IF NOT EXISTS [CommentsSearchInsert] AFTER INSERT ON [Comments]
+    BEGIN
+      INSERT INTO CommentsSearch (rowid, comment) VALUES (NEW.id, NEW.comment);
+    END;
+    CREATE TRIGGER IF NOT EXISTS [CommentsSearchDelete] AFTER DELETE ON [Comments]
+    BEGIN
+      INSERT INTO CommentsSearch (CommentsSearch, rowid, comment) VALUES ('delete', OLD.id, OLD.comment);
+    END;
+    CREATE TRIGGER IF NOT EXISTS [CommentsSearchUpdate] AFTER UPDATE OF comment ON [Comments]
+    BEGIN
+      INSERT INTO CommentsSearch (CommentsSearch, rowid, comment) VALUES ('delete', OLD.id, OLD.comment);
+      INSERT INTO CommentsSearch (rowid, comment) VALUES (NEW.id, NEW.comment);
+    END;
+    CREATE TRIGGER IF NOT EXISTS [UsersSearchInsert] AFTER INSERT ON [Users]
+    BEGIN
+      INSERT INTO UsersSearch (rowid, username, first_name, last_name)
+      VALUES (NEW.id, NEW.username, NEW.first_name, NEW.last_name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS [UsersSearchDelete] AFTER DELETE ON [Users]
+    BEGIN
+      INSERT INTO UsersSearch (UsersSearch, rowid, username, first_name, last_name)
+      VALUES ('delete', OLD.id, OLD.username, OLD.first_name, OLD.last_name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS [UsersSearchUpdate] AFTER UPDATE OF username, first_name, last_name ON [Users]
+    BEGIN
+      INSERT INTO UsersSearch (UsersSearch, rowid, username, first_name, last_name)
+      VALUES ('delete', OLD.id, OLD.username, OLD.first_name, OLD.last_name);
+      INSERT INTO UsersSearch (rowid, username, first_name, last_name)
+      VALUES (NEW.id, NEW.username, NEW.first_name, NEW.last_name);
+    END;
+    INSERT INTO PostsSearch (PostsSearch) VALUES ('rebuild');
+    INSERT INTO CommentsSearch (CommentsSearch) VALUES ('rebuild');
+    INSERT INTO UsersSearch (UsersSearch) VALUES ('rebuild');
+    COMMIT;
+"""
+
+
+class SearchPage(NamedTuple):
+    """A single page of search results, and whether there is a page after it."""
+
+    results: list[sqlite3.Row]
+    page: int
+    has_next: bool
+
+
+def to_match_query(text: str, prefix: bool = False) -> Optional[str]:
+    """Turns user input into an FTS5 query matching every word, or returns None if it has no words.
+
+    With `prefix`, the last word also matches longer words starting with it.
+    """
+    terms = _WORD.findall(text.lower())[:_MAX_TERMS]
+    if not terms:
+        return None
+    query = " ".join(f'"{term}"' for term in terms)
+    return query + "*" if prefix else query
+
+
+def search_posts(user_id: int, text: str, page: int = 1) -> SearchPage:
+    """Searches the posts of a user and their friends, best match first."""
+    return _search(_SEARCH_POSTS, to_match_query(text), page, _visible_authors(user_id))
+
+
+def search_comments(user_id: int, text: str, page: int = 1) -> SearchPage:
+    """Searches the comments on the posts of a user and their friends, best match first."""
+    return _search(_SEARCH_COMMENTS, to_match_query(text), page, _visible_authors(user_id))
+
+
+def search_users(text: str, page: int = 1) -> SearchPage:
+    """Searches users by username and name, best match first; the last word may be the start of a longer one."""
+    return _search(_SEARCH_USERS, to_match_query(text, prefix=True), page)
+
+
+def autocomplete_usernames(text: str, limit: Optional[int] = None) -> list[str]:
+    """Returns usernames whose words start with the words of the input, best match first."""
+    match = to_match_query(text, prefix=True)
+    if match is None:
+        return []
+    limit = limit or current_app.config["SEARCH_AUTOCOMPLETE_LIMIT"]
+    rows = sqlite.read(_SEARCH_USERS, (f"username : ({match})", limit, 0))
+    return [row["username"] for row in rows]
+
+
+def rebuild_search_index() -> None:
+    """Adds the search tables and triggers to an existing database and reindexes every row."""
+    sqlite.connection.executescript(_SEARCH_REBUILD)
+
+
+def optimize_search_index() -> None:
+    """Merges the segments of every search index into one, which makes queries faster after many writes."""
+    with sqlite.transaction():
+        for table in ("PostsSearch", "CommentsSearch", "UsersSearch"):
+            sqlite.write(f"INSERT INTO {table} ({table}) VALUES ('optimize');")
+
+
+def _search(query: str, match: Optional[str], page: int, *params: str) -> SearchPage:
+    """Runs a search query for one page of results."""
+    limit = current_app.config["SEARCH_PAGE_SIZE"]
+    page = max(1, min(page, current_app.config["SEARCH_MAX_PAGES"]))
+    if match is None:
+        return SearchPage([], page, False)
+
+    # Fetch one extra row to find out whether there is a next page without a COUNT(*)
+    rows = sqlite.read(query, (match, *params, limit + 1, (page - 1) * limit))
+    has_next = len(rows) > limit and page < current_app.config["SEARCH_MAX_PAGES"]
+    return SearchPage(rows[:limit], page, has_next)
+
+
+def _visible_authors(user_id: int) -> str:
+    """Returns the IDs of the user and their friends as a JSON array, for use with json_each."""
+    return json.dumps(sorted(friend_graph.friends_of(user_id) | {user_id}))
@@ -0,0 +1,16 @@
+// Suggests usernames for every input with a data-autocomplete-url attribute, through its datalist.
+document.querySelectorAll("input[data-autocomplete-url]").forEach((input) => {
+  const list = document.getElementById(input.getAttribute("list"));
+  let timer;
+  input.addEventListener("input", () => {
+    clearTimeout(timer);
+    timer = setTimeout(async () => {
+      const url = `${input.dataset.autocompleteUrl}?q=${encodeURIComponent(input.value)}`;
+      const response = await fetch(url, { credentials: "same-origin" });
+      if (!response.ok) return;
+      list.replaceChildren(
+        ...(await response.json()).map((username) => Object.assign(document.createElement("option"), { value: username }))
+      );
+    }, 150);
+  });
+});
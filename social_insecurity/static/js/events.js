@@ -0,0 +1,16 @@
+// Shows live updates from the server-sent event stream of the page's user.
+(() => {
+  const source = new EventSource(document.currentScript.dataset.eventsUrl);
+  const banner = document.getElementById("live-update");
+  const badge = document.getElementById("friend-request-badge");
+  let requests = 0;
+
+  source.addEventListener("post", () => (banner.hidden = false));
+  source.addEventListener("comment", () => (banner.hidden = false));
+  source.addEventListener("friend_request", () => {
+    badge.textContent = ++requests;
+    badge.hidden = false;
+  });
+  // Events were missed while disconnected, so the page may be out of date
+  source.addEventListener("reset", () => (banner.hidden = false));
+})();
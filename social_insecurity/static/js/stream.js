@@ -0,0 +1,29 @@
+// Appends the next page of posts below the stream, rather than loading the whole page again.
+document.querySelectorAll("a[data-more-url]").forEach((link) => {
+  link.addEventListener("click", async (event) => {
+    event.preventDefault();
+    if (link.classList.contains("disabled")) return;
+    link.classList.add("disabled");
+    const response = await fetch(link.dataset.moreUrl, { credentials: "same-origin" });
+    if (!response.ok) {
+      // The full page load still works
+      window.location.assign(link.href);
+      return;
+    }
+    const container = document.getElementById("load-more");
+    container.insertAdjacentHTML("beforebegin", await response.text());
+    const cursor = response.headers.get("X-Next-Cursor");
+    if (!cursor) {
+      container.remove();
+      return;
+    }
+    const withCursor = (url) => {
+      const next = new URL(url, window.location.href);
+      next.searchParams.set("cursor", cursor);
+      return next.pathname + next.search;
+    };
+    link.href = withCursor(link.href);
+    link.dataset.moreUrl = withCursor(link.dataset.moreUrl);
+    link.classList.remove("disabled");
+  });
+});
@@ -0,0 +1,181 @@
+"""Provides storage of uploaded images for the Social Insecurity application.
+
+Uploads are stored under the SHA-256 of their content, e.g. ``<64 hex digits>.png``.
+A name therefore always refers to the same bytes, which lets the ``uploads`` route
+serve such files as immutable with a strong ETag, and makes identical uploads share
+one file instead of overwriting each other.
+
+An upload is copied in fixed-size chunks to a temporary file in the upload folder while
+it is hashed, so memory use does not depend on its size. Its type is taken from its
+first bytes rather than from its name, and the copy stops as soon as it exceeds
+``UPLOADS_MAX_SIZE``. The ``Uploads`` table counts the posts referring to each stored
+file, and `prune_uploads` deletes the files that are no longer referred to. A file is
+only put in place, and only deleted, in a transaction that changes its row, so that a
+new post cannot refer to a file that is being pruned.
+
+Example:
+    from social_insecurity.uploads import store_upload
+
+    with store_upload(form.image.data) as filename:
+        post_id = create_post(current_user.id, form.content.data, filename)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+from collections.abc import Iterator
+from contextlib import contextmanager
+from mimetypes import guess_type
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Optional
+
+from flask import current_app
+from werkzeug.datastructures import FileStorage
+
+from social_insecurity.cache import TTLCache
+
+
+class UploadRejected(ValueError):
+    """Raised when an upload is not an allowed image or is too large."""
+
+
+_CHUNK_SIZE = 64 * 1024
+
+# <sha256>.<ext>, or <sha256>_<width>w.<ext> for the resized variants written by social_insecurity.images
+_CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{64}(_\d+w)?\.[a-z0-9]+$")
+
+# Leading bytes of each image format, and the extension it is stored with
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+)
+
+# Mime types of existing uploads; only files that exist are cached, as they never change
+_mimetypes = TTLCache(maxsize=4096, ttl=3600.0)
+
+
+def get_upload_folder() -> Path:
+    """Returns the folder uploads are stored in."""
+    return Path(current_app.instance_path) / current_app.config["UPLOADS_FOLDER_PATH"]
+
+
+@contextmanager
+def store_upload(file: FileStorage) -> Iterator[str]:
+    """Stores an uploaded image under the hash of its content, unless it is already stored, and yields its name.
+
+    The block is a database transaction, in which the post referring to the upload must be inserted; the
+    ``UploadsRefInsert`` trigger then counts the reference. The file is only put in place while that
+    transaction holds the write lock, so `prune_uploads` cannot delete it in between, and a missing file
+    is recreated. If the block raises, a file it put in place is deleted again.
+
+    Raises UploadRejected, before the block runs, if the upload is not an allowed image or larger than
+    ``UPLOADS_MAX_SIZE``.
+    """
+    from social_insecurity import sqlite
+
+    upload_folder = get_upload_folder()
+    upload_folder.mkdir(parents=True, exist_ok=True)
+    max_size = current_app.config["UPLOADS_MAX_SIZE"]
+    digest = hashlib.sha256()
+    extension, size = None, 0
+
+    # The upload is received and hashed before the transaction, so a slow one does not hold the write lock
+    with NamedTemporaryFile(dir=upload_folder, prefix=".upload-", delete=False) as temp:
+        try:
+            for chunk in iter(lambda: file.stream.read(_CHUNK_SIZE), b""):
+                if extension is None:
+                    extension = sniff_extension(chunk)
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadRejected(f"Images may be at most {max_size // (1024 * 1024)} MB.")
+                digest.update(chunk)
+                temp.write(chunk)
+            if extension is None:
+                raise UploadRejected("File type not allowed.")
+        except BaseException:
+            temp.close()
+            os.unlink(temp.name)
+            raise
+
+    filename = f"{digest.hexdigest()}.{extension}"
+    path = upload_folder / filename
+    try:
+        with sqlite.transaction():
+            # Every stored file has a row, so that it is pruned even if no post ends up referring to it
+            sqlite.write("INSERT INTO Uploads (filename) VALUES (?) ON CONFLICT (filename) DO NOTHING;", (filename,))
+            created = not path.exists()
+            if created:
+                os.replace(temp.name, path)  # Atomic, so readers never see a partially written upload
+            try:
+                yield filename
+            except BaseException:
+                if created:
+                    path.unlink(missing_ok=True)
+                raise
+    finally:
+        if os.path.exists(temp.name):
+            os.unlink(temp.name)
+
+
+def sniff_extension(head: bytes) -> str:
+    """Returns the extension of the image format the data starts with, raising UploadRejected if it is not allowed."""
+    allowed = current_app.config["ALLOWED_EXTENSIONS"]
+    for signature, extension in _SIGNATURES:
+        if head.startswith(signature) and extension in allowed:
+            return extension
+    raise UploadRejected("File type not allowed.")
+
+
+def prune_uploads() -> int:
+    """Deletes stored uploads, and their resized variants, that no post refers to any more; returns how many.
+
+    The files are moved aside while the transaction deleting their rows holds the write lock, so a post
+    storing the same content again afterwards recreates the file, and are deleted once it has committed.
+    """
+    from social_insecurity import sqlite
+
+    upload_folder = get_upload_folder()
+    moved: list[tuple[Path, Path]] = []
+    try:
+        with sqlite.transaction():
+            unused = sqlite.read("DELETE FROM Uploads WHERE refcount <= 0 RETURNING filename;", primary=True)
+            for row in unused:
+                path = upload_folder / row["filename"]
+                for variant in [path, *upload_folder.glob(f"{path.stem}_*w{path.suffix}")]:
+                    if variant.exists():
+                        pruned = variant.with_name(f".pruned-{variant.name}")
+                        os.replace(variant, pruned)
+                        moved.append((variant, pruned))
+                    _mimetypes.delete(variant)
+    except BaseException:
+        # The rows are still there, so their files must be too
+        for variant, pruned in moved:
+            os.replace(pruned, variant)
+        raise
+    for _, pruned in moved:
+        pruned.unlink(missing_ok=True)
+    return len(unused)
+
+
+def is_content_addressed(filename: str) -> bool:
+    """Returns whether the upload is named after its content, and may therefore be cached forever."""
+    return _CONTENT_ADDRESSED.match(filename) is not None
+
+
+def describe_upload(path: Path) -> Optional[str]:
+    """Returns the mime type of an upload, an empty string if it is unknown, or None if the file does not exist."""
+    mime_type = _mimetypes.get(path)
+    if mime_type is None:
+        if not path.is_file():
+            return None
+        mime_type = guess_type(path.name)[0] or ""
+        _mimetypes.set(path, mime_type)
+    return mime_type
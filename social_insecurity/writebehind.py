@@ -0,0 +1,249 @@
+"""Provides a write-behind queue for inserts that a request does not need to wait for.
+
+Routes hand new comments and friend requests to `WriteBehind.submit` instead of writing
+them with a commit of their own. A writer thread takes them off a bounded queue, waits
+up to ``WRITE_BEHIND_DELAY`` seconds for more, and commits up to ``WRITE_BEHIND_BATCH_SIZE``
+of them in one transaction, with one ``executemany`` per run of the same statement. A
+burst of small writes then takes the database write lock once per batch rather than
+once per request, and request threads never wait for it.
+
+Until its batch commits, a queued write can be shown back to its author from the
+pending overlay, see `WriteBehind.pending`, and the author's next requests read from
+the primary rather than from a read replica, see `SQLite3.mark_written`. Callbacks
+given to `submit`, such as publishing an event, run on the writer thread after the
+commit. When the queue holds ``WRITE_BEHIND_QUEUE_SIZE`` writes, further ones are
+written by the request itself, as they are when ``WRITE_BEHIND`` is off, which is the
+default. Queued writes are flushed when the process exits; like the overlay, the queue
+is per process.
+
+Example:
+    from social_insecurity import writebehind
+
+    writebehind.submit(
+        queries["insert_comment"],
+        (post_id, current_user.id, text),
+        key=("comments", post_id),
+        author_id=current_user.id,
+        row={"username": current_user.username, "comment": text},
+    )
+    pending = writebehind.pending(("comments", post_id), current_user.id)
+"""
+
+from __future__ import annotations
+
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable, Hashable
+from itertools import groupby
+from typing import Any, NamedTuple, Optional
+
+from flask import Flask, has_request_context
+
+from social_insecurity.database import SQLite3
+
+logger = logging.getLogger(__name__)
+
+
+class PendingWrite(NamedTuple):
+    """A queued statement, the overlay row it is shown as and the callback to run once it commits."""
+
+    query: str
+    params: tuple
+    key: Optional[Hashable]
+    author_id: Optional[int]
+    row: Optional[dict[str, Any]]
+    on_commit: Optional[Callable[[], None]]
+
+
+class WriteBehind:
+    """Provides a write-behind extension for Flask, batching queued inserts on a writer thread."""
+
+    def __init__(self, app: Optional[Flask] = None) -> None:
+        """Initializes the extension."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """Initializes the extension; the SQLite3 extension must be initialized first.
+
+        The writer thread is only started on first use.
+        """
+        if "writebehind" in app.extensions:
+            raise RuntimeError("Flask write-behind extension already initialized")
+        app.extensions["writebehind"] = self
+
+        self._app = app
+        self._db: SQLite3 = app.extensions["sqlite3"]
+        self.enabled = app.config.get("WRITE_BEHIND", False)
+        self.capacity = app.config.get("WRITE_BEHIND_QUEUE_SIZE", 1000)
+        self.batch_size = app.config.get("WRITE_BEHIND_BATCH_SIZE", 500)
+        self.delay = app.config.get("WRITE_BEHIND_DELAY", 0.01)
+        self.stats: Counter[str] = Counter()
+        self._lock = threading.Lock()
+        self._atexit = False
+        self._reset()
+
+    def submit(
+        self,
+        query: str,
+        params: tuple = (),
+        *,
+        key: Optional[Hashable] = None,
+        author_id: Optional[int] = None,
+        row: Optional[dict[str, Any]] = None,
+        on_commit: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """Queues a statement for the writer thread, or runs it right away if queueing is off or the queue is full.
+
+        Until it commits, `row` is returned by `pending` for `key` and `author_id`.
+        """
+        write = PendingWrite(query, params, key, author_id, row, on_commit)
+        if self.enabled and self._start():
+            if has_request_context():
+                # The author's next requests must not read from a replica that predates the write
+                self._db.mark_written()
+            if key is not None:
+                with self._lock:
+                    self._pending.setdefault(key, []).append(write)
+            try:
+                self._queue.put_nowait(write)
+                self._count("queued")
+                return
+            except queue.Full:
+                self._forget([write])
+                self._count("fallbacks")
+        self._write_now(write)
+
+    def pending(self, key: Hashable, author_id: Optional[int] = None) -> list[dict[str, Any]]:
+        """Returns the overlay rows of the queued writes under a key, of one author only if given, oldest first."""
+        with self._lock:
+            writes = list(self._pending.get(key, ()))
+        return [write.row for write in writes if author_id is None or write.author_id == author_id]
+
+    def flush(self) -> None:
+        """Waits until every write queued so far has been committed, or dropped if it failed."""
+        if self._pid == os.getpid():
+            self._queue.join()
+
+    def shutdown(self, timeout: float = 10.0) -> None:
+        """Commits the queued writes and stops the writer thread, if it was started."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and self._pid == os.getpid():
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def _start(self) -> bool:
+        """Starts the writer thread if it is not running yet, and returns whether writes can be queued."""
+        if self._pid != os.getpid():
+            # Queued writes belong to the parent process, so a forked child starts over with an empty queue
+            self._reset()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+                if not self._atexit:
+                    atexit.register(self.shutdown)
+                    self._atexit = True
+            return self._thread.is_alive()
+
+    def _reset(self) -> None:
+        """Replaces the queue and the overlay with empty ones."""
+        self._pid = os.getpid()
+        self._queue: queue.Queue[Optional[PendingWrite]] = queue.Queue(maxsize=self.capacity)
+        self._pending: dict[Hashable, list[PendingWrite]] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        """Commits batches of queued writes until the stop marker is taken off the queue."""
+        stopping = False
+        while not stopping:
+            write = self._queue.get()
+            if write is None:
+                self._queue.task_done()
+                return
+            batch = [write]
+            # Wait a little for more writes to share the transaction, but never past the batch size
+            deadline = time.monotonic() + self.delay
+            while len(batch) < self.batch_size:
+                try:
+                    write = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if write is None:
+                    stopping = True
+                    self._queue.task_done()
+                    break
+                batch.append(write)
+            try:
+                self._commit(batch)
+            except Exception:
+                logger.exception("Could not commit %d queued writes", len(batch))
+                self._forget(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _commit(self, batch: list[PendingWrite]) -> None:
+        """Writes a batch in one transaction, falling back to one write at a time if it fails."""
+        with self._app.app_context():
+            try:
+                with self._db.transaction():
+                    # Consecutive writes of the same statement share an executemany, keeping the order of the queue
+                    for query, writes in groupby(batch, key=lambda write: write.query):
+                        self._db.write_many(query, [write.params for write in writes])
+                committed = batch
+                self._count("batches")
+            except sqlite3.Error:
+                # One bad row must not lose the rest of the batch
+                logger.warning("Queued batch of %d writes failed, retrying them one at a time", len(batch))
+                committed = []
+                for write in batch:
+                    try:
+                        self._db.write(write.query, write.params)
+                        committed.append(write)
+                    except sqlite3.Error:
+                        logger.exception("Dropped a queued write: %s", write.query)
+                        self._count("dropped")
+            self._count("written", len(committed))
+            self._forget(batch)
+            for write in committed:
+                self._notify(write)
+
+    def _write_now(self, write: PendingWrite) -> None:
+        """Runs a write in the calling app context, and its callback once it has committed."""
+        self._db.write(write.query, write.params)
+        self._count("written")
+        self._notify(write)
+
+    def _forget(self, writes: list[PendingWrite]) -> None:
+        """Removes writes from the pending overlay."""
+        with self._lock:
+            for write in writes:
+                if write.key in self._pending:
+                    remaining = [other for other in self._pending[write.key] if other is not write]
+                    if remaining:
+                        self._pending[write.key] = remaining
+                    else:
+                        del self._pending[write.key]
+
+    def _count(self, name: str, n: int = 1) -> None:
+        """Adds to one of the counters in `stats`, which request threads and the writer thread both update."""
+        with self._lock:
+            self.stats[name] += n
+
+    @staticmethod
+    def _notify(write: PendingWrite) -> None:
+        """Runs the callback of a committed write, logging rather than raising its errors."""
+        if write.on_commit is None:
+            return
+        try:
+            write.on_commit()
+        except Exception:
+            logger.exception("Callback of a committed write failed")
@@ -0,0 +1,199 @@
+"""Fixtures of the route benchmarks, which only run with ``pytest --benchmark``.
+
+Every benchmark runs against a file database seeded by `social_insecurity.dataset.generate`,
+at each size in ``--benchmark-sizes``; the database grows from one size to the next. Each route is requested ``--benchmark-rounds``
+times after a warm-up request, and its p50/p95/p99 latency, the number of statements a
+request runs and the memory it allocates are recorded. The results are compared with
+``baseline.json``: a guarded route that runs more statements than before, or whose p95
+is slower than the baseline by more than ``--benchmark-tolerance`` and ``--benchmark-slack``,
+fails. The baseline was measured on one machine; save your own before comparing on another.
+``--benchmark-save`` replaces the baseline with the results of the run.
+
+Example:
+    pytest tests/benchmarks --benchmark --benchmark-sizes=1000,10000
+"""
+
+from __future__ import annotations
+
+import json
+import re
+import statistics
+import time
+import tracemalloc
+from collections.abc import Callable, Iterator
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+import pytest
+
+from social_insecurity import create_app, sqlite
+from social_insecurity.dataset import generate
+
+if TYPE_CHECKING:
+    from flask import Flask
+    from flask.testing import FlaskClient
+    from werkzeug.test import TestResponse
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+PASSWORD = "Benchmark123!"
+
+_results: dict[str, dict[str, Any]] = {}
+
+
+class Dataset(NamedTuple):
+    """A seeded app, and the busiest user and post in it."""
+
+    app: Flask
+    users: int
+    user_id: int
+    username: str
+    post_id: int
+    post_username: str
+    password: str
+
+
+class Result(NamedTuple):
+    """The measurements of one route at one dataset size."""
+
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    queries: int
+    alloc_kib: float
+
+
+def pytest_generate_tests(metafunc: pytest.Metafunc) -> None:
+    if "dataset" in metafunc.fixturenames:
+        sizes = sorted(int(size) for size in metafunc.config.getoption("benchmark_sizes").split(","))
+        metafunc.parametrize("dataset", sizes, indirect=True, scope="session", ids=[f"{n}users" for n in sizes])
+
+
+@pytest.fixture(scope="session")
+def benchmark_app(tmp_path_factory: pytest.TempPathFactory) -> Iterator[Flask]:
+    # The routes are registered on the first app created in a process, so every size shares this one
+    app = create_app(
+        {
+            "SQLITE3_DATABASE_PATH": str(tmp_path_factory.mktemp("benchmark") / "benchmark.db"),
+            "SQLITE3_PROFILE": True,  # Counts the statements of each request in its Server-Timing header
+            "SQLITE3_SLOW_QUERY_MS": float("inf"),
+            "TESTING": True,
+            "WTF_CSRF_ENABLED": False,
+            "RATELIMIT_ENABLED": False,
+            "BCRYPT_LOG_ROUNDS": 4,
+            "PASSWORD_HASH_WORKERS": 0,
+        }
+    )
+    yield app
+
+
+@pytest.fixture(scope="session")
+def dataset(request: pytest.FixtureRequest, benchmark_app: Flask) -> Dataset:
+    """Grows the benchmark database to the requested number of users; sizes run smallest first."""
+    users = request.param
+    with benchmark_app.app_context():
+        seeded = sqlite.read("SELECT COUNT(*) FROM Users;", one=True)[0]
+        if users > seeded:
+            generate(
+                users - seeded, posts_per_user=10, comments_per_post=3, friends_per_user=20, password=PASSWORD, seed=users
+            )
+        # The user with the most friends has the most expensive feed and friends page
+        user = sqlite.read(
+            """
+            SELECT u.id, u.username FROM Friends AS f JOIN Users AS u ON u.id = f.u_id
+            GROUP BY f.u_id ORDER BY COUNT(*) DESC, u.id LIMIT 1;
+            """,
+            one=True,
+        )
+        post = sqlite.read(
+            """
+            SELECT p.id, u.username FROM Posts AS p JOIN Users AS u ON u.id = p.u_id
+            ORDER BY p.comment_count DESC, p.id LIMIT 1;
+            """,
+            one=True,
+        )
+    return Dataset(benchmark_app, users, user["id"], user["username"], post["id"], post["username"], PASSWORD)
+
+
+@pytest.fixture()
+def client(dataset: Dataset) -> FlaskClient:
+    client = dataset.app.test_client()
+    # Flask-Talisman redirects plain HTTP requests to HTTPS
+    client.environ_base["HTTP_X_FORWARDED_PROTO"] = "https"
+    with client.session_transaction() as session:
+        session["_user_id"] = str(dataset.user_id)
+    return client
+
+
+@pytest.fixture()
+def benchmark(request: pytest.FixtureRequest, dataset: Dataset) -> Callable[..., Result]:
+    """Returns a function that measures a request, records the result and compares it with the baseline."""
+    rounds = request.config.getoption("benchmark_rounds")
+    tolerance = request.config.getoption("benchmark_tolerance")
+    slack = request.config.getoption("benchmark_slack")
+
+    def _benchmark(name: str, send: Callable[[], TestResponse], guarded: bool = False) -> Result:
+        assert send().status_code < 400  # Warms up the caches, and fails early on a broken route
+        latencies = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            response = send()
+            latencies.append((time.perf_counter() - start) * 1000)
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            send()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        result = Result(
+            p50_ms=round(quantiles[49], 3),
+            p95_ms=round(quantiles[94], 3),
+            p99_ms=round(quantiles[98], 3),
+            queries=_query_count(response),
+            alloc_kib=round((peak - before) / 1024, 1),
+        )
+        key = f"{name}[{dataset.users}]"
+        _results[key] = result._asdict()
+
+        baseline = _load_baseline().get(key)
+        if guarded and baseline and not request.config.getoption("benchmark_save"):
+            assert result.queries <= baseline["queries"], f"{key} runs {result.queries} statements, was {baseline['queries']}"
+            # Timer noise alone can add a good fraction to a route that takes a millisecond or two
+            limit = max(baseline["p95_ms"] * (1 + tolerance), baseline["p95_ms"] + slack)
+            assert result.p95_ms <= limit, f"{key} p95 is {result.p95_ms} ms, over {limit:.3f} ms"
+        return result
+
+    return _benchmark
+
+
+def pytest_terminal_summary(terminalreporter: Any, config: pytest.Config) -> None:
+    if not _results:
+        return
+    baseline = _load_baseline()
+    terminalreporter.section("route benchmarks")
+    terminalreporter.write_line(
+        f"{'route':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}{'alloc KiB':>11}{'p95 vs base':>13}"
+    )
+    for key, result in sorted(_results.items()):
+        base = baseline.get(key)
+        change = f"{result['p95_ms'] / base['p95_ms'] - 1:+.0%}" if base and base["p95_ms"] else "new"
+        terminalreporter.write_line(
+            f"{key:<28}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+            f"{result['queries']:>9}{result['alloc_kib']:>11.1f}{change:>13}"
+        )
+    if config.getoption("benchmark_save"):
+        BASELINE_PATH.write_text(json.dumps({**baseline, **_results}, indent=2, sort_keys=True) + "\n")
+        terminalreporter.write_line(f"Saved the results as the baseline in {BASELINE_PATH}")
+
+
+def _load_baseline() -> dict[str, dict[str, Any]]:
+    if not BASELINE_PATH.exists():
+        return {}
+    return json.loads(BASELINE_PATH.read_text())
+
+
+def _query_count(response: TestResponse) -> int:
+    match = re.search(r'desc="(\d+) queries"', response.headers.get("Server-Timing", ""))
+    return int(match.group(1)) if match else 0
@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Callable
+
+if TYPE_CHECKING:
+    from flask.testing import FlaskClient
+
+    from tests.benchmarks.conftest import Dataset, Result
+
+
+def test_stream(benchmark: Callable[..., Result], client: FlaskClient):
+    benchmark("stream", lambda: client.get("/stream"), guarded=True)
+
+
+def test_stream_next_page(benchmark: Callable[..., Result], client: FlaskClient):
+    cursor = client.get("/stream/more").headers["X-Next-Cursor"]
+    benchmark("stream_more", lambda: client.get(f"/stream/more?cursor={cursor}"), guarded=True)
+
+
+def test_comments(benchmark: Callable[..., Result], client: FlaskClient, dataset: Dataset):
+    benchmark("comments", lambda: client.get(f"/comments/{dataset.post_username}/{dataset.post_id}"))
+
+
+def test_friends(benchmark: Callable[..., Result], client: FlaskClient):
+    benchmark("friends", lambda: client.get("/friends"), guarded=True)
+
+
+def test_api_feed(benchmark: Callable[..., Result], client: FlaskClient):
+    benchmark("api_feed", lambda: client.get("/api/v1/feed"), guarded=True)
+
+
+def test_login(benchmark: Callable[..., Result], dataset: Dataset):
+    def log_in():
+        # A new client every time, as a logged in one is redirected before the form is read
+        client = dataset.app.test_client()
+        client.environ_base["HTTP_X_FORWARDED_PROTO"] = "https"
+        data = {"login-username": dataset.username, "login-password": dataset.password, "login-submit": "Sign In"}
+        response = client.post("/", data=data)
+        assert response.headers["Location"].endswith("/stream")
+        return response
+
+    benchmark("login", log_in)
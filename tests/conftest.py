@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+from collections.abc import Callable, Iterator
+from itertools import count
+from typing import TYPE_CHECKING
+
+import pytest
+
+from social_insecurity import create_app, sqlite
+
+if TYPE_CHECKING:
+    from flask import Flask
+    from flask.testing import FlaskClient
+
+_user_ids = count()
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    group = parser.getgroup("benchmark", "route benchmarks in tests/benchmarks")
+    group.addoption("--benchmark", action="store_true", help="Run only the route benchmarks.")
+    group.addoption("--benchmark-sizes", default="1000,5000", help="Comma separated numbers of users to seed.")
+    group.addoption("--benchmark-rounds", type=int, default=50, help="Timed requests per route and size.")
+    group.addoption(
+        "--benchmark-tolerance", type=float, default=0.5, help="Allowed p95 slowdown over the baseline, as a fraction."
+    )
+    group.addoption(
+        "--benchmark-slack", type=float, default=1.0, help="Allowed p95 slowdown in milliseconds, for the fastest routes."
+    )
+    group.addoption("--benchmark-save", action="store_true", help="Store the results as the new baseline.")
+
+
+def pytest_collection_modifyitems(config: pytest.Config, items: list[pytest.Item]) -> None:
+    """Runs the benchmarks only with --benchmark, and then nothing else."""
+    benchmark = config.getoption("benchmark")
+    skip = pytest.mark.skip(reason="benchmarks only run with --benchmark")
+    if benchmark:
+        config.hook.pytest_deselected(items=[item for item in items if "benchmarks" not in item.path.parts])
+        items[:] = [item for item in items if "benchmarks" in item.path.parts]
+        return
+    for item in items:
+        if "benchmarks" in item.path.parts:
+            item.add_marker(skip)
+
+
+@pytest.fixture(scope="session")
+def app() -> Iterator[Flask]:
+    test_config = {
+        "SQLITE3_DATABASE_PATH": "file::memory:?cache=shared",
+        "TESTING": True,
+        "WTF_CSRF_ENABLED": False,
+        "RATELIMIT_ENABLED": False,
+        "BCRYPT_LOG_ROUNDS": 4,
+        "PASSWORD_HASH_WORKERS": 0,
+    }
+    app = create_app(test_config)
+    yield app
+
+
+@pytest.fixture()
+def client(app: Flask) -> FlaskClient:
+    client = app.test_client()
+    # Flask-Talisman redirects plain HTTP requests to HTTPS
+    client.environ_base["HTTP_X_FORWARDED_PROTO"] = "https"
+    return client
+
+
+@pytest.fixture()
+def make_user(app: Flask) -> Callable[..., int]:
+    """Returns a factory that inserts a uniquely named user and returns its id."""
+
+    def _make_user(prefix: str = "user") -> int:
+        with app.app_context():
+            sqlite.query(
+                "INSERT INTO Users (username, password) VALUES (?, ?);", (f"{prefix}{next(_user_ids)}", "password")
+            )
+            return sqlite.query("SELECT MAX(id) FROM Users;", one=True)[0]
+
+    return _make_user
+
+
+@pytest.fixture()
+def login(client: FlaskClient) -> Callable[[int], None]:
+    """Returns a function that logs the test client in as the given user."""
+
+    def _login(user_id: int) -> None:
+        with client.session_transaction() as session:
+            session["_user_id"] = str(user_id)
+
+    return _login
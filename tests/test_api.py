@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from social_insecurity import friend_graph, sqlite
+from social_insecurity.feed import create_post
+
+if TYPE_CHECKING:
+    from flask import Flask
+    from flask.testing import FlaskClient
+
+
+def test_api_requires_login(client: FlaskClient):
+    response = client.get("/api/v1/feed")
+    assert response.status_code == 401
+    assert "error" in response.json
+
+
+def test_feed_is_paginated_with_field_selection(client: FlaskClient, app: Flask, make_user, login):
+    me = make_user()
+    login(me)
+    with app.app_context():
+        post_ids = [create_post(me, f"API post {n}") for n in range(3)]
+
+    response = client.get("/api/v1/feed?limit=2&fields=id,content")
+    assert response.status_code == 200
+    assert response.json["data"] == [
+        {"id": post_ids[2], "content": "API post 2"},
+        {"id": post_ids[1], "content": "API post 1"},
+    ]
+    cursor = response.json["next_cursor"]
+    response = client.get(f"/api/v1/feed?limit=2&fields=id&cursor={cursor}")
+    assert response.json == {"data": [{"id": post_ids[0]}], "next_cursor": None}
+
+    assert client.get("/api/v1/feed?fields=id,password").status_code == 400
+    assert client.get("/api/v1/feed?cursor=nonsense").status_code == 400
+
+
+def test_unchanged_resources_are_not_modified(client: FlaskClient, app: Flask, make_user, login):
+    me, friend = make_user(), make_user()
+    login(me)
+    with app.app_context():
+        with sqlite.transaction():
+            friend_graph.add_friendship(me, friend)
+        post_id = create_post(friend, "Conditional")
+
+    for url in ("/api/v1/feed", f"/api/v1/posts/{post_id}/comments", "/api/v1/friends", "/api/v1/friend-requests"):
+        response = client.get(url)
+        assert response.status_code == 200, url
+        etag = response.headers["ETag"]
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 304, url
+
+    # A new comment changes both the comment list and the feed page showing the post's count
+    feed_etag = client.get("/api/v1/feed").headers["ETag"]
+    comments_etag = client.get(f"/api/v1/posts/{post_id}/comments").headers["ETag"]
+    with app.app_context():
+        sqlite.write("INSERT INTO Comments (p_id, u_id, comment) VALUES (?, ?, ?);", (post_id, me, "Changed"))
+    assert client.get("/api/v1/feed", headers={"If-None-Match": feed_etag}).status_code == 200
+    response = client.get(f"/api/v1/posts/{post_id}/comments", headers={"If-None-Match": comments_etag})
+    assert response.status_code == 200
+    assert [comment["comment"] for comment in response.json["data"]] == ["Changed"]
+
+
+def test_comments_of_strangers_are_hidden(client: FlaskClient, app: Flask, make_user, login):
+    me, stranger = make_user(), make_user()
+    login(me)
+    with app.app_context():
+        post_id = create_post(stranger, "Private")
+    assert client.get(f"/api/v1/posts/{post_id}/comments").status_code == 404
+
+
+def test_friends_and_friend_requests(client: FlaskClient, app: Flask, make_user, login):
+    me, first, second, sender = make_user(), make_user(), make_user(), make_user()
+    login(me)
+    with app.app_context():
+        with sqlite.transaction():
+            friend_graph.add_friendship(me, first)
+            friend_graph.add_friendship(me, second)
+        sqlite.write("INSERT INTO FriendRequests (from_user_id, to_user_id) VALUES (?, ?);", (sender, me))
+
+    response = client.get("/api/v1/friends?limit=1&fields=id")
+    assert response.json == {"data": [{"id": first}], "next_cursor": str(first)}
+    response = client.get(f"/api/v1/friends?limit=1&fields=id&cursor={first}")
+    assert response.json == {"data": [{"id": second}], "next_cursor": None}
+
+    response = client.get("/api/v1/friend-requests?fields=from_user_id")
+    assert response.json == {"data": [{"from_user_id": sender}], "next_cursor": None}
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import re
+from typing import TYPE_CHECKING
+
+import pytest
+
+from social_insecurity import queries, sqlite
+from social_insecurity.comments import get_comment_previews, get_comments, get_post_with_comments
+from social_insecurity.feed import create_post, get_feed_page
+
+if TYPE_CHECKING:
+    from flask import Flask
+    from flask.testing import FlaskClient
+
+
+def _comment(post_id: int, author_id: int, comment: str, creation_time: str = "2024-01-01 12:00:00") -> int:
+    return sqlite.write(
+        "INSERT INTO Comments (p_id, u_id, comment, creation_time) VALUES (?, ?, ?, ?);",
+        (post_id, author_id, comment, creation_time),
+    )
+
+
+def test_comment_pages_cover_every_comment_once(app: Flask, make_user):
+    me = make_user()
+    with app.app_context():
+        post_id = create_post(me, "Busy post")
+        # Comments sharing a timestamp are ordered by id, so none are skipped between pages
+        expected = [_comment(post_id, me, f"comment {i}") for i in range(7)]
+
+        seen, cursor = [], None
+        while True:
+            page = get_post_with_comments(post_id, cursor=cursor, limit=3)
+            assert page.post["id"] == post_id and page.post["content"] == "Busy post"
+            seen.extend(comment["id"] for comment in page.comments)
+            if page.next_cursor is None:
+                break
+            cursor = page.next_cursor
+
+        rows, next_cursor = get_comments(post_id, limit=4)
+        assert [row["id"] for row in rows] == sorted(expected, reverse=True)[:4]
+        rows, _ = get_comments(post_id, cursor=next_cursor, limit=4)
+        assert [row["id"] for row in rows] == sorted(expected, reverse=True)[4:]
+
+    assert seen == sorted(expected, reverse=True)
+
+
+def test_post_without_comments(app: Flask, make_user):
+    me = make_user()
+    with app.app_context():
+        post_id = create_post(me, "Quiet post")
+        page = get_post_with_comments(post_id)
+        assert page.post["id"] == post_id and page.comments == [] and page.next_cursor is None
+        assert get_post_with_comments(post_id + 1000) is None
+
+
+def test_previews_hold_the_newest_comments_of_each_post(app: Flask, make_user):
+    me = make_user()
+    with app.app_context():
+        busy, quiet, silent = create_post(me, "busy"), create_post(me, "quiet"), create_post(me, "silent")
+        for i in range(4):
+            _comment(busy, me, f"busy {i}", f"2024-01-0{i + 1} 12:00:00")
+        _comment(quiet, me, "only one")
+
+        previews = get_comment_previews(get_feed_page(me, limit=10).posts, limit=2)
+
+    assert [row["comment"] for row in previews[busy]] == ["busy 3", "busy 2"]
+    assert [row["comment"] for row in previews[quiet]] == ["only one"]
+    assert silent not in previews
+
+
+def test_comment_queries_read_the_index_in_order(app: Flask):
+    with app.app_context():
+        for name, params in (
+            ("get_post_with_comments", (1, 21)),
+            ("get_comments_next_page", (1, "2024-01-01 12:00:00", 1, 21)),
+            ("get_comment_previews", ("[1, 2]", 2)),
+        ):
+            plan = [row["detail"] for row in sqlite.read(f"EXPLAIN QUERY PLAN {queries[name]}", params)]
+            assert any("INDEX CommentsByPostTime" in step for step in plan), plan
+            # "SCAN c LEFT-JOIN" only reads back the materialized page of the combined query
+            assert not any(step in ("SCAN c", "SCAN Comments") for step in plan), plan
+
+
+def test_comments_page_is_paginated(client: FlaskClient, app: Flask, make_user, login):
+    me = make_user()
+    login(me)
+    app.config["COMMENTS_PAGE_SIZE"] = 2
+    try:
+        with app.app_context():
+            post_id = create_post(me, "Paginated")
+            username = sqlite.get_user_by_id(me)["username"]
+            for i in range(3):
+                _comment(post_id, me, f"Comment number {i}", f"2024-01-0{i + 1} 12:00:00")
+
+        first = client.get(f"/comments/{username}/{post_id}").data
+        assert b"Comment number 2" in first and b"Comment number 0" not in first
+        cursor = re.search(rb"cursor=([\w-]+)", first).group(1).decode()
+        older = client.get(f"/comments/{username}/{post_id}?cursor={cursor}").data
+        assert b"Comment number 0" in older and b"Comment number 2" not in older
+    finally:
+        app.config["COMMENTS_PAGE_SIZE"] = 20
+
+    assert client.get(f"/comments/{username}/{post_id}?cursor=not-a-cursor").status_code == 400
+    assert client.get(f"/comments/{username}/{post_id + 1000}").status_code == 404
+    wrong_author = client.get(f"/comments/nobody/{post_id}")
+    assert wrong_author.status_code == 302 and f"/comments/{username}/{post_id}" in wrong_author.headers["Location"]
+
+
+def test_comments_on_missing_posts_are_refused(client: FlaskClient, app: Flask, make_user, login):
+    me = make_user()
+    login(me)
+    with app.app_context():
+        missing = sqlite.read("SELECT COALESCE(MAX(id), 0) + 1000 FROM Posts;", one=True)[0]
+    response = client.post(f"/comments/nobody/{missing}", data={"comment": "Into the void"})
+    assert response.status_code == 404
+    with app.app_context():
+        assert sqlite.read("SELECT COUNT(*) FROM Comments WHERE p_id = ?;", (missing,), one=True)[0] == 0
+
+
+@pytest.mark.parametrize("previews, shown", [(2, True), (0, False)])
+def test_stream_shows_comment_previews(client: FlaskClient, app: Flask, make_user, login, previews, shown):
+    me = make_user()
+    login(me)
+    app.config["COMMENT_PREVIEWS"] = previews
+    try:
+        with app.app_context():
+            post_id = create_post(me, f"Previewed {previews}")
+            _comment(post_id, me, f"Preview of {previews}")
+        assert (f"Preview of {previews}".encode() in client.get("/stream").data) is shown
+    finally:
+        app.config["COMMENT_PREVIEWS"] = 2
@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+
+import pytest
+from flask import Flask, session
+
+from social_insecurity.config import Config
+from social_insecurity.database import ConnectionPool, PoolTimeout, SQLite3
+
+
+def _make_app(**config) -> tuple[Flask, SQLite3]:
+    app = Flask(__name__)
+    app.config.update(SQLITE3_DATABASE_PATH=":memory:", **config)
+    db = SQLite3(app)
+    return app, db
+
+
+def test_connections_are_reused_across_app_contexts():
+    app, db = _make_app()
+    with app.app_context():
+        first = db.connection
+    with app.app_context():
+        assert db.connection is first
+
+
+def test_in_memory_database_is_shared_by_pooled_connections():
+    app, db = _make_app()
+    with app.app_context():
+        db.query("CREATE TABLE Things (name VARCHAR);")
+        db.query("INSERT INTO Things (name) VALUES ('shared');")
+        other = db._pool.acquire()
+        try:
+            assert other is not db.connection
+            assert other.execute("SELECT name FROM Things;").fetchone()[0] == "shared"
+        finally:
+            db._pool.release(other)
+
+
+def test_pool_is_bounded():
+    pool = ConnectionPool(":memory:", size=1, timeout=0.01)
+    conn = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+
+
+def test_unhealthy_connections_are_replaced():
+    pool = ConnectionPool(":memory:", ping_interval=0)
+    conn = pool.acquire()
+    pool.release(conn)
+    conn.close()
+    replacement = pool.acquire()
+    assert replacement is not conn
+    assert replacement.execute("SELECT 1;").fetchone()[0] == 1
+
+
+def test_pragmas_are_applied_to_new_connections():
+    app, db = _make_app(SQLITE3_PRAGMAS={"foreign_keys": "ON"})
+    with app.app_context():
+        assert db.query("PRAGMA foreign_keys;", one=True)[0] == 1
+
+
+def test_transaction_commits_all_writes_at_once():
+    app, db = _make_app()
+    with app.app_context():
+        db.write("CREATE TABLE Things (name VARCHAR);")
+        with db.transaction():
+            db.write("INSERT INTO Things (name) VALUES ('first');")
+            db.write_many("INSERT INTO Things (name) VALUES (?);", [("second",), ("third",)])
+            assert db.connection.in_transaction
+        assert not db.connection.in_transaction
+        assert db.read("SELECT COUNT(*) FROM Things;", one=True)[0] == 3
+
+
+def test_transaction_rolls_back_on_error():
+    app, db = _make_app()
+    with app.app_context():
+        db.write("CREATE TABLE Things (name VARCHAR);")
+        with pytest.raises(ZeroDivisionError):
+            with db.transaction():
+                db.write("INSERT INTO Things (name) VALUES ('lost');")
+                1 / 0
+        assert db.read("SELECT COUNT(*) FROM Things;", one=True)[0] == 0
+
+
+def test_pragma_profile_enables_wal(tmp_path):
+    app = Flask(__name__, instance_path=str(tmp_path))
+    app.config.from_object(Config)
+    db = SQLite3(app)
+    with app.app_context():
+        assert db.read("PRAGMA journal_mode;", one=True)[0] == "wal"
+        assert db.read("PRAGMA busy_timeout;", one=True)[0] == 5000
+        db.write("CREATE TABLE Things (name VARCHAR);")
+        db.write("INSERT INTO Things (name) VALUES ('checkpointed');")
+        busy, log, checkpointed = db.checkpoint()
+        assert busy == 0 and log == checkpointed
+        db.optimize()
+
+
+def test_users_are_cached_until_invalidated():
+    app, db = _make_app()
+    with app.app_context():
+        db.write("CREATE TABLE Users (id INTEGER PRIMARY KEY, username VARCHAR, education VARCHAR);")
+        user_id = db.write("INSERT INTO Users (username, education) VALUES ('cached', 'Unknown');")
+        assert db.get_user_by_id(user_id)["education"] == "Unknown"
+    with app.app_context():
+        db.write("UPDATE Users SET education = 'Master' WHERE id = ?;", (user_id,))
+        assert db.get_user_by_username("cached")["education"] == "Unknown"
+        db.invalidate_user(user_id)
+        assert db.get_user_by_username("cached")["education"] == "Master"
+
+
+def test_missing_users_are_only_memoized_per_request():
+    app, db = _make_app()
+    with app.app_context():
+        db.write("CREATE TABLE Users (id INTEGER PRIMARY KEY, username VARCHAR);")
+        assert db.get_user_by_username("newcomer") is None
+        db.write("INSERT INTO Users (username) VALUES ('newcomer');")
+        assert db.get_user_by_username("newcomer") is None
+        db.invalidate_user(username="newcomer")
+        assert db.get_user_by_username("newcomer") is not None
+    with app.app_context():
+        assert db.get_user_by_username("newcomer") is not None
+
+
+def test_profiler_reports_timing_slow_and_repeated_queries(caplog):
+    app, db = _make_app(SQLITE3_PROFILE=True, SQLITE3_SLOW_QUERY_MS=0.0, SQLITE3_REPEATED_QUERY_LIMIT=3)
+
+    @app.route("/things")
+    def things():
+        db.write("CREATE TABLE IF NOT EXISTS Things (id INTEGER PRIMARY KEY, name VARCHAR);")
+        db.write_many("INSERT INTO Things (name) VALUES (?);", [("a",), ("b",), ("c",)])
+        for name in "abc":
+            db.read("SELECT id FROM Things WHERE name = ?;", (name,))
+        assert [stats.rows for stats in db.queries] == [-1, 3, 1, 1, 1]
+        return "ok"
+
+    with caplog.at_level("DEBUG", logger="social_insecurity.database"):
+        response = app.test_client().get("/things")
+
+    assert response.headers["Server-Timing"].startswith("db;dur=")
+    assert response.headers["Server-Timing"].endswith('desc="5 queries"')
+    records = [json.loads(record.getMessage()) for record in caplog.records]
+    slow = [record for record in records if record["event"] == "slow_query" and "WHERE name" in record["query"]]
+    assert slow and slow[0]["full_scan"] and slow[0]["plan"] == ["SCAN Things"]
+    summary = next(record for record in records if record["event"] == "request_queries")
+    assert summary["repeated"] == [{"query": "SELECT id FROM Things WHERE name = ?;", "count": 3}]
+
+
+def _make_replicated_app(tmp_path) -> tuple[Flask, SQLite3]:
+    app = Flask(__name__, instance_path=str(tmp_path))
+    app.config.from_object(Config)
+    app.config.update(SQLITE3_REPLICA_PATHS=("replica.db",), SQLITE3_REPLICA_SYNC_INTERVAL=0)
+    db = SQLite3(app)
+    with app.app_context():
+        db.write("CREATE TABLE Things (name VARCHAR);")
+        db.write("INSERT INTO Things (name) VALUES ('synced');")
+        assert db.sync_replicas() == 1
+        db.write("UPDATE Things SET name = 'written since';")
+    return app, db
+
+
+def test_requests_read_from_a_fresh_replica(tmp_path):
+    app, db = _make_replicated_app(tmp_path)
+    query = "SELECT name FROM Things;"
+    with app.test_request_context():
+        assert db.read(query, one=True)[0] == "synced"
+        assert db.read(query, one=True, primary=True)[0] == "written since"
+    with app.app_context():
+        # Outside of requests, everything reads from the primary
+        assert db.read(query, one=True)[0] == "written since"
+
+    with app.test_request_context():
+        db.write("INSERT INTO Things (name) VALUES ('mine');")
+        assert db.read("SELECT COUNT(*) FROM Things;", one=True)[0] == 2
+        # The user's next requests read from the primary too
+        primary_until = session["sqlite3_primary_until"]
+    with app.test_request_context():
+        session["sqlite3_primary_until"] = primary_until
+        assert db.read("SELECT COUNT(*) FROM Things;", one=True)[0] == 2
+
+    # A replica older than the maximum lag is skipped
+    stale = time.time() - app.config["SQLITE3_REPLICA_MAX_LAG"] - 1
+    os.utime(tmp_path / "replica.db", (stale, stale))
+    with app.test_request_context():
+        assert db.read("SELECT COUNT(*) FROM Things;", one=True)[0] == 2
+
+
+def test_replicas_are_replaced_while_in_use(tmp_path):
+    app, db = _make_replicated_app(tmp_path)
+    replica = db._replicas[0]
+    with app.test_request_context():
+        assert db.read("SELECT name FROM Things;", one=True)[0] == "synced"
+        generation = replica.generation
+        with app.app_context():
+            db.sync_replicas()
+        # The request keeps reading the copy it started with
+        assert db.read("SELECT name FROM Things;", one=True)[0] == "synced"
+    with app.test_request_context():
+        assert db.read("SELECT name FROM Things;", one=True)[0] == "written since"
+        assert replica.generation == generation + 1
+        assert db.read("PRAGMA journal_mode;", one=True)[0] == "delete"
+
+
+def test_replicas_need_a_database_file():
+    with pytest.raises(ValueError):
+        _make_app(SQLITE3_REPLICA_PATHS=("replica.db",))
+
+
+@pytest.mark.skipif(os.name != "posix", reason="Replica sync locks need fcntl")
+def test_one_process_at_a_time_syncs_the_replicas(tmp_path):
+    lock_path = tmp_path / "database.db.sync-lock"
+    # Each open file stands in for the lock file of one worker process
+    with open(lock_path, "a") as first, open(lock_path, "a") as second:
+        assert SQLite3._hold_sync_lock(first) and SQLite3._hold_sync_lock(first)
+        assert not SQLite3._hold_sync_lock(second)
+        first.close()
+        assert SQLite3._hold_sync_lock(second)
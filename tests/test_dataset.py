@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from social_insecurity import friend_graph, sqlite
+from social_insecurity.dataset import export_data, generate, import_data
+from social_insecurity.search import search_posts
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+    from flask import Flask
+
+
+def test_generated_data_survives_an_export_and_import(app: Flask, tmp_path: Path):
+    with app.app_context():
+        stats = generate(200, posts_per_user=3, comments_per_post=2, friends_per_user=6, seed=7)
+        assert stats.users == 200 and stats.posts == 600
+        hub = sqlite.read("SELECT u_id, COUNT(*) AS n FROM Friends GROUP BY u_id ORDER BY n DESC LIMIT 1;", one=True)
+        # Preferential attachment gives a few users far more friends than the average
+        assert hub["n"] > 3 * 6
+
+        before = {table: _rows(table) for table in ("Users", "Friends", "Posts", "Comments")}
+        counts = export_data(tmp_path / "dump.ndjson.gz")
+        assert counts["Posts"] == len(before["Posts"])
+        assert import_data(tmp_path / "dump.ndjson.gz") == counts
+        assert {table: _rows(table) for table in before} == before
+
+        # Indexes and triggers are back, and the derived data was rebuilt
+        indexes = {row["name"] for row in sqlite.read("SELECT name FROM sqlite_master WHERE type = 'index';")}
+        assert {"PostsByAuthorTime", "FriendRequestsByRecipient"} <= indexes
+        author = hub["u_id"]
+        friend_graph.invalidate(author)
+        assert search_posts(author, "the").results
+        comment_counts = sqlite.read(
+            "SELECT COUNT(*) FROM Posts AS p WHERE comment_count != (SELECT COUNT(*) FROM Comments WHERE p_id = p.id);",
+            one=True,
+        )[0]
+        assert comment_counts == 0
+
+
+def _rows(table: str) -> list[tuple]:
+    return [tuple(row) for row in sqlite.read(f"SELECT * FROM {table} ORDER BY rowid;")]
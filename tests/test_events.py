@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import threading
+from typing import TYPE_CHECKING
+
+from social_insecurity import events, sqlite
+from social_insecurity.events import EventHub
+
+if TYPE_CHECKING:
+    from flask import Flask
+    from flask.testing import FlaskClient
+
+
+def test_events_are_delivered_to_their_audience(app: Flask):
+    hub = EventHub()
+    app.extensions.pop("events")
+    try:
+        hub.init_app(app)
+    finally:
+        app.extensions["events"] = events
+    start = hub.last_id
+    hub.publish("post", {"id": 1}, audience={1, 2})
+    hub.publish("post", {"id": 2}, audience={3})
+
+    new_events, last_id = hub.since(2, start)
+    assert [event.data for event in new_events] == [{"id": 1}]
+    assert last_id == start + 2
+    assert hub.since(2, last_id) == ([], last_id)
+
+    # A waiting subscriber is woken by the next event for it, and skips the ones for others
+    threading.Timer(0.05, hub.publish, ("comment", {"post_id": 1}, {3})).start()
+    threading.Timer(0.1, hub.publish, ("comment", {"post_id": 1}, {2})).start()
+    new_events, last_id = hub.wait(2, last_id, timeout=5.0)
+    assert [event.type for event in new_events] == ["comment"]
+    assert hub.wait(2, last_id, timeout=0.01) == ([], last_id)
+
+
+def test_dropped_events_ask_for_a_reset(app: Flask):
+    hub = EventHub()
+    app.extensions.pop("events")
+    try:
+        app.config["EVENTS_BUFFER_SIZE"] = 2
+        hub.init_app(app)
+    finally:
+        app.config["EVENTS_BUFFER_SIZE"] = 1024
+        app.extensions["events"] = events
+    for n in range(3):
+        hub.publish("post", {"id": n}, audience={1})
+    assert hub.since(1, 0)[0] is None
+    assert len(hub.since(1, 1)[0]) == 2
+    assert hub.since(1, 99)[0] is None
+
+
+def test_friend_requests_are_published(client: FlaskClient, app: Flask, make_user, login):
+    me, friend = make_user(), make_user()
+    with app.app_context():
+        friend_username = sqlite.get_user_by_id(friend)["username"]
+    login(me)
+    since = client.get("/api/v1/events").json["last_id"]
+    client.post("/friends", data={"username": friend_username})
+
+    login(friend)
+    response = client.get(f"/api/v1/events?since={since}&timeout=0")
+    assert [event["type"] for event in response.json["events"]] == ["friend_request"]
+    assert response.json["reset"] is False
+
+    stream = client.get("/events", headers={"Last-Event-ID": str(since)}, buffered=False)
+    assert stream.mimetype == "text/event-stream"
+    chunks = stream.response
+    assert next(chunks).startswith(b"retry:")
+    assert b"event: friend_request" in next(chunks)
+    stream.close()
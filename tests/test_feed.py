@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import pytest
+
+from social_insecurity import friend_graph, sqlite
+from social_insecurity.feed import (
+    backfill_comment_counts,
+    backfill_timelines,
+    create_post,
+    decode_cursor,
+    encode_cursor,
+    get_feed_page,
+    rebuild_timelines,
+)
+
+if TYPE_CHECKING:
+    from flask import Flask
+    from flask.testing import FlaskClient
+
+
+def _post(author_id: int, content: str, creation_time: str = "2024-01-01 12:00:00") -> int:
+    sqlite.query(
+        "INSERT INTO Posts (u_id, content, creation_time) VALUES (?, ?, ?);", (author_id, content, creation_time)
+    )
+    return sqlite.query("SELECT MAX(id) FROM Posts;", one=True)[0]
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor("2024-01-01 12:00:00", 42)) == ("2024-01-01 12:00:00", 42)
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+
+def test_feed_pages_cover_friends_posts_once(app: Flask, make_user):
+    me, friend, stranger = make_user(), make_user(), make_user()
+    with app.app_context():
+        sqlite.query("INSERT INTO Friends (u_id, f_id) VALUES (?, ?);", (me, friend))
+        # Posts sharing a timestamp are ordered by id, so none are skipped between pages
+        expected = [_post(author, f"post {i}") for i, author in enumerate([me, friend] * 3)]
+        _post(stranger, "hidden")
+
+        seen, cursor = [], None
+        while True:
+            page = get_feed_page(me, cursor=cursor, limit=4)
+            seen.extend(post["id"] for post in page.posts)
+            if page.next_cursor is None:
+                break
+            cursor = page.next_cursor
+
+    assert seen == sorted(expected, reverse=True)
+
+
+def test_comment_count_is_maintained(app: Flask, make_user):
+    me = make_user()
+    with app.app_context():
+        post_id = _post(me, "commented")
+        for comment in ("first", "second"):
+            sqlite.query("INSERT INTO Comments (p_id, u_id, comment) VALUES (?, ?, ?);", (post_id, me, comment))
+        count = "SELECT comment_count FROM Posts WHERE id = ?;"
+        assert sqlite.query(count, (post_id,), one=True)[0] == 2
+
+        sqlite.query("UPDATE Posts SET comment_count = 0 WHERE id = ?;", (post_id,))
+        backfill_comment_counts()
+        assert sqlite.query(count, (post_id,), one=True)[0] == 2
+
+
+def test_backfill_adds_missing_post_columns(app: Flask, make_user):
+    me = make_user()
+    with app.app_context():
+        post_id = _post(me, "from an older database")
+        # Posts of a database created before image variants
+        sqlite.write("DROP TRIGGER PostsTouch;")
+        sqlite.write("ALTER TABLE Posts DROP COLUMN image_variants;")
+        backfill_comment_counts()
+        columns = {row["name"] for row in sqlite.read("PRAGMA table_info(Posts);")}
+        assert "image_variants" in columns
+        assert get_feed_page(me).posts[0]["id"] == post_id
+
+
+def test_push_mode_matches_pull_mode(app: Flask, make_user, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setitem(app.config, "FEED_MODE", "push")
+    me, friend, newcomer = make_user(), make_user(), make_user()
+    with app.app_context():
+        with sqlite.transaction():
+            friend_graph.add_friendship(me, friend)
+            backfill_timelines(me, friend)
+        for author in (me, friend, newcomer, friend):
+            create_post(author, f"post by {author}")
+
+        # The newcomer's earlier post is backfilled into my timeline when we become friends
+        with sqlite.transaction():
+            friend_graph.add_friendship(me, newcomer)
+            backfill_timelines(me, newcomer)
+
+        pushed = [post["id"] for post in get_feed_page(me, limit=2).posts]
+        cursor = get_feed_page(me, limit=2).next_cursor
+        pushed += [post["id"] for post in get_feed_page(me, cursor=cursor, limit=2).posts]
+        monkeypatch.setitem(app.config, "FEED_MODE", "pull")
+        pulled = [post["id"] for post in get_feed_page(me).posts]
+        assert pushed == pulled and len(pulled) == 4
+
+        monkeypatch.setitem(app.config, "FEED_MODE", "push")
+        rebuild_timelines()
+        assert [post["id"] for post in get_feed_page(me).posts] == pulled
+
+
+def test_push_mode_fans_out_to_friends_missing_from_the_cache(app: Flask, make_user, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setitem(app.config, "FEED_MODE", "push")
+    me, friend = make_user(), make_user()
+    with app.app_context():
+        assert friend_graph.friends_of(me) == frozenset()
+        # Another worker accepts the friendship, leaving this one's cache stale
+        sqlite.write_many("INSERT INTO Friends (u_id, f_id) VALUES (?, ?);", [(me, friend), (friend, me)])
+        post_id = create_post(me, "Fresh friends")
+        rows = sqlite.read("SELECT p_id FROM Timeline WHERE owner_id = ?;", (friend,))
+        friend_graph.invalidate(me, friend)
+    assert [row["p_id"] for row in rows] == [post_id]
+
+
+def test_rebuild_creates_missing_timelines(app: Flask, make_user):
+    me = make_user()
+    with app.app_context():
+        post_id = create_post(me, "Before timelines")
+        # A database created before push mode has no Timeline table
+        sqlite.write("DROP TABLE Timeline;")
+        rebuild_timelines()
+        rows = sqlite.read("SELECT p_id FROM Timeline WHERE owner_id = ?;", (me,))
+    assert [row["p_id"] for row in rows] == [post_id]
+
+
+def test_stream_more(client: FlaskClient, app: Flask, make_user, login):
+    me = make_user()
+    with app.app_context():
+        for i in range(app.config["FEED_PAGE_SIZE"] + 1):
+            _post(me, f"post {i}", f"2024-01-01 12:00:{i:02}")
+    login(me)
+
+    response = client.get("/stream")
+    assert response.status_code == 200
+    assert b"Load more" in response.data
+    assert b"data-more-url=" in response.data and b"js/stream.js" in response.data
+
+    with app.app_context():
+        first, second = get_feed_page(me, limit=1), get_feed_page(me, limit=2)
+    # The fragment leaves the page's own "Load more" link in place, and only moves its cursor on
+    app.config["FEED_PAGE_SIZE"], page_size = 1, app.config["FEED_PAGE_SIZE"]
+    try:
+        response = client.get(f"/stream/more?cursor={first.next_cursor}")
+    finally:
+        app.config["FEED_PAGE_SIZE"] = page_size
+    assert response.status_code == 200
+    assert b"Load more" not in response.data
+    assert response.headers["X-Next-Cursor"] == second.next_cursor
+
+    with app.app_context():
+        cursor = get_feed_page(me).next_cursor
+    response = client.get(f"/stream/more?cursor={cursor}")
+    assert response.status_code == 200
+    assert b"post 0" in response.data
+    assert "X-Next-Cursor" not in response.headers
+
+    assert client.get("/stream/more?cursor=bogus").status_code == 400
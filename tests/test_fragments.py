@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from flask import render_template_string
+
+from social_insecurity import fragments, sqlite
+from social_insecurity.feed import create_post
+
+if TYPE_CHECKING:
+    from flask import Flask
+    from flask.testing import FlaskClient
+
+TEMPLATE = '{% cache ("post", id, "test") %}<b>{{ value }}</b>{% endcache %}'
+
+
+def test_fragments_are_cached_until_evicted(app: Flask):
+    with app.test_request_context():
+        assert render_template_string(TEMPLATE, id=1, value="first") == "<b>first</b>"
+        assert render_template_string(TEMPLATE, id=1, value="second") == "<b>first</b>"
+        assert render_template_string(TEMPLATE, id=2, value="<i>") == "<b>&lt;i&gt;</b>"
+
+        assert fragments.evict("post", 1) == 1
+        assert render_template_string(TEMPLATE, id=1, value="second") == "<b>second</b>"
+
+
+def test_post_card_shows_new_comments(client: FlaskClient, app: Flask, make_user, login):
+    me = make_user()
+    login(me)
+    with app.app_context():
+        post_id = create_post(me, "Cached card")
+        username = sqlite.get_user_by_id(me)["username"]
+
+    assert b"Comments (0)" in client.get("/stream").data
+    client.post(f"/comments/{username}/{post_id}", data={"comment": "Fresh comment"})
+    assert b"Comments (1)" in client.get("/stream").data
+    assert b"Fresh comment" in client.get(f"/comments/{username}/{post_id}").data
+
+    # Another process would not evict its copy, but the changed updated_at gives the card a new key
+    with app.app_context():
+        sqlite.write("INSERT INTO Comments (p_id, u_id, comment) VALUES (?, ?, ?);", (post_id, me, "From elsewhere"))
+    assert b"Comments (2)" in client.get("/stream").data
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from social_insecurity import friend_graph, sqlite
+
+if TYPE_CHECKING:
+    from flask import Flask
+    from flask.testing import FlaskClient
+
+
+def _befriend(*pairs: tuple[int, int]) -> None:
+    with sqlite.transaction():
+        for user_id, friend_id in pairs:
+            friend_graph.add_friendship(user_id, friend_id)
+
+
+def test_friends_mutuals_and_suggestions(app: Flask, make_user):
+    me, alice, bob, carol, dave = (make_user() for _ in range(5))
+    with app.app_context():
+        _befriend((me, alice), (me, bob), (alice, carol), (bob, carol), (bob, dave))
+
+        assert friend_graph.friends_of(me) == {alice, bob}
+        assert friend_graph.friends_of_many([alice, bob]) == {alice: {me, carol}, bob: {me, carol, dave}}
+        assert friend_graph.mutual_friend_counts(me, [carol, dave]) == {carol: 2, dave: 1}
+        assert friend_graph.suggestions(me) == [(carol, 2), (dave, 1)]
+
+
+def test_cache_is_updated_only_after_commit(app: Flask, make_user):
+    me, friend, other = make_user(), make_user(), make_user()
+    with app.app_context():
+        assert friend_graph.friends_of(me) == frozenset()
+        with sqlite.transaction():
+            friend_graph.add_friendship(me, friend)
+            assert friend_graph.friends_of(me) == frozenset()
+        assert friend_graph.friends_of(me) == {friend}
+
+        try:
+            with sqlite.transaction():
+                friend_graph.add_friendship(me, other)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        assert friend_graph.friends_of(me) == {friend}
+
+
+def test_accepting_a_friend_request(client: FlaskClient, app: Flask, make_user, login):
+    me, requester = make_user(), make_user()
+    with app.app_context():
+        request_id = sqlite.write(
+            "INSERT INTO FriendRequests (from_user_id, to_user_id) VALUES (?, ?);", (requester, me)
+        )
+        assert friend_graph.friends_of(me) == frozenset()
+    login(me)
+
+    response = client.post("/handle_friend_request", data={"request_id": request_id, "action": "accept"})
+    assert response.status_code == 302
+    with app.app_context():
+        assert friend_graph.friends_of(me) == {requester}
+        assert friend_graph.friends_of(requester) == {me}
+        assert sqlite.read("SELECT * FROM FriendRequests WHERE id = ?;", (request_id,)) == []
+    assert client.get("/friends").status_code == 200
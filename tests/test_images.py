@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import pytest
+
+from social_insecurity import images, sqlite
+from social_insecurity.feed import create_post
+from social_insecurity.images import make_variants, srcset
+
+if TYPE_CHECKING:
+    from flask import Flask
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def _save_image(path: Path, width: int, height: int) -> Path:
+    Image.new("RGB", (width, height), "red").save(path)
+    return path
+
+
+def test_variants_are_only_made_for_smaller_widths(tmp_path: Path):
+    original = _save_image(tmp_path / "photo.png", 500, 250)
+    variants = make_variants(original, [320, 640])
+    assert variants == {"500": "photo.png", "320": "photo_320w.png"}
+    with Image.open(tmp_path / "photo_320w.png") as variant:
+        assert variant.size == (320, 160)
+
+
+def test_existing_variants_are_not_rewritten(tmp_path: Path):
+    original = _save_image(tmp_path / "photo.png", 500, 250)
+    make_variants(original, [320])
+    written = (tmp_path / "photo_320w.png").stat()
+    assert make_variants(original, [320]) == {"500": "photo.png", "320": "photo_320w.png"}
+    assert (tmp_path / "photo_320w.png").stat().st_ino == written.st_ino
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["photo.png", "photo_320w.png"]
+
+
+def test_variants_are_recorded_on_the_post(app: Flask, make_user):
+    upload_folder = Path(app.instance_path) / app.config["UPLOADS_FOLDER_PATH"]
+    _save_image(upload_folder / "test-variants.jpg", 800, 600)
+    with app.app_context():
+        post_id = create_post(make_user(), "with image", "test-variants.jpg")
+    images.submit(post_id, "test-variants.jpg").result()
+
+    with app.app_context():
+        variants = sqlite.read("SELECT image_variants FROM Posts WHERE id = ?;", (post_id,), one=True)[0]
+    assert json.loads(variants) == {"800": "test-variants.jpg", "320": "test-variants_320w.jpg", "640": "test-variants_640w.jpg"}
+    with app.test_request_context():
+        assert srcset(variants) == (
+            "/uploads/test-variants_320w.jpg 320w, /uploads/test-variants_640w.jpg 640w, /uploads/test-variants.jpg 800w"
+        )
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from social_insecurity.loadtest import hidden_fields, parse_page
+
+
+def test_forms_are_parsed_for_their_hidden_fields():
+    html = """
+      <input id="csrf_token" name="csrf_token" type="hidden" value="abc">
+      <input name="request_id" type="hidden" value="1"><input name="request_id" type="hidden" value="2">
+      <input name="content" type="text" value="ignored">
+      <a href="/comments/jane/7">Comments (0)</a>
+    """
+    assert hidden_fields(html) == {"csrf_token": "abc", "request_id": "1"}
+    assert parse_page(html).hidden["request_id"] == ["1", "2"]
+    assert parse_page(html).post_links == ["/comments/jane/7"]
+
+
+# The test app's shared-cache in-memory database locks whole tables and fails rather than waits on a
+# concurrent write, and the routes are bound to the first app of a process, so the virtual users run
+# against an app of their own on a file database, in a process of its own
+_LOADTEST_SCRIPT = """
+import json, sys
+from social_insecurity import create_app, passwords, sqlite
+from social_insecurity.loadtest import run
+
+app = create_app({
+    "SQLITE3_DATABASE_PATH": sys.argv[1],
+    "WTF_CSRF_ENABLED": False,
+    "RATELIMIT_ENABLED": False,
+    "RATELIMIT_STORAGE_URI": "memory://",
+    "BCRYPT_LOG_ROUNDS": 4,
+})
+usernames = ["loadtester1", "loadtester2"]
+with app.app_context():
+    pwhash = passwords.hash("Loadtest123!")
+    sqlite.write_many("INSERT INTO Users (username, password) VALUES (?, ?);", [(u, pwhash) for u in usernames])
+report = run(app, usernames, "Loadtest123!", virtual_users=4, duration=2.0, seed=1)
+print(json.dumps({
+    "logins": report.steps["POST / (login)"].statuses[302],
+    "streams": len(report.steps["GET /stream"].latencies),
+    "errors": sum(stats.errors for stats in report.steps.values()),
+    "exceptions": dict(report.exceptions),
+    "report": report.format(),
+}))
+"""
+
+
+def test_virtual_users_run_scenarios_against_a_local_server(tmp_path: Path):
+    pythonpath = os.pathsep.join(filter(None, [str(Path(__file__).parents[1]), os.environ.get("PYTHONPATH")]))
+    env = {**os.environ, "PYTHONPATH": pythonpath}
+    completed = subprocess.run(
+        [sys.executable, "-c", _LOADTEST_SCRIPT, str(tmp_path / "loadtest.db")],
+        capture_output=True,
+        text=True,
+        env=env,
+        timeout=60,
+        check=True,
+    )
+    result = json.loads(completed.stdout.splitlines()[-1])
+
+    assert result["logins"] == 4
+    assert result["streams"] > 0
+    assert result["errors"] == 0
+    assert not result["exceptions"]
+    assert "requests/s" in result["report"]
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import pytest
+from flask import Flask
+from werkzeug.security import generate_password_hash
+
+from social_insecurity import sqlite
+from social_insecurity.passwords import HasherBusy, PasswordHasher
+
+if TYPE_CHECKING:
+    from flask.testing import FlaskClient
+
+
+def _make_hasher(**config) -> PasswordHasher:
+    app = Flask(__name__)
+    app.config.update({"BCRYPT_LOG_ROUNDS": 4, **config})
+    return PasswordHasher(app)
+
+
+def test_hash_and_check_on_worker_process():
+    hasher = _make_hasher(PASSWORD_HASH_WORKERS=1)
+    try:
+        pwhash = hasher.hash("Password123!")
+        assert pwhash.startswith("$2b$04$")
+        assert hasher.check(pwhash, "Password123!")
+        assert not hasher.check(pwhash, "password123!")
+    finally:
+        hasher.shutdown()
+
+
+def test_legacy_hashes_are_accepted_and_flagged_for_rehash():
+    hasher = _make_hasher(PASSWORD_HASH_WORKERS=0)
+    legacy = generate_password_hash("Password123!")
+    assert hasher.check(legacy, "Password123!")
+    assert hasher.needs_rehash(legacy)
+    assert hasher.needs_rehash(_make_hasher(BCRYPT_LOG_ROUNDS=5, PASSWORD_HASH_WORKERS=0).hash("x"))
+    assert not hasher.needs_rehash(hasher.hash("x"))
+
+
+def test_full_queue_is_refused():
+    hasher = _make_hasher(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE_LIMIT=1)
+    hasher._slots.acquire()
+    with pytest.raises(HasherBusy):
+        hasher.hash("Password123!")
+
+
+def test_slow_hash_is_refused():
+    hasher = _make_hasher(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_TIMEOUT=0.001)
+    try:
+        # Starting the worker process alone takes longer than the timeout
+        with pytest.raises(HasherBusy):
+            hasher.hash("Password123!")
+    finally:
+        hasher.shutdown()
+
+
+def test_login_upgrades_legacy_hash(client: FlaskClient, app: Flask):
+    with app.app_context():
+        sqlite.write(
+            "INSERT INTO Users (username, password) VALUES (?, ?);",
+            ("legacy", generate_password_hash("Password123!")),
+        )
+    response = client.post(
+        "/index", data={"login-username": "legacy", "login-password": "Password123!", "login-submit": "Sign In"}
+    )
+    assert response.status_code == 302
+    with app.app_context():
+        assert sqlite.get_user_by_username("legacy")["password"].startswith("$2b$04$")
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import pytest
+from flask import Flask
+
+from social_insecurity import queries, sqlite
+from social_insecurity.database import SQLite3
+from social_insecurity.queries import InvalidQuery, QueryRegistry, count_parameters, parse_queries
+
+if TYPE_CHECKING:
+    from flask.testing import FlaskClient
+
+
+def test_queries_are_parsed_into_single_lines():
+    parsed = parse_queries(
+        """
+        -- name: first
+        SELECT *
+          FROM Users
+        WHERE id = ?;
+
+        -- name: second
+        -- A comment above the statement
+        DELETE FROM Users;
+        """
+    )
+    assert parsed == {"first": "SELECT * FROM Users WHERE id = ?;", "second": "DELETE FROM Users;"}
+    with pytest.raises(InvalidQuery, match="twice"):
+        parse_queries("-- name: a\nSELECT 1;\n-- name: a\nSELECT 2;")
+
+
+def test_parameters_are_counted_like_sqlite():
+    assert count_parameters("SELECT ?, ?;") == 2
+    assert count_parameters("SELECT ? WHERE x = ?2 OR y = ?3 LIMIT ?4;") == 4
+    assert count_parameters("SELECT '?', ? WHERE a = 'it''s ?';") == 1
+
+
+def test_invalid_queries_stop_the_app_from_starting(tmp_path):
+    (tmp_path / "queries.sql").write_text("-- name: ok\nSELECT 1;\n-- name: broken\nSELECT nope FROM Missing;\n")
+    app = Flask(__name__, root_path=str(tmp_path))
+    app.config.update(SQLITE3_DATABASE_PATH=":memory:")
+    SQLite3(app)
+    with pytest.raises(InvalidQuery, match="broken: no such table: Missing"):
+        QueryRegistry(app)
+
+
+def test_named_queries_hit_the_statement_cache(client: FlaskClient, app: Flask, make_user, login):
+    user = make_user()
+    login(user)
+    assert "get_friend_requests" in queries
+
+    client.get("/friends")
+    stats = sqlite.statement_cache_stats
+    hits, misses = stats.hits, stats.misses
+    client.get("/friends")
+    # The second request compiles nothing new on the connection it reuses
+    assert stats.hits > hits and stats.misses == misses
+    assert 0 < stats.hit_rate <= 1
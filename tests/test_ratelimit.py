@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from limits import RateLimitItemPerMinute
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter, SlidingWindowCounterRateLimiter
+
+from social_insecurity.ratelimit import SQLiteStorage
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+
+def test_counters_are_shared_between_storages(tmp_path: Path):
+    uri = f"sqlite:///{tmp_path / 'ratelimits.db'}"
+    first, second = storage_from_string(uri), storage_from_string(uri)
+    assert isinstance(first, SQLiteStorage)
+
+    assert first.incr("key", 60) == 1
+    assert second.incr("key", 60, amount=2) == 3
+    assert first.get("key") == 3
+    assert first.get_expiry("key") > 0
+
+    first.clear("key")
+    assert second.get("key") == 0
+
+
+def test_limits_are_enforced_across_workers(tmp_path: Path):
+    uri = f"sqlite:///{tmp_path / 'ratelimits.db'}"
+    limit = RateLimitItemPerMinute(3)
+    for strategy in (FixedWindowRateLimiter, SlidingWindowCounterRateLimiter):
+        workers = [strategy(storage_from_string(uri)), strategy(storage_from_string(uri))]
+        hits = [workers[n % 2].hit(limit, strategy.__name__) for n in range(5)]
+        assert hits == [True, True, True, False, False]
+
+
+def test_batched_increments_are_flushed(tmp_path: Path):
+    uri = f"sqlite:///{tmp_path / 'ratelimits.db'}"
+    batched = storage_from_string(uri, flush_interval=3600)
+    other = storage_from_string(uri)
+
+    assert batched.incr("key", 60) == 1
+    assert batched.incr("key", 60) == 2
+    assert other.get("key") == 0
+    batched.flush()
+    assert other.get("key") == 2
+    assert batched.get("key") == 2
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from social_insecurity import friend_graph, sqlite
+from social_insecurity.feed import create_post
+from social_insecurity.search import (
+    autocomplete_usernames,
+    search_comments,
+    search_posts,
+    search_users,
+    to_match_query,
+)
+
+if TYPE_CHECKING:
+    from flask import Flask
+    from flask.testing import FlaskClient
+
+
+def test_match_query_quotes_every_word():
+    assert to_match_query('cats AND "dogs" NEAR(x)') == '"cats" "and" "dogs" "near" "x"'
+    assert to_match_query("jane d", prefix=True) == '"jane" "d"*'
+    assert to_match_query(" *-- ") is None
+
+
+def test_posts_and_comments_are_searched_among_friends(app: Flask, make_user):
+    me, friend, stranger = make_user(), make_user(), make_user()
+    with app.app_context():
+        with sqlite.transaction():
+            friend_graph.add_friendship(me, friend)
+        mine = create_post(me, "Zebras crossing the savanna")
+        theirs = create_post(friend, "A zebra at the zoo, and zebras everywhere")
+        create_post(stranger, "Zebras are secretly horses")
+        sqlite.write("INSERT INTO Comments (p_id, u_id, comment) VALUES (?, ?, ?);", (mine, stranger, "Stripy zebras"))
+
+        assert {post["id"] for post in search_posts(me, "zebras").results} == {mine, theirs}
+        assert [post["id"] for post in search_posts(friend, "zebras crossing").results] == [mine]
+        assert search_posts(stranger, "savanna").results == []
+        assert [comment["p_id"] for comment in search_comments(friend, "stripy").results] == [mine]
+
+        # Edits are reindexed, and the old text no longer matches
+        sqlite.write("UPDATE Posts SET content = ? WHERE id = ?;", ("Giraffes crossing", mine))
+        assert [post["id"] for post in search_posts(me, "giraffes").results] == [mine]
+        assert search_posts(me, "savanna").results == []
+
+
+def test_search_pages_are_bounded(app: Flask, make_user):
+    me = make_user()
+    with app.app_context():
+        for n in range(app.config["SEARCH_PAGE_SIZE"] + 1):
+            create_post(me, f"Pagination test {n}")
+        first = search_posts(me, "pagination", page=1)
+        second = search_posts(me, "pagination", page=2)
+    assert first.has_next and not second.has_next
+    assert len(first.results) + len(second.results) == app.config["SEARCH_PAGE_SIZE"] + 1
+
+
+def test_usernames_are_autocompleted(client: FlaskClient, app: Flask, make_user, login):
+    user = make_user("autocompleteme")
+    with app.app_context():
+        assert [row["id"] for row in search_users("autocompleteme").results] == [user]
+        assert autocomplete_usernames("autocompl")[0].startswith("autocompleteme")
+        assert autocomplete_usernames("zzzz") == []
+
+    login(user)
+    response = client.get("/search/usernames?q=autocompl")
+    assert response.status_code == 200
+    assert response.json[0].startswith("autocompleteme")
+    assert client.get("/search?q=autocompl&type=users").status_code == 200
+    assert client.get("/search?q=x&type=secrets").status_code == 400
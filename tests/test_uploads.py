@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import hashlib
+import io
+from typing import TYPE_CHECKING
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from social_insecurity import sqlite
+from social_insecurity.feed import create_post
+from social_insecurity.uploads import get_upload_folder, prune_uploads, store_upload
+
+if TYPE_CHECKING:
+    from flask import Flask
+    from flask.testing import FlaskClient
+
+# A 1x1 transparent GIF
+GIF = b"GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;"
+
+
+def _upload(client: FlaskClient, name: str, data: bytes = GIF):
+    return client.post(
+        "/stream",
+        data={"content": "with image", "image": (io.BytesIO(data), name)},
+        content_type="multipart/form-data",
+    )
+
+
+def test_uploads_are_content_addressed_and_deduplicated(client: FlaskClient, app: Flask, make_user, login):
+    login(make_user())
+    assert _upload(client, "first.gif").status_code == 302
+    assert _upload(client, "second.gif").status_code == 302
+
+    with app.app_context():
+        images = sqlite.read("SELECT image FROM Posts ORDER BY id DESC LIMIT 2;")
+    assert [row["image"] for row in images] == [f"{hashlib.sha256(GIF).hexdigest()}.gif"] * 2
+
+
+def test_content_addressed_uploads_are_immutable(client: FlaskClient, make_user, login):
+    login(make_user())
+    _upload(client, "cached.gif")
+    filename = f"{hashlib.sha256(GIF).hexdigest()}.gif"
+
+    response = client.get(f"/uploads/{filename}")
+    assert response.status_code == 200
+    assert response.data == GIF
+    assert response.headers["ETag"] == f'"{filename[:-4]}"'
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == 31536000
+
+    response = client.get(f"/uploads/{filename}", headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+    assert response.data == b""
+
+    assert client.get(f"/uploads/{'0' * 64}.gif").status_code == 404
+
+
+def test_uploads_are_sniffed_by_content_and_size_capped(client: FlaskClient, app: Flask, make_user, login):
+    login(make_user())
+    with app.app_context():
+        count = sqlite.read("SELECT COUNT(*) FROM Posts;", one=True)[0]
+
+    # Neither a non-image with an image extension nor an image over UPLOADS_MAX_SIZE is stored
+    assert _upload(client, "fake.png", b"<?php echo 'hi'; ?>").status_code == 302
+    assert _upload(client, "large.gif", GIF + b"\x00" * app.config["UPLOADS_MAX_SIZE"]).status_code == 302
+
+    with app.app_context():
+        assert sqlite.read("SELECT COUNT(*) FROM Posts;", one=True)[0] == count
+        assert not list(get_upload_folder().glob(".upload-*"))
+
+
+def test_unreferenced_uploads_are_pruned(client: FlaskClient, app: Flask, make_user, login):
+    login(make_user())
+    data = GIF + b"prune"
+    filename = f"{hashlib.sha256(data).hexdigest()}.gif"
+    _upload(client, "one.gif", data)
+    _upload(client, "two.gif", data)
+
+    with app.app_context():
+        assert sqlite.read("SELECT refcount FROM Uploads WHERE filename = ?;", (filename,), one=True)[0] == 2
+        sqlite.write("DELETE FROM Posts WHERE image = ?;", (filename,))
+        assert prune_uploads() >= 1
+        assert sqlite.read("SELECT * FROM Uploads WHERE filename = ?;", (filename,), one=True) is None
+        assert not (get_upload_folder() / filename).exists()
+
+
+def test_pruned_uploads_are_recreated_when_posted_again(client: FlaskClient, app: Flask, make_user, login):
+    login(make_user())
+    data = GIF + b"again"
+    filename = f"{hashlib.sha256(data).hexdigest()}.gif"
+    _upload(client, "first.gif", data)
+
+    with app.app_context():
+        sqlite.write("DELETE FROM Posts WHERE image = ?;", (filename,))
+        prune_uploads()
+        assert not (get_upload_folder() / filename).exists()
+    _upload(client, "second.gif", data)
+
+    with app.app_context():
+        assert sqlite.read("SELECT refcount FROM Uploads WHERE filename = ?;", (filename,), one=True)[0] == 1
+        assert (get_upload_folder() / filename).read_bytes() == data
+        assert not list(get_upload_folder().glob(".pruned-*"))
+
+
+def test_upload_is_removed_when_its_post_fails(app: Flask, make_user):
+    me = make_user()
+    data = GIF + b"failed"
+    filename = f"{hashlib.sha256(data).hexdigest()}.gif"
+    with app.test_request_context():
+        with pytest.raises(RuntimeError):
+            with store_upload(FileStorage(io.BytesIO(data), "failed.gif")) as stored:
+                create_post(me, "never posted", stored)
+                raise RuntimeError("The post could not be stored")
+
+        assert not (get_upload_folder() / filename).exists()
+        assert not list(get_upload_folder().glob(".upload-*"))
+        assert sqlite.read("SELECT * FROM Uploads WHERE filename = ?;", (filename,), one=True) is None
+        assert sqlite.read("SELECT * FROM Posts WHERE image = ?;", (filename,), one=True) is None
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+from collections.abc import Iterator
+from typing import TYPE_CHECKING
+
+import pytest
+from flask import Flask, session
+
+from social_insecurity import sqlite, writebehind
+from social_insecurity.config import Config
+from social_insecurity.database import SQLite3
+from social_insecurity.feed import create_post
+from social_insecurity.writebehind import WriteBehind
+
+if TYPE_CHECKING:
+    from flask.testing import FlaskClient
+
+INSERT_COMMENT = "INSERT INTO Comments (p_id, u_id, comment) VALUES (?, ?, ?);"
+
+
+@pytest.fixture()
+def queued() -> Iterator[None]:
+    """Turns the write-behind queue on for one test, and commits whatever the test left queued."""
+    writebehind.enabled = True
+    try:
+        yield
+    finally:
+        writebehind.flush()
+        writebehind.enabled = False
+        writebehind.delay = 0.01
+
+
+def _comments(post_id: int) -> list[str]:
+    rows = sqlite.read("SELECT comment FROM Comments WHERE p_id = ? ORDER BY id;", (post_id,))
+    return [row["comment"] for row in rows]
+
+
+def test_writes_run_in_the_request_when_queueing_is_off(app: Flask, make_user):
+    me = make_user()
+    committed = []
+    with app.app_context():
+        post_id = create_post(me, "Synchronous")
+        writebehind.submit(
+            INSERT_COMMENT, (post_id, me, "now"), key=("comments", post_id), on_commit=lambda: committed.append(1)
+        )
+        assert _comments(post_id) == ["now"]
+    assert committed == [1]
+    assert writebehind.pending(("comments", post_id)) == []
+
+
+def test_queued_writes_are_batched_in_order(app: Flask, make_user, queued):
+    me = make_user()
+    committed = []
+    with app.app_context():
+        post_id = create_post(me, "Busy")
+    # Everything submitted while the writer waits shares its transaction
+    writebehind.delay = 0.5
+    batches = writebehind.stats["batches"]
+    with app.app_context():
+        for i in range(50):
+            writebehind.submit(INSERT_COMMENT, (post_id, me, f"comment {i}"), on_commit=lambda i=i: committed.append(i))
+    writebehind.flush()
+
+    with app.app_context():
+        assert _comments(post_id) == [f"comment {i}" for i in range(50)]
+    assert writebehind.stats["batches"] - batches == 1
+    assert committed == list(range(50))
+
+
+def test_pending_writes_are_shown_to_their_author(app: Flask, make_user, queued):
+    me, friend = make_user(), make_user()
+    with app.app_context():
+        post_id = create_post(me, "Pending")
+    writebehind.delay = 0.5
+    with app.app_context():
+        writebehind.submit(INSERT_COMMENT, (post_id, me, "mine"), key=("comments", post_id), author_id=me, row={"x": 1})
+        assert writebehind.pending(("comments", post_id), me) == [{"x": 1}]
+        assert writebehind.pending(("comments", post_id), friend) == []
+    writebehind.flush()
+
+    assert writebehind.pending(("comments", post_id), me) == []
+    with app.app_context():
+        assert _comments(post_id) == ["mine"]
+
+
+def test_a_failing_write_does_not_lose_its_batch(app: Flask, make_user, queued):
+    me, friend = make_user(), make_user()
+    writebehind.delay = 0.5
+    dropped = writebehind.stats["dropped"]
+    with app.app_context():
+        insert_friend = "INSERT INTO Friends (u_id, f_id) VALUES (?, ?);"
+        for pair in [(me, friend), (me, friend), (friend, me)]:  # The second breaks the primary key
+            writebehind.submit(insert_friend, pair)
+    writebehind.flush()
+
+    with app.app_context():
+        rows = sqlite.read("SELECT u_id, f_id FROM Friends WHERE u_id IN (?, ?);", (me, friend))
+    assert sorted(tuple(row) for row in rows) == sorted([(me, friend), (friend, me)])
+    assert writebehind.stats["dropped"] - dropped == 1
+
+
+def test_own_queued_comment_is_shown_before_it_commits(client: FlaskClient, app: Flask, make_user, login, queued):
+    me, friend = make_user(), make_user()
+    with app.app_context():
+        sqlite.write_many("INSERT INTO Friends (u_id, f_id) VALUES (?, ?);", [(me, friend), (friend, me)])
+        post_id = create_post(me, "Commented soon")
+        username = sqlite.get_user_by_id(me)["username"]
+    writebehind.delay = 0.5
+
+    login(me)
+    client.post(f"/comments/{username}/{post_id}", data={"comment": "Still in the queue"})
+    assert b"Still in the queue" in client.get(f"/comments/{username}/{post_id}").data
+    login(friend)
+    assert b"Still in the queue" not in client.get(f"/comments/{username}/{post_id}").data
+
+    writebehind.flush()
+    assert b"Still in the queue" in client.get(f"/comments/{username}/{post_id}").data
+
+
+def test_queued_writes_are_read_back_from_the_primary(tmp_path):
+    app = Flask(__name__, instance_path=str(tmp_path))
+    app.config.from_object(Config)
+    app.config.update(SQLITE3_REPLICA_PATHS=("replica.db",), SQLITE3_REPLICA_SYNC_INTERVAL=0, WRITE_BEHIND=True)
+    db, queue = SQLite3(app), WriteBehind(app)
+    with app.app_context():
+        db.write("CREATE TABLE Things (name VARCHAR);")
+        db.sync_replicas()
+
+    with app.test_request_context():
+        queue.submit("INSERT INTO Things (name) VALUES (?);", ("mine",))
+        primary_until = session["sqlite3_primary_until"]
+    queue.flush()
+    queue.shutdown()
+
+    # The author's next request must see the write, although the replica predates it
+    with app.test_request_context():
+        assert db.read("SELECT COUNT(*) FROM Things;", one=True)[0] == 0
+    with app.test_request_context():
+        session["sqlite3_primary_until"] = primary_until
+        assert db.read("SELECT COUNT(*) FROM Things;", one=True)[0] == 1